@@ -1,6 +1,7 @@
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 import dj_database_url
 from corsheaders.defaults import default_headers
 
@@ -33,7 +34,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'routes.authentication.RevocableJWTAuthentication',
     ),
 }
 
@@ -50,9 +51,19 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_REFRESH_SERIALIZER': 'routes.revocation.RevocableTokenRefreshSerializer',
 }
 
+# Revoked tokens are mirrored in memory; workers pull new revocations this often (seconds)
+TOKEN_REVOCATION_SYNC_INTERVAL = 5
+# Width of the expiry buckets revoked token ids are grouped in (seconds)
+TOKEN_REVOCATION_BUCKET_SECONDS = 3600
+
 MIDDLEWARE = [
+    # Outermost, so everything below logs with the request id and metrics cover the other middleware
+    'routes.request_id.RequestIDMiddleware',
+    'routes.metrics.MetricsMiddleware',
+    'routes.slow_queries.SlowQueryMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     # Must be right after SecurityMiddleware
@@ -104,6 +115,16 @@ CORS_ALLOW_HEADERS = list(default_headers) + [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
+    'if-none-match',
+    'x-request-id',
+]
+
+CORS_EXPOSE_HEADERS = [
+    'idempotent-replayed',
+    'etag',
+    'server-timing',
+    'x-request-id',
 ]
 
 # CSRF settings - Open for Capacitor.js frontend
@@ -176,6 +197,10 @@ else:
         }
     }
 
+AUTHENTICATION_BACKENDS = [
+    'routes.backends.ProfileModelBackend',
+]
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -199,6 +224,74 @@ CACHES = {
     }
 }
 
+# Keyset pagination of list endpoints (opt-in with ?page_size= or ?cursor=)
+PAGINATION_PAGE_SIZE = 100
+PAGINATION_MAX_PAGE_SIZE = 500
+
+# Longest date range, in days, a single report/ request may cover
+REPORT_MAX_DAYS = 31
+# Longest range an export/ stream may cover, and rows fetched per database round trip
+EXPORT_MAX_DAYS = 93
+EXPORT_CHUNK_SIZE = 2000
+
+# client-dashboard/ results are cached this long (seconds)
+CLIENT_DASHBOARD_CACHE_TIMEOUT = 30
+# A checkpoint scanned longer than this after the previous one (or the run start) counts as late
+CHECKPOINT_LATE_AFTER = timedelta(minutes=20)
+# Longest range segment-timings/ may analyse
+ANALYTICS_MAX_DAYS = 366
+
+# Background report files. start.sh runs run_report_worker next to gunicorn so both see this directory.
+REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR', os.path.join(BASE_DIR, 'report_jobs'))
+REPORT_JOB_TTL = timedelta(hours=24)
+REPORT_JOB_TIMEOUT = timedelta(minutes=30)
+REPORT_JOB_MAX_ATTEMPTS = 3
+REPORT_WORKER_POLL_INTERVAL = 2
+
+# How long a resolved request principal (role, client, frozen flag) is cached per worker;
+# invalidations reach other workers with the token revocation sync, this bounds anything missed
+PRINCIPAL_CACHE_TIMEOUT = 60
+
+# Per-endpoint metrics file mapped by every worker on the host (/api/metrics/)
+METRICS_FILE = os.environ.get('METRICS_FILE', os.path.join(tempfile.gettempdir(), 'route_monitor_metrics'))
+# Bearer token the Prometheus scraper sends to /api/metrics/; the endpoint refuses everyone while unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Queries slower than this are kept with their call site in the slow query log (/api/slow-queries/)
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+# Share of slow SELECTs that also get an EXPLAIN; ANALYZE (Postgres) runs the query a second time
+SLOW_QUERY_EXPLAIN_RATE = 0.1
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', 'false').lower() == 'true'
+# Entries kept in the shared ring buffer, newest replacing oldest
+SLOW_QUERY_LOG_SIZE = 500
+SLOW_QUERY_FILE = os.environ.get('SLOW_QUERY_FILE', os.path.join(tempfile.gettempdir(), 'route_monitor_slow_queries'))
+
+# Points METRICS_FILE and SLOW_QUERY_FILE at a directory of the test run's own
+TEST_RUNNER = 'routes.tests.runner.TestRunner'
+
+# Every record from the routes app carries the id of the request it was logged in; LOG_LEVEL=INFO for view traces
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'routes.request_id.RequestIDFilter'},
+    },
+    'formatters': {
+        'request': {'format': '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'filters': ['request_id'], 'formatter': 'request'},
+    },
+    'loggers': {
+        'routes': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'WARNING')},
+    },
+}
+
+# Idempotency-Key replay window for mobile write endpoints
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# In-flight keys older than this are treated as abandoned (above the gunicorn timeout)
+IDEMPOTENCY_KEY_LOCK_TIMEOUT = timedelta(minutes=3)
+
 # Internationalization
 LANGUAGE_CODE = 'es-pe'  # Spanish (Peru)
 TIME_ZONE = 'America/Lima'  # Peru's time zone
@@ -0,0 +1,96 @@
+"""
+Timing of route segments, the stretch between two consecutive scans of a run.
+
+A ``LAG`` window over each run's scans pairs every scan with the one before it,
+so the database returns one ``(route, from, to, run, gap)`` row per segment
+walked and Python never rebuilds runs. The gaps are grouped into ``array('d')``
+buffers per segment, sorted once and summarized with median, p90 and Tukey
+outliers (above Q3 + 1.5 IQR).
+"""
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import DurationField, ExpressionWrapper, F, Window
+from django.db.models.functions import Lag
+
+from .models import Checkpoint, CheckpointScan
+
+# Slowest outlier runs listed per segment
+SLOWEST_LIMIT = 5
+
+
+def _percentile(values, q):
+    """Linear-interpolated percentile of the sorted ``values``."""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def segment_gaps(client_id, start, end, route_id=None):
+    """``(route_id, from_checkpoint_id, to_checkpoint_id, run_id, gap)`` of the runs started in ``[start, end)``."""
+    by_run = {'partition_by': [F('route_run_id')], 'order_by': F('scanned_at').asc()}
+    scans = CheckpointScan.objects.filter(
+        route_run__assignment__route__client_id=client_id,
+        route_run__start_time__gte=start,
+        route_run__start_time__lt=end,
+    )
+    if route_id:
+        scans = scans.filter(checkpoint__route_id=route_id)
+    return scans.annotate(
+        from_checkpoint=Window(Lag('checkpoint_id'), **by_run),
+        gap=ExpressionWrapper(
+            F('scanned_at') - Window(Lag('scanned_at'), **by_run), output_field=DurationField()
+        ),
+    ).filter(from_checkpoint__isnull=False).values_list(
+        'checkpoint__route_id', 'from_checkpoint', 'checkpoint_id', 'route_run_id', 'gap'
+    )
+
+
+def summarize(gaps, run_ids):
+    order = sorted(range(len(gaps)), key=gaps.__getitem__)
+    values = [gaps[i] for i in order]
+    q1, q3 = _percentile(values, 0.25), _percentile(values, 0.75)
+    threshold = q3 + 1.5 * (q3 - q1)
+    outliers = [i for i in reversed(order) if gaps[i] > threshold]
+    return {
+        'count': len(values),
+        'min': values[0],
+        'median': _percentile(values, 0.5),
+        'p90': _percentile(values, 0.9),
+        'max': values[-1],
+        'mean': round(sum(values) / len(values), 1),
+        'outlier_threshold': round(threshold, 1),
+        'outliers': len(outliers),
+        'slowest': [{'route_run_id': run_ids[i], 'seconds': gaps[i]} for i in outliers[:SLOWEST_LIMIT]],
+    }
+
+
+def segment_timings(client_id, start, end, route_id=None):
+    """Per-route segment timing distributions in seconds, segments in checkpoint order."""
+    gaps = defaultdict(lambda: array('d'))
+    run_ids = defaultdict(lambda: array('q'))
+    rows = segment_gaps(client_id, start, end, route_id).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    for route, from_checkpoint, to_checkpoint, run_id, gap in rows:
+        key = (route, from_checkpoint, to_checkpoint)
+        gaps[key].append(gap.total_seconds())
+        run_ids[key].append(run_id)
+
+    checkpoint_ids = {checkpoint_id for key in gaps for checkpoint_id in key[1:]}
+    checkpoints = {
+        row['id']: row
+        for row in Checkpoint.objects.filter(id__in=checkpoint_ids).values('id', 'name', 'order', 'route__name')
+    }
+
+    routes = {}
+    for key in sorted(gaps, key=lambda key: (key[0], checkpoints[key[1]]['order'], checkpoints[key[2]]['order'])):
+        route, from_checkpoint, to_checkpoint = key
+        if route not in routes:
+            routes[route] = {'route_id': route, 'route_name': checkpoints[to_checkpoint]['route__name'], 'segments': []}
+        routes[route]['segments'].append({
+            'from': {field: checkpoints[from_checkpoint][field] for field in ('id', 'name', 'order')},
+            'to': {field: checkpoints[to_checkpoint][field] for field in ('id', 'name', 'order')},
+            **summarize(gaps[key], run_ids[key]),
+        })
+    return list(routes.values())
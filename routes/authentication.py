@@ -0,0 +1,77 @@
+"""
+JWT authentication classes.
+
+``RevocableJWTAuthentication`` is the default: simplejwt's authentication plus
+the in-memory revocation check. ``CustomTokenObtainPairSerializer`` already puts
+the role and ``client_id`` in the token, so read-heavy guard endpoints do not
+need the ``User`` row either; they opt in to ``ClaimsJWTAuthentication`` with
+``@authentication_classes(CLAIMS_AUTHENTICATION)``.
+"""
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .principal import load_principal
+from .revocation import store as revocation_store
+
+
+class RevocableJWTAuthentication(JWTAuthentication):
+    """Reject access tokens revoked individually or through their client."""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if revocation_store.is_revoked(validated_token.payload):
+            raise InvalidToken({
+                'detail': _('Token is blacklisted'),
+                'code': 'token_not_valid',
+            })
+        return validated_token
+
+
+class ClaimsUser(TokenUser):
+    """Stateless user backed by a validated token and the caller's cached principal.
+
+    Views reached through ``ClaimsJWTAuthentication`` must reference the caller
+    by ``request.user.id`` rather than passing ``request.user`` as a model.
+    """
+
+    def __init__(self, token, principal):
+        super().__init__(token)
+        self.principal = principal
+
+    @cached_property
+    def is_superuser(self):
+        return self.principal.role == 'superadmin'
+
+
+class ClaimsJWTAuthentication(RevocableJWTAuthentication):
+    """Build the user from the claims; revocation is checked against the cached principal.
+
+    Deleting or deactivating a user, or freezing a client, invalidates the
+    principal in every worker: at once in the one that made the change, and
+    at the next revocation sync (``TOKEN_REVOCATION_SYNC_INTERVAL``) in the
+    others. Deleted guards and frozen clients are cut off without a
+    per-request ``User`` query.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        principal = load_principal(user_id)
+        if not principal.is_authenticated:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not principal.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if principal.is_frozen:
+            raise AuthenticationFailed(_('Client account is frozen'), code='client_frozen')
+
+        return ClaimsUser(validated_token, principal)
+
+
+CLAIMS_AUTHENTICATION = [ClaimsJWTAuthentication]
@@ -0,0 +1,46 @@
+"""
+Per-worker index of route checkpoints used by the scan hot path.
+
+Each entry maps ``qr_code -> (checkpoint_id, order, name)`` for one route and is
+stamped with the route's ``updated_at``. Checkpoint and route signals drop the
+local entry and touch ``Route.updated_at``, so entries built by other gunicorn
+workers are detected as stale the next time the route row is read.
+"""
+import threading
+from collections import namedtuple
+
+from .models import Checkpoint
+
+IndexedCheckpoint = namedtuple('IndexedCheckpoint', ['id', 'order', 'name'])
+RouteIndex = namedtuple('RouteIndex', ['version', 'checkpoints', 'total'])
+
+_index = {}
+_lock = threading.Lock()
+
+
+def get_route_index(route):
+    """Return the index for ``route``, rebuilding it if missing or stale."""
+    entry = _index.get(route.id)
+    if entry is not None and entry.version == route.updated_at:
+        return entry
+
+    checkpoints = {
+        qr_code: IndexedCheckpoint(checkpoint_id, order, name)
+        for checkpoint_id, qr_code, order, name in Checkpoint.objects.filter(
+            route_id=route.id
+        ).values_list('id', 'qr_code', 'order', 'name')
+    }
+    entry = RouteIndex(route.updated_at, checkpoints, len(checkpoints))
+    with _lock:
+        _index[route.id] = entry
+    return entry
+
+
+def invalidate_route(route_id):
+    with _lock:
+        _index.pop(route_id, None)
+
+
+def clear():
+    with _lock:
+        _index.clear()
@@ -0,0 +1,102 @@
+"""
+ETag functions for conditional GETs of polled endpoints.
+
+Each function computes a version for what the view would return with one
+aggregate query over change timestamps (``Route.updated_at``,
+``GuardAssignment.updated_at``, ``DailyGuardStats.updated_at``) plus the
+active run's progress columns, so a scan changes the version without a second
+write, and is plugged
+in with Django's ``condition`` decorator below the DRF decorators, so an
+unchanged poll is answered with 304 after authentication but before the view's
+own queries and serializers run. The caller's role and client are part of every
+ETag since the same URL returns different data to different callers.
+
+Returning ``None`` skips conditional handling and lets the view answer, which
+is what happens for requests the view would reject.
+"""
+import hashlib
+
+from django.db.models import Count, FilteredRelation, Max, Q
+from django.contrib.auth.models import User
+
+from .models import Route, GuardAssignment
+from .principal import get_principal
+from .reports import ReportError, parse_report_date
+
+
+def _etag(request, *parts):
+    principal = get_principal(request)
+    key = repr((principal.role, principal.client_id, request.get_full_path()) + parts)
+    return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _aggregate_etag(request, queryset, *timestamp_fields, **aggregates):
+    versions = queryset.aggregate(
+        count=Count('id', distinct=True),
+        **{f'latest_{i}': Max(field) for i, field in enumerate(timestamp_fields)},
+        **aggregates,
+    )
+    return _etag(request, *versions.values())
+
+
+def _with_active_run(assignments):
+    # Joins through the partial unique index: at most one row per assignment
+    return assignments.annotate(
+        active_run=FilteredRelation('route_runs', condition=Q(route_runs__completed=False))
+    )
+
+
+def routes_etag(request, *args, **kwargs):
+    principal = get_principal(request)
+    if request.user.is_superuser:
+        routes = Route.objects.all()
+    elif principal.has_profile or principal.role == 'client':
+        routes = Route.objects.filter(client_id=principal.client_id)
+    else:
+        return None
+    return _aggregate_etag(request, routes, 'updated_at')
+
+
+def assignment_etag(request, *args, **kwargs):
+    if get_principal(request).is_frozen:
+        return None
+    version = _with_active_run(GuardAssignment.objects.filter(guard_id=request.user.id)).values_list(
+        'id', 'updated_at', 'route__updated_at',
+        'active_run__id', 'active_run__scanned_count', 'active_run__last_scan_at',
+    ).first()
+    return _etag(request, *version) if version else None
+
+
+def guard_assignments_etag(request, *args, **kwargs):
+    principal = get_principal(request)
+    if request.user.is_superuser:
+        assignments = GuardAssignment.objects.all()
+    elif (principal.is_admin or principal.role == 'client') and principal.client_id:
+        assignments = GuardAssignment.objects.filter(guard__userprofile__client_id=principal.client_id)
+    else:
+        return None
+    # Run ids only grow, so a started run raises the max and a finished one drops the count
+    return _aggregate_etag(
+        request, _with_active_run(assignments), 'updated_at', 'route__updated_at',
+        active_runs=Count('active_run'), latest_run=Max('active_run__id'),
+    )
+
+
+def daily_report_etag(request, *args, **kwargs):
+    guard_id = request.query_params.get('guard_id')
+    if not guard_id or not guard_id.isdigit():
+        return None
+    try:
+        date = parse_report_date(request.query_params.get('date'))
+    except ReportError:
+        return None
+
+    on_date = Q(daily_stats__date=date)
+    version = User.objects.filter(id=guard_id).values_list(
+        'username',
+        'userprofile__client__is_active',
+    ).annotate(
+        stats=Count('daily_stats', filter=on_date),
+        latest=Max('daily_stats__updated_at', filter=on_date),
+    ).order_by('id').first()
+    return _etag(request, date, *version) if version else None
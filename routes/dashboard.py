@@ -0,0 +1,125 @@
+"""
+Client KPI dashboard.
+
+Everything a client overview needs comes from a handful of aggregate queries:
+the ``DailyGuardStats`` rollup for the day's totals and per-guard rows, the
+open runs for live progress, the day's runs for missed checkpoints and a
+``LAG`` window over the day's scans for late ones. The result is cached for
+``CLIENT_DASHBOARD_CACHE_TIMEOUT`` seconds since dashboards poll it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum, Window
+from django.db.models.functions import Coalesce, Lag
+from django.utils import timezone
+
+from .models import CheckpointScan, DailyGuardStats, GuardAssignment, RouteRun
+from .reports import local_day_bounds
+
+CACHE_KEY = 'client-dashboard:{}:{}'
+
+
+def _ratio(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+def late_scans(client_id, start, end):
+    """Scans of the day taken more than ``CHECKPOINT_LATE_AFTER`` after the previous one.
+
+    The first checkpoint of a run is measured from the run's start.
+    """
+    gap = ExpressionWrapper(
+        F('scanned_at') - Coalesce(
+            Window(Lag('scanned_at'), partition_by=[F('route_run_id')], order_by=F('scanned_at').asc()),
+            F('route_run__start_time'),
+        ),
+        output_field=DurationField(),
+    )
+    return CheckpointScan.objects.filter(
+        route_run__assignment__route__client_id=client_id,
+        route_run__start_time__gte=start,
+        route_run__start_time__lt=end,
+    ).annotate(gap=gap).filter(gap__gt=settings.CHECKPOINT_LATE_AFTER).count()
+
+
+def build_dashboard(client_id, date):
+    start, end = local_day_bounds(date, date)
+    day_stats = DailyGuardStats.objects.filter(date=date, route__client_id=client_id)
+
+    totals = day_stats.aggregate(
+        active_guards=Count('guard', distinct=True, filter=Q(runs_started__gt=0)),
+        runs_started=Coalesce(Sum('runs_started'), 0),
+        runs_completed=Coalesce(Sum('runs_completed'), 0),
+        completed_duration=Sum('completed_duration'),
+        checkpoints_scanned=Coalesce(Sum('checkpoints_scanned'), 0),
+        checkpoints_expected=Coalesce(Sum('checkpoints_expected'), 0),
+        incidents=Coalesce(Sum('incidents'), 0),
+        occurrences=Coalesce(Sum('occurrences'), 0),
+    )
+    missed = RouteRun.objects.filter(
+        assignment__route__client_id=client_id, start_time__gte=start, start_time__lt=end, completed=True,
+    ).aggregate(missed=Coalesce(Sum(F('expected_total') - F('scanned_count')), 0))['missed']
+
+    stats_by_guard = {
+        row.pop('guard_id'): row
+        for row in day_stats.values('guard_id').annotate(
+            runs_started=Sum('runs_started'),
+            runs_completed=Sum('runs_completed'),
+            checkpoints_scanned=Sum('checkpoints_scanned'),
+            checkpoints_expected=Sum('checkpoints_expected'),
+            incidents=Sum('incidents'),
+            occurrences=Sum('occurrences'),
+        )
+    }
+    active_runs = {}
+    for row in RouteRun.objects.filter(completed=False, assignment__route__client_id=client_id).values(
+        'assignment__guard_id', 'id', 'start_time', 'scanned_count', 'expected_total', 'last_scan_at'
+    ):
+        for field in ('start_time', 'last_scan_at'):
+            row[field] = row[field] and timezone.localtime(row[field])
+        active_runs[row.pop('assignment__guard_id')] = row
+    assignments = GuardAssignment.objects.filter(
+        guard__userprofile__client_id=client_id
+    ).values('guard_id', 'guard__username', 'route_id', 'route__name', 'shift').order_by('guard__username')
+
+    average_duration = (
+        totals['completed_duration'] / totals['runs_completed'] if totals['runs_completed'] else None
+    )
+    return {
+        'client_id': client_id,
+        'date': date,
+        'guards_assigned': len(assignments),
+        'active_guards': totals['active_guards'],
+        'runs_in_progress': len(active_runs),
+        'runs_started': totals['runs_started'],
+        'runs_completed': totals['runs_completed'],
+        'completion_rate': _ratio(totals['runs_completed'], totals['runs_started']),
+        'average_run_duration': average_duration.total_seconds() if average_duration is not None else None,
+        'checkpoints_scanned': totals['checkpoints_scanned'],
+        'checkpoints_expected': totals['checkpoints_expected'],
+        'checkpoint_coverage': _ratio(totals['checkpoints_scanned'], totals['checkpoints_expected']),
+        'missed_checkpoints': missed,
+        'late_checkpoints': late_scans(client_id, start, end),
+        'incidents': totals['incidents'],
+        'occurrences': totals['occurrences'],
+        'guards': [
+            {
+                'id': row['guard_id'],
+                'username': row['guard__username'],
+                'route': {'id': row['route_id'], 'name': row['route__name']},
+                'shift': row['shift'],
+                'active_run': active_runs.get(row['guard_id']),
+                'today': stats_by_guard.get(row['guard_id']),
+            }
+            for row in assignments
+        ],
+    }
+
+
+def get_dashboard(client_id, date):
+    key = CACHE_KEY.format(client_id, date.isoformat())
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = build_dashboard(client_id, date)
+        cache.set(key, dashboard, settings.CLIENT_DASHBOARD_CACHE_TIMEOUT)
+    return dashboard
@@ -0,0 +1,145 @@
+"""
+Streaming CSV/NDJSON audit exports.
+
+Runs, checkpoint scans, incidents and occurrences of a client's date range are
+written one row at a time from ``values_list().iterator()`` querysets, one
+section after the other, so a worker holds at most ``EXPORT_CHUNK_SIZE`` rows
+of each query whatever the size of the export.
+"""
+import csv
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RouteRun, CheckpointScan, Incident, Occurrence
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Output columns and the lookup each record type reads them from
+SECTIONS = [
+    ('run', RouteRun, [
+        ('id', 'id'),
+        ('run_id', 'id'),
+        ('guard_id', 'assignment__guard_id'),
+        ('guard', 'assignment__guard__username'),
+        ('route', 'assignment__route__name'),
+        ('timestamp', 'start_time'),
+        ('end_time', 'end_time'),
+        ('completed', 'completed'),
+    ], 'start_time'),
+    ('scan', CheckpointScan, [
+        ('id', 'id'),
+        ('run_id', 'route_run_id'),
+        ('guard_id', 'route_run__assignment__guard_id'),
+        ('guard', 'route_run__assignment__guard__username'),
+        ('route', 'route_run__assignment__route__name'),
+        ('timestamp', 'scanned_at'),
+        ('checkpoint', 'checkpoint__name'),
+        ('checkpoint_order', 'checkpoint__order'),
+        ('qr_code', 'checkpoint__qr_code'),
+    ], 'scanned_at'),
+    ('incident', Incident, [
+        ('id', 'id'),
+        ('run_id', 'route_run_id'),
+        ('guard_id', 'guard_id'),
+        ('guard', 'guard__username'),
+        ('route', 'route_run__assignment__route__name'),
+        ('timestamp', 'timestamp'),
+        ('description', 'description'),
+    ], 'timestamp'),
+    ('occurrence', Occurrence, [
+        ('id', 'id'),
+        ('run_id', 'route_run_id'),
+        ('guard_id', 'route_run__assignment__guard_id'),
+        ('guard', 'route_run__assignment__guard__username'),
+        ('route', 'route_run__assignment__route__name'),
+        ('timestamp', 'timestamp'),
+        ('occurrence_type', 'occurrence_type'),
+        ('name', 'name'),
+        ('dni', 'dni'),
+        ('motive', 'motive'),
+        ('observation', 'observation'),
+        ('remission_guide', 'remission_guide'),
+        ('bill', 'bill'),
+        ('driver_name', 'driver_name'),
+        ('car_plate', 'car_plate'),
+    ], 'timestamp'),
+]
+
+COLUMNS = ['record_type'] + list(dict.fromkeys(column for _, _, fields, _ in SECTIONS for column, _ in fields))
+
+
+def section_queryset(model, client_id, start, end, guard_ids=None):
+    """Rows of ``model`` belonging to the client's runs started in ``[start, end)``."""
+    if model is RouteRun:
+        runs = RouteRun.objects.filter(
+            assignment__route__client_id=client_id, start_time__gte=start, start_time__lt=end
+        )
+        return runs.filter(assignment__guard_id__in=guard_ids) if guard_ids else runs
+    in_runs = Q(
+        route_run__assignment__route__client_id=client_id,
+        route_run__start_time__gte=start,
+        route_run__start_time__lt=end,
+    )
+    if model is Incident:
+        # Incidents reported outside a run are matched by the guard's client and their own time
+        in_runs |= Q(
+            route_run__isnull=True,
+            guard__userprofile__client_id=client_id,
+            timestamp__gte=start,
+            timestamp__lt=end,
+        )
+    rows = model.objects.filter(in_runs)
+    if guard_ids:
+        guard_lookup = 'guard_id__in' if model is Incident else 'route_run__assignment__guard_id__in'
+        rows = rows.filter(**{guard_lookup: guard_ids})
+    return rows
+
+
+def export_records(client_id, start, end, guard_ids=None):
+    """Yield ``(record_type, {column: value})`` for every exported row, section by section."""
+    for record_type, model, fields, order_by in SECTIONS:
+        columns = [column for column, _ in fields]
+        rows = section_queryset(model, client_id, start, end, guard_ids).order_by(order_by, 'id').values_list(
+            *[lookup for _, lookup in fields]
+        )
+        for row in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            yield record_type, dict(zip(columns, row))
+
+
+def export_value(value):
+    return timezone.localtime(value).isoformat() if isinstance(value, datetime) else value
+
+
+class Echo:
+    """File-like object whose ``write`` hands back the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(records):
+    writer = csv.DictWriter(Echo(), fieldnames=COLUMNS)
+    yield writer.writeheader()
+    for record_type, record in records:
+        record = {column: export_value(value) for column, value in record.items()}
+        record['record_type'] = record_type
+        yield writer.writerow(record)
+
+
+def stream_ndjson(records):
+    for record_type, record in records:
+        record = {column: export_value(value) for column, value in record.items()}
+        yield json.dumps({'record_type': record_type, **record}, cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(output, client_id, start, end):
+    records = export_records(client_id, start, end)
+    return stream_csv(records) if output == 'csv' else stream_ndjson(records)
@@ -0,0 +1,98 @@
+"""
+``Idempotency-Key`` support for the mobile write endpoints.
+
+The first request for a (user, key) pair claims a row in ``IdempotencyKey``
+before the view runs and stores the response afterwards. Retries with the same
+key get the stored response back without touching the domain models.
+"""
+import functools
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+
+
+def _claim(request, key, now):
+    """Insert the in-flight row for ``key``; return the existing row on conflict."""
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                user_id=request.user.id,
+                key=key,
+                path=request.path,
+                created_at=now,
+                expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+            )
+        return None
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user_id=request.user.id, key=key).first()
+
+
+def idempotent(view_func):
+    """Replay the stored response when a request repeats its ``Idempotency-Key``.
+
+    Must be applied below ``@api_view`` so that ``request.user`` is the
+    authenticated user. Responses with a 5xx status are not stored, so the
+    client may retry them with the same key.
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        now = timezone.now()
+        existing = _claim(request, key, now)
+        if existing is not None:
+            abandoned = existing.status_code is None and (
+                existing.created_at <= now - settings.IDEMPOTENCY_KEY_LOCK_TIMEOUT
+            )
+            if existing.expires_at <= now or abandoned:
+                IdempotencyKey.objects.filter(pk=existing.pk).delete()
+                existing = _claim(request, key, now)
+
+        if existing is not None:
+            if existing.path != request.path:
+                return Response(
+                    {'error': f'{IDEMPOTENCY_HEADER} was already used for a different endpoint'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if existing.status_code is None:
+                return Response(
+                    {'error': 'A request with this Idempotency-Key is still being processed'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return Response(
+                existing.response_body,
+                status=existing.status_code,
+                headers={'Idempotent-Replayed': 'true'}
+            )
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(user_id=request.user.id, key=key).delete()
+            raise
+
+        if response.status_code >= 500:
+            IdempotencyKey.objects.filter(user_id=request.user.id, key=key).delete()
+        else:
+            IdempotencyKey.objects.filter(user_id=request.user.id, key=key).update(
+                status_code=response.status_code,
+                response_body=getattr(response, 'data', None),
+            )
+        return response
+
+    return wrapper
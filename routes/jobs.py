@@ -0,0 +1,141 @@
+"""
+Database-backed queue of report files.
+
+Request workers only record a ``ReportJob``; ``run_report_worker`` claims jobs
+one at a time, renders the export rows of ``exports.py`` to a file under
+``REPORT_JOBS_DIR`` and keeps it for ``REPORT_JOB_TTL``. Heavy reports never
+occupy a gunicorn worker, so they cannot starve the scan endpoints.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .exports import COLUMNS, export_records, export_value
+from .models import ReportJob
+from .reports import local_day_bounds, parse_report_date
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def params_hash(client_id, params, output):
+    key = json.dumps([client_id, params, output], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def submit(client_id, user_id, params, output):
+    """Return ``(job, created)``; an identical queued job or fresh file is reused.
+
+    A finished file is only reused for a range that ended before today: one
+    reaching today misses every scan and event since it was rendered.
+    """
+    digest = params_hash(client_id, params, output)
+    reusable = Q(status__in=[ReportJob.PENDING, ReportJob.RUNNING])
+    if params['date_to'] < timezone.localdate():
+        reusable |= Q(status=ReportJob.DONE, expires_at__gt=timezone.now())
+    job = ReportJob.objects.filter(params_hash=digest).filter(reusable).order_by('-created_at').first()
+    if job:
+        return job, False
+    job = ReportJob.objects.create(
+        client_id=client_id, requested_by_id=user_id, params_hash=digest, params=params, output=output
+    )
+    return job, True
+
+
+def claim_next():
+    """Mark the oldest pending job as running and return it.
+
+    The claim is a conditional update, so concurrent workers never run the same
+    job and no ``SKIP LOCKED`` support is needed from the database.
+    """
+    pending = ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at')
+    for job_id in pending.values_list('id', flat=True)[:10]:
+        claimed = ReportJob.objects.filter(id=job_id, status=ReportJob.PENDING).update(
+            status=ReportJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            return ReportJob.objects.get(id=job_id)
+    return None
+
+
+def requeue_stale():
+    """Give jobs whose worker died mid-run another attempt, or fail them."""
+    stale = ReportJob.objects.filter(
+        status=ReportJob.RUNNING, started_at__lt=timezone.now() - settings.REPORT_JOB_TIMEOUT
+    )
+    stale.filter(attempts__lt=settings.REPORT_JOB_MAX_ATTEMPTS).update(status=ReportJob.PENDING)
+    stale.update(status=ReportJob.FAILED, error='Worker timed out', finished_at=timezone.now())
+
+
+def purge_expired():
+    """Delete the files and rows of expired results and old failures."""
+    now = timezone.now()
+    expired = ReportJob.objects.filter(
+        Q(status=ReportJob.DONE, expires_at__lte=now)
+        | Q(status=ReportJob.FAILED, created_at__lte=now - settings.REPORT_JOB_TTL)
+    )
+    for job in expired.only('id', 'file_path').iterator():
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.delete()
+
+
+def run(job):
+    os.makedirs(settings.REPORT_JOBS_DIR, exist_ok=True)
+    path = os.path.join(settings.REPORT_JOBS_DIR, f'report-{job.id}.{job.output}')
+    partial = path + '.partial'
+    try:
+        date_from = parse_report_date(job.params['date_from'])
+        date_to = parse_report_date(job.params['date_to'])
+        start, end = local_day_bounds(date_from, date_to)
+        records = export_records(job.client_id, start, end, job.params.get('guard_ids'))
+        rows = RENDERERS[job.output](records, partial)
+        os.replace(partial, path)
+    except Exception as e:
+        logger.exception('Report job %s failed', job.id)
+        if os.path.exists(partial):
+            os.remove(partial)
+        job.status = ReportJob.FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return
+
+    job.status = ReportJob.DONE
+    job.file_path = path
+    job.rows = rows
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + settings.REPORT_JOB_TTL
+    job.save(update_fields=['status', 'file_path', 'rows', 'finished_at', 'expires_at'])
+
+
+def _rows(records):
+    for record_type, record in records:
+        record['record_type'] = record_type
+        yield [export_value(record.get(column)) for column in COLUMNS]
+
+
+def render_csv(records, path):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in _rows(records):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+RENDERERS = {
+    'csv': render_csv,
+}
@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from routes.models import Client, UserProfile
+from routes.principal import invalidate_user
+from routes.views import CustomTokenObtainPairView
+
+PASSWORD = 'bench-login-password'
+FAST_HASHER = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+
+class Command(BaseCommand):
+    help = 'Measure login throughput, reporting password hashing separately from the rest of the request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Guards to create for the run')
+        parser.add_argument('--logins', type=int, default=200, help='Logins to perform')
+
+    def handle(self, *args, **options):
+        # Benchmark users are created in a transaction that is rolled back at the end
+        with transaction.atomic():
+            usernames = self.create_users(options['users'])
+            try:
+                hash_times = self.time_password_checks(options['logins'])
+                login_times, queries = self.time_logins(usernames, options['logins'])
+                # Same logins with a near-free hasher: what is left is our own per-login cost
+                with override_settings(PASSWORD_HASHERS=[FAST_HASHER]):
+                    User.objects.filter(username__in=usernames).update(password=make_password(PASSWORD))
+                    overhead_times, _ = self.time_logins(usernames, options['logins'])
+            finally:
+                transaction.set_rollback(True)
+        for user_id in self.user_ids:
+            invalidate_user(user_id)
+
+        self.report(hash_times, login_times, overhead_times, queries)
+
+    def create_users(self, count):
+        client_user = User.objects.create_user(username='bench-login-client')
+        client = Client.objects.create(user=client_user, name='Bench login')
+        encoded = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            [User(username=f'bench-login-{i}', password=encoded) for i in range(count)]
+        )
+        UserProfile.objects.bulk_create([UserProfile(user=user, client=client) for user in users])
+        self.user_ids = [client_user.id] + [user.id for user in users]
+        return [user.username for user in users]
+
+    def time_password_checks(self, count):
+        user = User(password=make_password(PASSWORD))
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            user.check_password(PASSWORD)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def time_logins(self, usernames, count):
+        factory = APIRequestFactory()
+        view = CustomTokenObtainPairView.as_view()
+        timings = []
+        with CaptureQueriesContext(connection) as captured:
+            for i in range(count):
+                request = factory.post(
+                    '/api/token/', {'username': usernames[i % len(usernames)], 'password': PASSWORD}, format='json'
+                )
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f'Login failed with {response.status_code}: {response.data}')
+        return timings, len(captured.captured_queries) / count
+
+    def report(self, hash_times, login_times, overhead_times, queries):
+        hasher = identify_hasher(make_password(PASSWORD))
+        login_mean = statistics.fmean(login_times)
+        login_ms = sorted(t * 1000 for t in login_times)
+        overhead_ms = sorted(t * 1000 for t in overhead_times)
+
+        self.stdout.write(f'Hasher: {hasher.algorithm} ({getattr(hasher, "iterations", "n/a")} iterations)')
+        self.stdout.write(f'Logins: {len(login_times)} at {1 / login_mean:.1f}/s per worker')
+        self.stdout.write(
+            f'Login latency ms: p50 {statistics.median(login_ms):.2f}, '
+            f'p95 {login_ms[int(len(login_ms) * 0.95) - 1]:.2f}, max {login_ms[-1]:.2f}'
+        )
+        self.stdout.write(f'Password check ms: mean {statistics.fmean(hash_times) * 1000:.2f}')
+        self.stdout.write(
+            f'Login without password hashing ms: p50 {statistics.median(overhead_ms):.2f}, '
+            f'p95 {overhead_ms[int(len(overhead_ms) * 0.95) - 1]:.2f} '
+            f'({1000 / statistics.fmean(overhead_ms):.0f}/s per worker)'
+        )
+        self.stdout.write(f'Queries per login: {queries:.1f}')
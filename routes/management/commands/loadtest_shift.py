@@ -0,0 +1,250 @@
+"""
+Replay a shift change against a running server and report latency per endpoint.
+
+Every guard thread logs in, loads its assignment, starts a run and scans its
+route's checkpoints in order, pausing ``--scan-interval`` seconds (lognormal
+jitter) between scans and now and then posting an incident or an occurrence
+on the way; after the last checkpoint it ends the shift and starts over. Admin threads
+poll ``guard-assignments/`` and ``daily-report/`` with ``If-None-Match`` as
+the dashboard does.
+
+Users come from ``seed_load`` (same ``--prefix`` and ``--password``), read from
+the database the server uses. ``--guards`` takes several counts to run one
+stage per count, which gives the concurrency a single instance sustains:
+
+    python manage.py seed_load --clients 2 --guards 100
+    gunicorn route_monitor.wsgi:application --workers 2 &
+    python manage.py loadtest_shift --guards 10 25 50 100 --duration 60
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from math import ceil
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of already sorted ``values``."""
+    return values[max(0, min(len(values) - 1, ceil(q * len(values)) - 1))]
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by every thread of a stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+        self.samples = {}
+
+    def record(self, endpoint, seconds, status_code, body=b''):
+        with self.lock:
+            self.timings.setdefault(endpoint, []).append(seconds)
+            if status_code == 0 or status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+                self.samples.setdefault(endpoint, f'{status_code} {body[:200].decode(errors="replace")}')
+
+
+class Session:
+    """One user's HTTP client: JSON in and out, bearer token, timings into ``stats``."""
+
+    def __init__(self, base_url, stats, timeout):
+        self.base_url = base_url
+        self.stats = stats
+        self.timeout = timeout
+        self.token = None
+        self.etags = {}
+
+    def call(self, method, path, data=None, endpoint=None, idempotent=False, conditional=False):
+        headers = {'Accept': 'application/json', 'X-Forwarded-Proto': 'https'}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if idempotent:
+            headers['Idempotency-Key'] = str(uuid.uuid4())
+        if conditional and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+
+        request = Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                status_code, content = response.status, response.read()
+                etag = response.headers.get('ETag')
+        except HTTPError as e:
+            status_code, content, etag = e.code, e.read(), None
+        except (URLError, OSError) as e:
+            status_code, content, etag = 0, str(e).encode(), None
+        self.stats.record(endpoint or path.split('?')[0], time.perf_counter() - start, status_code, content)
+
+        if status_code == 304:
+            return status_code, None
+        if conditional and etag:
+            self.etags[path] = etag
+        try:
+            return status_code, json.loads(content) if content else None
+        except ValueError:
+            return status_code, None
+
+    def login(self, username, password):
+        status_code, data = self.call('POST', 'token/', {'username': username, 'password': password})
+        if status_code != 200:
+            return False
+        self.token = data['access']
+        return True
+
+
+class Command(BaseCommand):
+    help = 'Simulate a shift change against a running server: guards patrol, admins poll, latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/')
+        parser.add_argument('--guards', type=int, nargs='+', default=[10],
+                            help='Concurrent guards; several values run one stage each')
+        parser.add_argument('--admins', type=int, default=2, help='Admins polling during each stage')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds per stage')
+        parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which guards log in')
+        parser.add_argument('--scan-interval', type=float, default=5,
+                            help='Mean seconds between scans (a real patrol takes minutes)')
+        parser.add_argument('--poll-interval', type=float, default=10, help='Seconds between admin polls')
+        parser.add_argument('--incident-rate', type=float, default=0.05, help='Chance of an incident per scan')
+        parser.add_argument('--occurrence-rate', type=float, default=0.1, help='Chance of an occurrence per scan')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+        parser.add_argument('--password', default='load-test')
+        parser.add_argument('--prefix', default='load')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if not options['base_url'].endswith('/'):
+            options['base_url'] += '/'
+        self.options = options
+        self.rng = random.Random(options['seed'])
+
+        guards = list(
+            User.objects.filter(username__startswith=f"{options['prefix']}-", route_assignment__isnull=False)
+            .order_by('id').values_list('username', flat=True)[:max(options['guards'])]
+        )
+        if len(guards) < max(options['guards']):
+            raise CommandError(
+                f'Only {len(guards)} guards with prefix {options["prefix"]!r}; run seed_load with more --guards'
+            )
+        admins = list(
+            User.objects.filter(username__startswith=f"{options['prefix']}-", userprofile__is_admin=True)
+            .order_by('id').values_list('username', 'userprofile__client_id')
+        )
+        # Admins only look at guards of their own client
+        guard_ids = {}
+        for guard_id, client_id in User.objects.filter(username__in=guards).values_list('id', 'userprofile__client_id'):
+            guard_ids.setdefault(client_id, []).append(guard_id)
+        admins = [(username, guard_ids[client_id]) for username, client_id in admins if client_id in guard_ids]
+
+        summary = []
+        for count in options['guards']:
+            self.stdout.write(f'\n{count} guards, {options["admins"]} admins, {options["duration"]:.0f}s')
+            stats, elapsed, rounds = self.run_stage(guards[:count], admins[:options['admins']])
+            summary.append((count, *self.report(stats, elapsed, rounds)))
+
+        if len(summary) > 1:
+            self.stdout.write(f'\n{"guards":>6} {"req/s":>8} {"scan p95":>9} {"error %":>8}')
+            for count, throughput, scan_p95, error_rate in summary:
+                self.stdout.write(f'{count:>6} {throughput:>8.1f} {scan_p95:>9.0f} {error_rate:>8.2f}')
+
+    def run_stage(self, guards, admins):
+        options = self.options
+        stats = Stats()
+        rounds = []
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.patrol, daemon=True, args=(
+                username, stats, stop, rounds, options['ramp_up'] * i / len(guards), self.rng.random()))
+            for i, username in enumerate(guards)
+        ] + [
+            threading.Thread(target=self.poll, daemon=True, args=(username, guard_ids, stats, stop, self.rng.random()))
+            for username, guard_ids in admins
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        stop.wait(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join(options['timeout'] + options['scan_interval'])
+        return stats, time.perf_counter() - start, len(rounds)
+
+    def patrol(self, username, stats, stop, rounds, delay, seed):
+        options, rng = self.options, random.Random(seed)
+        session = Session(options['base_url'], stats, options['timeout'])
+        if stop.wait(delay) or not session.login(username, options['password']):
+            return
+        status_code, assignment = session.call('GET', 'assignment/')
+        if status_code != 200:
+            return
+        checkpoints = sorted(assignment['route']['checkpoints'], key=lambda checkpoint: checkpoint['order'])
+        if assignment.get('active_run'):
+            # A run left open by an earlier stage
+            session.call('POST', 'end-shift/')
+
+        while not stop.is_set():
+            status_code, _ = session.call('POST', 'start-run/', idempotent=True)
+            if status_code != 201:
+                return
+            for checkpoint in checkpoints:
+                if stop.wait(options['scan_interval'] * rng.lognormvariate(0, 0.3)):
+                    return
+                # Events happen on the way; the last scan completes the run
+                if rng.random() < options['incident_rate']:
+                    session.call('POST', 'create-incident/', {'description': 'Incidente de prueba'}, idempotent=True)
+                if rng.random() < options['occurrence_rate']:
+                    session.call('POST', 'create-occurrence/', {
+                        'occurrence_type': 'person', 'name': 'Visitante', 'dni': f'{rng.randrange(10 ** 8):08d}',
+                        'motive': 'Visita',
+                    }, idempotent=True)
+                session.call('POST', 'scan/', {'qr_code': checkpoint['qr_code']}, idempotent=True)
+            session.call('POST', 'end-shift/')
+            rounds.append(username)
+
+    def poll(self, username, guard_ids, stats, stop, seed):
+        options, rng = self.options, random.Random(seed)
+        session = Session(options['base_url'], stats, options['timeout'])
+        if not session.login(username, options['password']):
+            return
+        while not stop.is_set():
+            session.call('GET', 'guard-assignments/', conditional=True)
+            today = timezone.localdate().isoformat()
+            session.call('GET', f'daily-report/?guard_id={rng.choice(guard_ids)}&date={today}',
+                         endpoint='daily-report/', conditional=True)
+            stop.wait(options['poll_interval'] * rng.uniform(0.5, 1.5))
+
+    def report(self, stats, elapsed, rounds):
+        self.stdout.write(
+            f'{"endpoint":<20} {"requests":>8} {"errors":>7} {"req/s":>7} '
+            f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+        )
+        total = errors = 0
+        for endpoint in sorted(stats.timings):
+            timings = sorted(seconds * 1000 for seconds in stats.timings[endpoint])
+            failed = stats.errors.get(endpoint, 0)
+            total += len(timings)
+            errors += failed
+            self.stdout.write(
+                f'{endpoint:<20} {len(timings):>8} {failed:>7} {len(timings) / elapsed:>7.1f} '
+                f'{percentile(timings, 0.5):>8.1f} {percentile(timings, 0.95):>8.1f} '
+                f'{percentile(timings, 0.99):>8.1f} {timings[-1]:>8.1f}'
+            )
+        for endpoint, sample in sorted(stats.samples.items()):
+            self.stdout.write(self.style.WARNING(f'{endpoint} failed, e.g. {sample}'))
+
+        scans = sorted(stats.timings.get('scan/', [0]))
+        summary = f'{total} requests in {elapsed:.1f}s ({total / elapsed:.1f}/s), {rounds} rounds completed'
+        self.stdout.write(self.style.ERROR(summary) if errors else self.style.SUCCESS(summary))
+        return total / elapsed, percentile(scans, 0.95) * 1000, 100 * errors / max(total, 1)
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from routes.models import RevokedToken, ClientRevocation
+
+
+class Command(BaseCommand):
+    help = 'Delete token revocations that no unexpired token can match any more'
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        tokens, _ = RevokedToken.objects.filter(expires_at__lte=now).delete()
+
+        longest_lifetime = max(
+            settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'], settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
+        )
+        clients, _ = ClientRevocation.objects.filter(revoked_before__lte=now - longest_lifetime).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {tokens} expired token revocations and {clients} client revocations'
+        ))
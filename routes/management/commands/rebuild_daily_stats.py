@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from routes import rollups
+from routes.reports import ReportError, parse_report_date
+
+
+class Command(BaseCommand):
+    help = 'Recompute DailyGuardStats for a range of local days from the run and event tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First day (YYYY-MM-DD), defaults to --to')
+        parser.add_argument('--to', dest='date_to', help='Last day (YYYY-MM-DD), defaults to today')
+
+    def handle(self, *args, **options):
+        try:
+            date_to = parse_report_date(options['date_to'], default=timezone.localdate())
+            date_from = parse_report_date(options['date_from'], default=date_to)
+        except ReportError as e:
+            raise CommandError(str(e))
+        if date_to < date_from:
+            raise CommandError('--to must not be before --from')
+
+        rows = rollups.rebuild(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily stats rows for {date_from} to {date_to}'))
@@ -0,0 +1,45 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from routes import jobs, slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Render queued report jobs to files, one at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        next_purge = 0.0
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() >= next_purge:
+                jobs.requeue_stale()
+                jobs.purge_expired()
+                next_purge = time.monotonic() + 60
+
+            job = jobs.claim_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(settings.REPORT_WORKER_POLL_INTERVAL)
+                continue
+
+            self.stdout.write(f'Rendering report job {job.id} ({job.output})')
+            with slow_queries.sampling(f'report job {job.id}'):
+                jobs.run(job)
+            job.refresh_from_db(fields=['status', 'rows', 'error'])
+            self.stdout.write(f'Report job {job.id} {job.status}: {job.rows if job.rows is not None else job.error}')
+
+    def stop(self, signum, frame):
+        # Finish the job in hand, then exit
+        self.stopping = True
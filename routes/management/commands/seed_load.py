@@ -0,0 +1,215 @@
+import random
+import time as timer
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from routes import rollups
+from routes.models import (
+    Client, UserProfile, Route, Checkpoint, GuardAssignment, RouteRun, CheckpointScan, Incident, Occurrence,
+)
+
+# Local shift windows: (start hour, length in hours)
+SHIFT_HOURS = {'day': (7, 12), 'night': (19, 12), 'weekend': (7, 12)}
+SHIFT_WEIGHTS = [('day', 50), ('night', 35), ('weekend', 15)]
+
+
+class Command(BaseCommand):
+    help = 'Generate clients, guards, routes and months of patrol history for capacity testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5)
+        parser.add_argument('--guards', type=int, default=50, help='Guards per client')
+        parser.add_argument('--routes', type=int, default=10, help='Routes per client')
+        parser.add_argument('--checkpoints', type=int, default=12, help='Checkpoints per route')
+        parser.add_argument('--days', type=int, default=90, help='Days of history, ending today')
+        parser.add_argument('--rounds', type=int, default=4, help='Patrol rounds per shift')
+        parser.add_argument('--incident-rate', type=float, default=0.05, help='Chance of an incident per run')
+        parser.add_argument('--occurrence-rate', type=float, default=0.1, help='Chance of an occurrence per run')
+        parser.add_argument('--miss-rate', type=float, default=0.03, help='Chance a run is abandoned midway')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--password', default='load-test', help='Password of every generated user')
+        parser.add_argument('--prefix', default='load', help='Prefix of usernames and QR codes')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable datasets')
+        parser.add_argument('--skip-rollup', action='store_true', help='Do not rebuild DailyGuardStats afterwards')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['rounds'] < 1 or options['checkpoints'] < 1:
+            raise CommandError('--batch-size, --rounds and --checkpoints must be positive')
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users with prefix '{options['prefix']}' already exist; pass another --prefix")
+
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.counts = dict.fromkeys(['runs', 'scans', 'incidents', 'occurrences'], 0)
+        self.runs, self.plans = [], []
+        started = timer.perf_counter()
+
+        # One hash for everyone: hashing per user would dominate the run
+        self.password = make_password(options['password'])
+        assignments = []
+        for n in range(options['clients']):
+            with transaction.atomic():
+                assignments += self.create_client(n)
+        self.stdout.write(f'Created {options["clients"]} clients and {len(assignments)} guards')
+
+        today = timezone.localdate()
+        first_day = today - timedelta(days=options['days'] - 1)
+        for assignment, checkpoints, segment_minutes in assignments:
+            self.create_history(assignment, checkpoints, segment_minutes, first_day, today)
+        self.flush()
+
+        if not options['skip_rollup']:
+            rows = rollups.rebuild(first_day, today)
+            self.stdout.write(f'Rebuilt {rows} daily stats rows')
+
+        elapsed = timer.perf_counter() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.counts['runs']} runs, {self.counts['scans']} scans, {self.counts['incidents']} incidents, "
+            f"{self.counts['occurrences']} occurrences in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)"
+        ))
+
+    def create_client(self, n):
+        """Create client ``n`` and return ``(assignment, checkpoints, segment minutes)`` per guard."""
+        options, prefix = self.options, f"{self.options['prefix']}-{n}"
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}-client', password=self.password)]
+            + [User(username=f'{prefix}-admin', password=self.password, is_staff=True)]
+            + [User(username=f'{prefix}-guard-{i}', password=self.password) for i in range(options['guards'])],
+            batch_size=self.batch_size,
+        )
+        client_user, admin, guards = users[0], users[1], users[2:]
+        client = Client.objects.create(user=client_user, name=f'Load client {n}')
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=admin, client=client, is_admin=True)]
+            + [UserProfile(user=guard, client=client) for guard in guards],
+            batch_size=self.batch_size,
+        )
+
+        routes = Route.objects.bulk_create(
+            [Route(name=f'Ruta {i + 1}', client=client) for i in range(options['routes'])]
+        )
+        checkpoints = Checkpoint.objects.bulk_create([
+            Checkpoint(route=route, name=f'Punto {order}', qr_code=f'{prefix}-{route.id}-{order}', order=order)
+            for route in routes for order in range(1, options['checkpoints'] + 1)
+        ], batch_size=self.batch_size)
+        by_route = {route.id: [] for route in routes}
+        for checkpoint in checkpoints:
+            by_route[checkpoint.route_id].append(checkpoint)
+        # Walking time between checkpoints differs per route
+        segment_minutes = {route.id: self.rng.uniform(2, 6) for route in routes}
+
+        shifts, weights = zip(*SHIFT_WEIGHTS)
+        assignments = GuardAssignment.objects.bulk_create([
+            GuardAssignment(guard=guard, route=routes[i % len(routes)], shift=self.rng.choices(shifts, weights)[0])
+            for i, guard in enumerate(guards)
+        ], batch_size=self.batch_size)
+        return [
+            (assignment, by_route[assignment.route_id], segment_minutes[assignment.route_id])
+            for assignment in assignments
+        ]
+
+    def working_days(self, assignment, first_day, last_day):
+        """Weekend guards work Saturdays and Sundays; the rest five days a week with rotating days off."""
+        day_off = assignment.guard_id % 7
+        day = first_day
+        while day <= last_day:
+            weekday = day.weekday()
+            if assignment.shift == 'weekend':
+                if weekday >= 5:
+                    yield day
+            elif weekday not in (day_off, (day_off + 1) % 7):
+                yield day
+            day += timedelta(days=1)
+
+    def create_history(self, assignment, checkpoints, segment_minutes, first_day, last_day):
+        options, rng = self.options, self.rng
+        start_hour, shift_hours = SHIFT_HOURS[assignment.shift]
+        round_minutes = shift_hours * 60 / options['rounds']
+        now = timezone.now()
+
+        for day in self.working_days(assignment, first_day, last_day):
+            shift_start = timezone.make_aware(datetime.combine(day, time(start_hour)))
+            for i in range(options['rounds']):
+                start = shift_start + timedelta(minutes=i * round_minutes + rng.uniform(0, 15))
+                scans = []
+                at = start
+                expected = len(checkpoints)
+                stop = rng.randrange(1, expected) if expected > 1 and rng.random() < options['miss_rate'] else expected
+                for checkpoint in checkpoints[:stop]:
+                    at += timedelta(minutes=segment_minutes * rng.lognormvariate(0, 0.3))
+                    scans.append((checkpoint.id, at))
+                end = at + timedelta(minutes=rng.uniform(0, 3))
+                if end > now:
+                    break
+                self.runs.append(RouteRun(
+                    assignment=assignment, start_time=start, end_time=end, completed=True,
+                    last_scanned_order=stop, scanned_count=stop, expected_total=expected,
+                    last_scan_at=scans[-1][1] if scans else None,
+                ))
+                self.plans.append(scans)
+                if len(self.runs) >= self.batch_size:
+                    self.flush()
+
+    def flush(self):
+        """Insert the buffered runs, then their scans and events now that the runs have ids."""
+        options, rng = self.options, self.rng
+        runs, plans = self.runs, self.plans
+        self.runs, self.plans = [], []
+        with transaction.atomic():
+            RouteRun.objects.bulk_create(runs, batch_size=self.batch_size)
+            adapt = connection.ops.adapt_datetimefield_value
+            scans = [
+                (checkpoint_id, run.id, adapt(scanned_at))
+                for run, plan in zip(runs, plans) for checkpoint_id, scanned_at in plan
+            ]
+            incidents = [
+                Incident(guard_id=run.assignment.guard_id, route_run=run, description='Incidente de prueba',
+                         timestamp=run.start_time + (run.end_time - run.start_time) * rng.random())
+                for run in runs if rng.random() < options['incident_rate']
+            ]
+            occurrences = [
+                self.occurrence(run) for run in runs if rng.random() < options['occurrence_rate']
+            ]
+            self.insert_rows(CheckpointScan, ['checkpoint', 'route_run', 'scanned_at'], scans)
+            Incident.objects.bulk_create(incidents, batch_size=self.batch_size)
+            Occurrence.objects.bulk_create(occurrences, batch_size=self.batch_size)
+        self.counts['runs'] += len(runs)
+        self.counts['scans'] += len(scans)
+        self.counts['incidents'] += len(incidents)
+        self.counts['occurrences'] += len(occurrences)
+
+    def insert_rows(self, model, field_names, rows):
+        """Multi-row INSERT of already adapted values, skipping model instances and the SQL compiler.
+
+        Scans are most of the generated rows; building a model per row is what
+        would otherwise bound the insert rate.
+        """
+        fields = [model._meta.get_field(name) for name in field_names]
+        quote = connection.ops.quote_name
+        row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        batch_size = connection.ops.bulk_batch_size(fields, rows) or len(rows)
+        batch_size = min(batch_size, self.batch_size)
+        prefix = 'INSERT INTO {} ({}) VALUES '.format(
+            quote(model._meta.db_table), ', '.join(quote(field.column) for field in fields)
+        )
+        with connection.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                cursor.execute(prefix + ', '.join([row_sql] * len(batch)), [value for row in batch for value in row])
+
+    def occurrence(self, run):
+        rng = self.rng
+        timestamp = run.start_time + (run.end_time - run.start_time) * rng.random()
+        if rng.random() < 0.5:
+            return Occurrence(route_run=run, occurrence_type='person', name='Visitante', dni=f'{rng.randrange(10 ** 8):08d}',
+                              motive='Visita', timestamp=timestamp)
+        return Occurrence(route_run=run, occurrence_type='car', name='Proveedor', dni=f'{rng.randrange(10 ** 8):08d}',
+                          motive='Entrega', driver_name='Conductor', car_plate=f'ABC-{rng.randrange(1000):03d}',
+                          timestamp=timestamp)
@@ -0,0 +1,77 @@
+"""
+Fixed-size files that every worker process on the host maps with ``mmap``.
+
+gunicorn workers share nothing in memory; a file named by a setting, mapped by
+each worker on first use (and again after a fork), is the cheapest shared
+state they have. Writers lock only the byte range they touch with
+``fcntl.lockf``; a threading lock covers threads of one process, which POSIX
+record locks do not separate. The file starts with a magic string naming its
+layout, and is cleared when the magic does not match.
+"""
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev server process, no cross-process lock needed
+    fcntl = None
+
+
+class MappedFile:
+    setting = None
+    magic = b''
+    size = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._opened = None
+
+    @property
+    def header_size(self):
+        return len(self.magic)
+
+    @contextmanager
+    def _locked(self, length=0, start=0, shared=False):
+        """``lockf`` a byte range of the file; ``length=0`` locks to its end."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(self.fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, length, start)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+    def _map(self):
+        """The mapped file; call with ``self._lock`` held."""
+        path = getattr(settings, self.setting)
+        if self._opened != (os.getpid(), path):
+            # First use in this process, in a forked worker, or with another file under test
+            if self._opened is not None:
+                self.mm.close()
+                os.close(self.fd)
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._locked():
+                if os.fstat(self.fd).st_size != self.size:
+                    os.ftruncate(self.fd, self.size)
+                self.mm = mmap.mmap(self.fd, self.size)
+                if self.mm[:self.header_size] != self.magic:
+                    # New file or an older layout
+                    self.mm[:] = self.magic + bytes(self.size - self.header_size)
+            self._opened = (os.getpid(), path)
+            self.opened()
+        return self.mm
+
+    def opened(self):
+        """Hook run after the file is (re)mapped in this process."""
+
+    def reset(self):
+        with self._lock:
+            mm = self._map()
+            with self._locked():
+                mm[self.header_size:] = bytes(self.size - self.header_size)
+            self.opened()
@@ -0,0 +1,261 @@
+"""
+Per-endpoint request metrics shared by every worker on the host.
+
+``MetricsMiddleware`` times each request and, through a per-request
+``RequestMetrics`` held in a context variable, collects the number and time of
+its database queries (``connection.execute_wrapper``) and the time spent in
+DRF authentication, permission checks and serializers' ``.data``; the phases
+go back to the client in a ``Server-Timing`` header. The totals are added to
+the slot of the request's URL name in a fixed-layout file that every gunicorn
+worker maps with ``mmap``, so ``/api/metrics/`` reports the whole instance
+whichever worker answers it, in the Prometheus text format.
+
+A slot holds the URL name followed by integer counters (requests, responses by
+status class, latency histogram buckets, queries, response bytes) and float
+totals in seconds. Updates lock the slot's byte range (see ``mapped_file``);
+claiming a slot for a new URL name locks the file header. The file outlives
+worker restarts, so counters only grow, as a metrics scraper expects.
+"""
+import contextvars
+import functools
+import struct
+import time
+
+from django.db import connection
+from rest_framework import serializers
+from rest_framework.views import APIView
+
+from .mapped_file import MappedFile
+
+MAGIC = b'RMMETR01'
+NAME_SIZE = 64
+MAX_SLOTS = 256
+# Upper bounds of the latency histogram buckets, in milliseconds; one more bucket catches the rest
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+STATUS_CLASSES = ('2xx', '3xx', '4xx', '5xx')
+INT_FIELDS = ('requests', *STATUS_CLASSES, 'queries', 'response_bytes') + tuple(
+    f'latency_{i}' for i in range(len(LATENCY_BUCKETS_MS) + 1)
+)
+FLOAT_FIELDS = ('latency', 'db_time', 'serializer_time')
+SLOT = struct.Struct(f'<{NAME_SIZE}s{len(INT_FIELDS)}q{len(FLOAT_FIELDS)}d')
+HEADER_SIZE = len(MAGIC)
+FILE_SIZE = HEADER_SIZE + MAX_SLOTS * SLOT.size
+UNMATCHED = '<unmatched>'
+OVERFLOW = '<other>'
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'route_monitor'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What the current request spent authenticating, checking permissions, in the database and in serializers."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.auth_time = 0.0
+        self.permission_time = 0.0
+        self.serializer_time = 0.0
+        self.timing = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        """``execute_wrapper`` hook."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        """``Server-Timing`` value. Phases overlap: auth and serialization include the queries they run."""
+        return ', '.join([
+            f'auth;dur={self.auth_time * 1000:.1f}',
+            f'permission;dur={self.permission_time * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialization;dur={self.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def _timed(original, attribute):
+    """Wrap ``original`` to add its duration to the current request's ``attribute``."""
+    @functools.wraps(original)
+    def method(self, *args, **kwargs):
+        metrics = _current.get()
+        # Nested calls (a serializer's .data inside another one's) count once
+        if metrics is None or attribute in metrics.timing:
+            return original(self, *args, **kwargs)
+        metrics.timing.add(attribute)
+        start = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            setattr(metrics, attribute, getattr(metrics, attribute) + time.perf_counter() - start)
+            metrics.timing.discard(attribute)
+    method.timed = True
+    return method
+
+
+def install():
+    """Time DRF's authentication, permission checks and ``BaseSerializer.data``.
+
+    ``Serializer.data`` and ``ListSerializer.data`` reach the base property
+    through ``super()``; function views get ``APIView``'s methods through
+    ``@api_view``.
+    """
+    if getattr(serializers.BaseSerializer.data.fget, 'timed', False):
+        return
+    serializers.BaseSerializer.data = property(_timed(serializers.BaseSerializer.data.fget, 'serializer_time'))
+    APIView.perform_authentication = _timed(APIView.perform_authentication, 'auth_time')
+    APIView.check_permissions = _timed(APIView.check_permissions, 'permission_time')
+
+
+class SharedMetrics(MappedFile):
+    """The slot table in ``settings.METRICS_FILE``."""
+
+    setting = 'METRICS_FILE'
+    magic = MAGIC
+    size = FILE_SIZE
+
+    def opened(self):
+        self._slots = {}
+
+    def _offset(self, index):
+        return HEADER_SIZE + index * SLOT.size
+
+    def _slot(self, name):
+        """Offset of ``name``'s slot, claiming a free one the first time any worker sees it."""
+        if name not in self._slots:
+            key = name.encode()[:NAME_SIZE]
+            with self._locked(HEADER_SIZE):
+                for index in range(MAX_SLOTS):
+                    offset = self._offset(index)
+                    stored = self.mm[offset:offset + NAME_SIZE].rstrip(b'\0')
+                    if stored == key:
+                        break
+                    if not stored:
+                        if index == MAX_SLOTS - 1:
+                            # The last slot collects every name that did not get one
+                            key = OVERFLOW.encode()
+                        self.mm[offset:offset + NAME_SIZE] = key.ljust(NAME_SIZE, b'\0')
+                        break
+            self._slots[name] = offset
+        return self._slots[name]
+
+    def record(self, name, seconds, status_code, response_bytes, request_metrics):
+        milliseconds = seconds * 1000
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS)
+        )
+        status_class = f'{min(max(status_code // 100, 2), 5)}xx'
+        with self._lock:
+            mm = self._map()
+            offset = self._slot(name)
+            with self._locked(SLOT.size, offset):
+                values = SLOT.unpack_from(mm, offset)
+                ints = dict(zip(INT_FIELDS, values[1:1 + len(INT_FIELDS)]))
+                floats = dict(zip(FLOAT_FIELDS, values[1 + len(INT_FIELDS):]))
+                ints['requests'] += 1
+                ints[status_class] += 1
+                ints[f'latency_{bucket}'] += 1
+                ints['queries'] += request_metrics.queries
+                ints['response_bytes'] += response_bytes
+                floats['latency'] += seconds
+                floats['db_time'] += request_metrics.db_time
+                floats['serializer_time'] += request_metrics.serializer_time
+                SLOT.pack_into(mm, offset, values[0], *ints.values(), *floats.values())
+
+    def snapshot(self):
+        """``{url name: {field: total}}`` for every endpoint seen so far."""
+        with self._lock:
+            mm = self._map()
+            with self._locked(shared=True):
+                rows = [SLOT.unpack_from(mm, self._offset(index)) for index in range(MAX_SLOTS)]
+        result = {}
+        for values in rows:
+            name = values[0].rstrip(b'\0').decode(errors='replace')
+            if name:
+                result[name] = dict(zip(INT_FIELDS + FLOAT_FIELDS, values[1:]))
+        return result
+
+
+store = SharedMetrics()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition():
+    """Every endpoint's totals in the Prometheus text format, labelled by URL name."""
+    rows = sorted(store.snapshot().items())
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{key}="{_label(label)}"' for key, label in labels)
+            lines.append(f'{PREFIX}_{name}{suffix}{{{label_text}}} {value}')
+
+    metric('requests_total', 'counter', 'Requests by URL name and response status class.', [
+        ('', [('url_name', name), ('status', status_class)], totals[status_class])
+        for name, totals in rows for status_class in STATUS_CLASSES
+    ])
+    histogram = []
+    for name, totals in rows:
+        seen = 0
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            seen += totals[f'latency_{i}']
+            histogram.append(('_bucket', [('url_name', name), ('le', f'{bound / 1000:g}')], seen))
+        histogram.append(('_bucket', [('url_name', name), ('le', '+Inf')], totals['requests']))
+        histogram.append(('_sum', [('url_name', name)], repr(totals['latency'])))
+        histogram.append(('_count', [('url_name', name)], totals['requests']))
+    metric('request_duration_seconds', 'histogram', 'Time from the first middleware in to the response out.', histogram)
+    for name, field, help_text in [
+        ('db_queries_total', 'queries', 'Database queries run by requests.'),
+        ('db_duration_seconds_total', 'db_time', 'Time requests spent in database queries.'),
+        ('serializer_duration_seconds_total', 'serializer_time', "Time requests spent in serializers' data."),
+        ('response_bytes_total', 'response_bytes', 'Response body bytes, when known before streaming.'),
+    ]:
+        metric(name, 'counter', help_text, [
+            ('', [('url_name', url_name)], repr(totals[field]) if field in FLOAT_FIELDS else totals[field])
+            for url_name, totals in rows
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Records the request into the shared table and answers its ``Server-Timing`` header.
+
+    Sits right below ``RequestIDMiddleware``, so the latency it records
+    includes every other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(request_metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        name = match.view_name if match else UNMATCHED
+        if response.streaming:
+            # Streamed bodies are produced after this returns; Content-Length is set when known
+            response_bytes = int(response.get('Content-Length') or 0)
+        else:
+            response_bytes = len(response.content)
+        store.record(name, elapsed, response.status_code, response_bytes, request_metrics)
+        response['Server-Timing'] = request_metrics.server_timing(elapsed)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0013_alter_client_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:38
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+BATCH_SIZE = 1000
+
+def forward_func(apps, schema_editor):
+    RouteRun = apps.get_model("routes", "RouteRun")
+    Checkpoint = apps.get_model("routes", "Checkpoint")
+    totals = dict(
+        Checkpoint.objects.values('route_id').annotate(total=Count('id')).values_list('route_id', 'total')
+    )
+    runs = RouteRun.objects.annotate(
+        route_id=Max('assignment__route_id'),
+        last_order=Max('checkpoint_scans__checkpoint__order'),
+        scans=Count('checkpoint_scans'),
+        last_scan=Max('checkpoint_scans__scanned_at'),
+    ).order_by('pk')
+    batch = []
+    for run in runs.iterator(chunk_size=BATCH_SIZE):
+        run.last_scanned_order = run.last_order or 0
+        run.scanned_count = run.scans
+        run.last_scan_at = run.last_scan
+        run.expected_total = totals.get(run.route_id, 0)
+        batch.append(run)
+        if len(batch) >= BATCH_SIZE:
+            RouteRun.objects.bulk_update(batch, ['last_scanned_order', 'scanned_count', 'last_scan_at', 'expected_total'])
+            batch = []
+    if batch:
+        RouteRun.objects.bulk_update(batch, ['last_scanned_order', 'scanned_count', 'last_scan_at', 'expected_total'])
+
+def reverse_func(apps, schema_editor):
+    pass  # The columns are dropped by the reverse AddField operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0014_route_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routerun',
+            name='expected_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='routerun',
+            name='last_scan_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='routerun',
+            name='last_scanned_order',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='routerun',
+            name='scanned_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(forward_func, reverse_func),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count
+
+def forward_func(apps, schema_editor):
+    # Close duplicate active runs left by the old unlocked start-run path, keeping the newest
+    RouteRun = apps.get_model("routes", "RouteRun")
+    duplicated = list(RouteRun.objects.filter(completed=False).values('assignment_id').annotate(
+        active=Count('id')
+    ).filter(active__gt=1).values_list('assignment_id', flat=True))
+    for assignment_id in duplicated:
+        runs = RouteRun.objects.filter(assignment_id=assignment_id, completed=False).order_by('-start_time', '-id')
+        for run in runs[1:]:
+            run.completed = True
+            run.end_time = run.last_scan_at or run.start_time
+            run.save(update_fields=['completed', 'end_time'])
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward_func, reverse_func),
+    ]
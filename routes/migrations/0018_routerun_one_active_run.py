@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0017_close_duplicate_active_runs'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='routerun',
+            name='routes_rout_assignm_14ea1e_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='routerun',
+            constraint=models.UniqueConstraint(condition=models.Q(('completed', False)), fields=('assignment',), name='routes_routerun_one_active_run'),
+        ),
+    ]
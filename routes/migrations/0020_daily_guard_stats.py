@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:54
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0019_token_revocation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyGuardStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('runs_started', models.PositiveIntegerField(default=0)),
+                ('runs_completed', models.PositiveIntegerField(default=0)),
+                ('completed_duration', models.DurationField(default=datetime.timedelta)),
+                ('checkpoints_scanned', models.PositiveIntegerField(default=0)),
+                ('checkpoints_expected', models.PositiveIntegerField(default=0)),
+                ('incidents', models.PositiveIntegerField(default=0)),
+                ('occurrences', models.PositiveIntegerField(default=0)),
+                ('guard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='routes.route')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['route', 'date'], name='routes_dail_route_i_7c5dd6_idx'), models.Index(fields=['date'], name='routes_dail_date_73dc8a_idx')],
+                'unique_together': {('guard', 'route', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0020_daily_guard_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyguardstats',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='guardassignment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
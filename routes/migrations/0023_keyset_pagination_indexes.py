@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 20:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0022_reportjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['name', 'id'], name='routes_clie_name_45ed94_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='route',
+            index=models.Index(fields=['client', 'name', 'id'], name='routes_rout_client__4a9cdf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['client', 'is_admin'], name='routes_user_client__4f7f9a_idx'),
+        ),
+    ]
@@ -1,14 +1,23 @@
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from . import principal
 
 class Client(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -17,12 +26,24 @@ class UserProfile(models.Model):
     is_admin = models.BooleanField(default=False)
     client = models.ForeignKey(Client, on_delete=models.CASCADE, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'is_admin']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {'Admin' if self.is_admin else 'Guard'} - {self.client.name if self.client else 'No Client'}"
 
 class Route(models.Model):
     name = models.CharField(max_length=100)
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # Touched whenever the route or any of its checkpoints change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'name', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.client.name}"
@@ -37,6 +58,8 @@ class GuardAssignment(models.Model):
     route = models.ForeignKey(Route, related_name='guard_assignments', on_delete=models.CASCADE)
     guard = models.OneToOneField(User, related_name='route_assignment', on_delete=models.CASCADE)
     shift = models.CharField(max_length=10, choices=SHIFT_CHOICES)
+    # Touched whenever the assignment, its runs or its guard change; used as the ETag version
+    updated_at = models.DateTimeField(auto_now=True)
 
     @property
     def active_run(self):
@@ -61,9 +84,22 @@ class RouteRun(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     completed = models.BooleanField(default=False)
 
+    # Denormalized progress, updated in the scan transaction
+    last_scanned_order = models.PositiveIntegerField(default=0)
+    scanned_count = models.PositiveIntegerField(default=0)
+    expected_total = models.PositiveIntegerField(default=0)
+    last_scan_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
+        constraints = [
+            # At most one active run per assignment; also the lookup index for "the active run"
+            models.UniqueConstraint(
+                fields=['assignment'],
+                condition=models.Q(completed=False),
+                name='routes_routerun_one_active_run',
+            ),
+        ]
         indexes = [
-            models.Index(fields=['assignment', 'completed']),
             models.Index(fields=['start_time']),
         ]
 
@@ -71,6 +107,26 @@ class RouteRun(models.Model):
     def incidents(self):
         return self.incident_set.all()
 
+    @property
+    def expected_order(self):
+        return self.last_scanned_order + 1
+
+    PROGRESS_FIELDS = ['last_scanned_order', 'scanned_count', 'last_scan_at', 'expected_total', 'completed', 'end_time']
+
+    def apply_scan(self, order, scanned_at, expected_total):
+        """Advance the in-memory progress; the run completes on its last checkpoint."""
+        self.last_scanned_order = order
+        self.scanned_count += 1
+        self.last_scan_at = scanned_at
+        self.expected_total = expected_total
+        if self.scanned_count >= self.expected_total:
+            self.completed = True
+            self.end_time = scanned_at
+
+    def record_scan(self, order, scanned_at, expected_total):
+        self.apply_scan(order, scanned_at, expected_total)
+        self.save(update_fields=self.PROGRESS_FIELDS)
+
     def mark_as_completed(self):
         self.end_time = timezone.now()
         self.completed = True
@@ -153,6 +209,128 @@ class Occurrence(models.Model):
             models.Index(fields=['timestamp']),
         ]
 
+class IdempotencyKey(models.Model):
+    """First response stored per (user, Idempotency-Key) so mobile retries can be replayed."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    path = models.CharField(max_length=100)
+    # Empty while the first request is still being processed
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'key')
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.path})"
+
+class RevokedToken(models.Model):
+    """Revoked JWT id, kept only until the token would have expired anyway."""
+
+    jti = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+class ClientRevocation(models.Model):
+    """Tokens issued to a client's users before ``revoked_before`` are rejected."""
+
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='token_revocation')
+    revoked_before = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.client.name} < {self.revoked_before}"
+
+class PrincipalInvalidation(models.Model):
+    """A user whose cached principal every worker drops at its next revocation sync."""
+
+    user_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.created_at}"
+
+class DailyGuardStats(models.Model):
+    """Per guard, route and local day totals, kept current by the write endpoints (see ``rollups.py``).
+
+    Runs are counted on the local day they started, together with everything
+    scanned or reported during them.
+    """
+
+    guard = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    runs_started = models.PositiveIntegerField(default=0)
+    runs_completed = models.PositiveIntegerField(default=0)
+    # Sum of end_time - start_time over completed runs
+    completed_duration = models.DurationField(default=timedelta)
+    checkpoints_scanned = models.PositiveIntegerField(default=0)
+    checkpoints_expected = models.PositiveIntegerField(default=0)
+    incidents = models.PositiveIntegerField(default=0)
+    occurrences = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('guard', 'route', 'date')
+        indexes = [
+            models.Index(fields=['route', 'date']),
+            models.Index(fields=['date']),
+        ]
+
+    @property
+    def average_duration(self):
+        return self.completed_duration / self.runs_completed if self.runs_completed else None
+
+    def __str__(self):
+        return f"{self.guard.username} - {self.route.name} - {self.date}"
+
+class ReportJob(models.Model):
+    """Report rendered to a file by ``run_report_worker`` instead of inside a request."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='report_jobs')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='report_jobs')
+    # Hash of client and params; identical requests share a job while it is queued or its file is fresh
+    params_hash = models.CharField(max_length=64)
+    params = models.JSONField(encoder=DjangoJSONEncoder)
+    output = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    file_path = models.CharField(max_length=255, blank=True)
+    rows = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['params_hash', 'status']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.client.name} {self.output} ({self.status})"
+
 # Signal handlers for creating UserProfiles for superusers
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -164,3 +342,65 @@ def save_user_profile(sender, instance, **kwargs):
     if instance.is_superuser and not hasattr(instance, 'userprofile'):
         UserProfile.objects.create(user=instance, is_admin=True)
 
+
+def _cascaded(sender, origin):
+    """Whether a delete comes from deleting a parent row, which takes the rows we would touch with it."""
+    if origin is None:
+        return False
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model is not sender
+
+# Signal handlers keeping the in-process checkpoint index coherent
+@receiver(post_save, sender=Checkpoint)
+@receiver(post_delete, sender=Checkpoint)
+def touch_checkpoint_route(sender, instance, origin=None, **kwargs):
+    from . import checkpoint_index
+    if not _cascaded(sender, origin):
+        Route.objects.filter(pk=instance.route_id).update(updated_at=timezone.now())
+    checkpoint_index.invalidate_route(instance.route_id)
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def invalidate_route_index(sender, instance, **kwargs):
+    from . import checkpoint_index
+    checkpoint_index.invalidate_route(instance.pk)
+
+# Signal handlers dropping cached request principals
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principal(sender, instance, created=False, **kwargs):
+    if not created:
+        principal.invalidate_user(instance.pk)
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_delete, sender=Client)
+def invalidate_owner_principal(sender, instance, **kwargs):
+    principal.invalidate_user(instance.user_id)
+
+@receiver(post_save, sender=Client)
+def invalidate_client_principals(sender, instance, created, **kwargs):
+    # Admins and guards carry the client's active flag in their principals too
+    if created:
+        principal.invalidate_user(instance.user_id)
+    else:
+        principal.invalidate_client(instance)
+
+# Signal handlers bumping the versions behind conditional GETs
+@receiver(post_save, sender=User)
+def touch_guard_assignment(sender, instance, created, **kwargs):
+    if not created:
+        GuardAssignment.objects.filter(guard_id=instance.pk).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def touch_profile_assignment(sender, instance, origin=None, **kwargs):
+    if not _cascaded(sender, origin):
+        GuardAssignment.objects.filter(guard_id=instance.user_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=Client)
+def touch_client_routes_and_assignments(sender, instance, created, **kwargs):
+    if not created:
+        now = timezone.now()
+        Route.objects.filter(client=instance).update(updated_at=now)
+        GuardAssignment.objects.filter(guard__userprofile__client=instance).update(updated_at=now)
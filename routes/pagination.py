@@ -0,0 +1,114 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are read with ``WHERE (ordering) > (last row)`` on an indexed, unique
+ordering ending in ``id``, so a page costs the same at the start of a table as
+at its end, and no ``COUNT(*)`` runs unless ``?count=true`` asks for one.
+
+Pagination is opt-in: a request without ``?cursor=`` or ``?page_size=`` gets
+the plain list it always got.
+"""
+import base64
+import json
+from functools import reduce
+from operator import attrgetter, or_
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .query_planner import optimize
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    ordering = ('id',)
+
+    def __init__(self, ordering=None):
+        if ordering:
+            self.ordering = tuple(ordering)
+        self.getters = [attrgetter(field.replace('__', '.')) for field in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self._page_size(params.get(self.page_size_query_param))
+        self.count = queryset.count() if params.get(self.count_query_param) == 'true' else None
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(self._decode(cursor)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        last = [getter(self.page[-1]) for getter in self.getters]
+        return replace_query_param(url, self.cursor_query_param, self._encode(last))
+
+    def _page_size(self, value):
+        if value is None:
+            return settings.PAGINATION_PAGE_SIZE
+        try:
+            return max(1, min(int(value), settings.PAGINATION_MAX_PAGE_SIZE))
+        except ValueError:
+            return settings.PAGINATION_PAGE_SIZE
+
+    def _after(self, values):
+        """``(f1, f2, ...) > (v1, v2, ...)`` spelled out so any database can use the index."""
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            equal = {self.ordering[j]: values[j] for j in range(i)}
+            conditions.append(Q(**equal, **{f'{field}__gt': values[i]}))
+        return reduce(or_, conditions)
+
+    def _encode(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def _decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise NotFound('Cursor inválido')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Cursor inválido')
+        return values
+
+
+class NameKeysetPagination(KeysetPagination):
+    ordering = ('name', 'id')
+
+
+def paginated_response(request, queryset, serializer_class, ordering):
+    """Serialize ``queryset`` as one keyset page, or whole when pagination was not requested.
+
+    The queryset is planned from the serializer as this request shapes it, so
+    ``?fields=`` and ``?expand=`` narrow the query along with the payload.
+    """
+    context = {'request': request}
+    queryset = optimize(queryset, serializer_class(context=context))
+    paginator = KeysetPagination(ordering)
+    page = paginator.paginate_queryset(queryset, request)
+    if page is None:
+        return Response(serializer_class(queryset.order_by(*ordering), many=True, context=context).data)
+    return paginator.get_paginated_response(serializer_class(page, many=True, context=context).data)
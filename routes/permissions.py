@@ -1,4 +1,8 @@
+import hmac
+
+from django.conf import settings
 from rest_framework import permissions
+from .principal import get_principal
 
 class IsSuperAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -6,13 +10,21 @@ class IsSuperAdmin(permissions.BasePermission):
 
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return hasattr(request.user, 'userprofile') and request.user.userprofile.is_admin
+        return get_principal(request).is_admin
 
 class IsClientUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return hasattr(request.user, 'client')
+        return get_principal(request).role == 'client'
 
 class IsGuardUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return hasattr(request.user, 'userprofile') and not request.user.userprofile.is_admin
+        principal = get_principal(request)
+        return principal.has_profile and not principal.is_admin
+
+class HasMetricsToken(permissions.BasePermission):
+    """A scraper's ``Authorization: Bearer <METRICS_TOKEN>``; nobody passes while the setting is empty."""
 
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        supplied = request.headers.get('Authorization', '')
+        return bool(token) and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
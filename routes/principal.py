@@ -0,0 +1,127 @@
+"""
+Resolved role and client of the requesting user.
+
+Permissions and views used to walk ``request.user.userprofile.client`` through
+``hasattr`` chains, each step a lazy query. The principal is resolved once with
+a single joined query, memoized on the request and cached across requests.
+User, profile and client changes invalidate it through the signals in
+``models.py``. The cache is per worker: an invalidation drops the entry here
+at once and again when the transaction commits, and is then recorded for the
+other workers, which drop it at their next revocation sync (see
+``revocation.py``). ``PRINCIPAL_CACHE_TIMEOUT`` bounds anything missed.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_KEY = 'principal:{}'
+
+
+@dataclass(frozen=True)
+class Principal:
+    user_id: Optional[int]
+    is_active: bool
+    role: Optional[str]
+    is_admin: bool
+    has_profile: bool
+    client_id: Optional[int]
+    client_is_active: bool
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+    @property
+    def is_frozen(self):
+        return self.client_id is not None and not self.client_is_active
+
+
+ANONYMOUS = Principal(None, False, None, False, False, None, True)
+
+
+def principal_from_user(user):
+    """Build the principal from a user whose ``userprofile`` and ``client`` are already loaded."""
+    profile = getattr(user, 'userprofile', None)
+    own_client = getattr(user, 'client', None)
+    client = own_client if own_client is not None else getattr(profile, 'client', None)
+
+    if user.is_superuser:
+        role = 'superadmin'
+    elif own_client is not None:
+        role = 'client'
+    elif profile is not None and profile.is_admin:
+        role = 'admin'
+    else:
+        role = 'guard'
+
+    return Principal(
+        user_id=user.pk,
+        is_active=user.is_active,
+        role=role,
+        is_admin=profile is not None and profile.is_admin,
+        has_profile=profile is not None,
+        client_id=client.pk if client is not None else None,
+        client_is_active=client.is_active if client is not None else True,
+    )
+
+
+def cache_principal(principal):
+    cache.set(CACHE_KEY.format(principal.user_id), principal, settings.PRINCIPAL_CACHE_TIMEOUT)
+
+
+def load_principal(user_id):
+    principal = cache.get(CACHE_KEY.format(user_id))
+    if principal is None:
+        user = User.objects.select_related('userprofile__client', 'client').filter(pk=user_id).first()
+        if user is None:
+            return ANONYMOUS
+        principal = principal_from_user(user)
+        cache_principal(principal)
+    return principal
+
+
+def get_principal(request):
+    """Return the principal for ``request``, resolving it at most once per request."""
+    principal = getattr(request, '_principal', None)
+    if principal is None:
+        user = request.user
+        # ClaimsJWTAuthentication resolves the principal while authenticating
+        principal = getattr(user, 'principal', None)
+        if principal is None:
+            principal = load_principal(user.pk) if user.is_authenticated else ANONYMOUS
+        request._principal = principal
+    return principal
+
+
+def forget(user_ids):
+    """Drop cached principals in this worker only."""
+    cache.delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def _committed(user_ids):
+    from .revocation import store
+
+    # A request may have cached the old state while the transaction was open
+    forget(user_ids)
+    store.invalidate_principals(user_ids)
+
+
+def invalidate_users(user_ids):
+    user_ids = list(user_ids)
+    forget(user_ids)
+    transaction.on_commit(lambda: _committed(user_ids), robust=True)
+
+
+def invalidate_user(user_id):
+    invalidate_users([user_id])
+
+
+def invalidate_client(client):
+    """Invalidate the client's own user and every admin and guard of the client."""
+    user_ids = list(User.objects.filter(userprofile__client=client).values_list('id', flat=True))
+    user_ids.append(client.user_id)
+    invalidate_users(user_ids)
@@ -0,0 +1,132 @@
+"""
+Derive ``select_related`` / ``prefetch_related`` / ``only`` from a serializer.
+
+``optimize(queryset, serializer)`` walks the readable fields of a serializer,
+nested serializers included, and follows each field's ``source`` through the
+model's relations:
+
+- concrete fields end up in ``only()``;
+- forward foreign keys and one-to-one relations (either side) are joined with
+  ``select_related``;
+- reverse foreign keys and many-to-many relations get a ``Prefetch`` whose
+  queryset is planned from the nested serializer in turn.
+
+A ``SerializerMethodField``, a ``source='*'`` or a source that is not a model
+field (a property, an annotation) can read anything, so the model it sits on
+is loaded whole: the plan drops ``only()`` rather than risk a deferred-field
+query per row. Relations the queryset already selects or prefetches are left
+as the view declared them.
+"""
+import re
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+DISPLAY_METHOD = re.compile(r'^get_(\w+)_display$')
+
+
+class QueryPlan:
+    def __init__(self):
+        self.select = set()
+        self.prefetch = {}
+        self.only = set()
+        self.restricted = True
+
+
+def _serializer(serializer):
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    return serializer
+
+
+def build_plan(serializer, model, existing_prefetch=()):
+    plan = QueryPlan()
+    _walk(_serializer(serializer), model, '', plan, set(existing_prefetch))
+    return plan
+
+
+def _walk(serializer, model, prefix, plan, existing_prefetch):
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            plan.restricted = False
+            continue
+        _follow(field, field.source_attrs, model, prefix, plan, existing_prefetch)
+
+
+def _follow(field, attrs, model, prefix, plan, existing_prefetch):
+    name, rest = attrs[0], attrs[1:]
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        display = DISPLAY_METHOD.match(name)
+        if display and not rest:
+            plan.only.add(prefix + display.group(1))
+        else:
+            plan.restricted = False
+        return
+
+    path = prefix + name
+    if not model_field.is_relation:
+        plan.only.add(path)
+        return
+
+    nested = _serializer(field) if isinstance(field, serializers.BaseSerializer) and not rest else None
+    if model_field.one_to_many or model_field.many_to_many:
+        if path not in existing_prefetch and path not in plan.prefetch:
+            plan.prefetch[path] = _prefetch(path, model_field, nested)
+        if rest:
+            plan.restricted = False
+        return
+
+    if model_field.concrete:
+        plan.only.add(path)
+    if rest or nested is not None:
+        plan.select.add(path)
+        if rest:
+            _follow(field, rest, model_field.related_model, path + '__', plan, existing_prefetch)
+        else:
+            _walk(nested, model_field.related_model, path + '__', plan, existing_prefetch)
+
+
+def _prefetch(path, relation, serializer):
+    queryset = relation.related_model._default_manager.all()
+    if serializer is None:
+        return Prefetch(path, queryset=queryset)
+    # The prefetch matches rows back to their parent through this foreign key
+    back_reference = relation.field.name if relation.one_to_many else None
+    return Prefetch(path, queryset=optimize(queryset, serializer, back_reference))
+
+
+def _select_related_paths(select_related, prefix=''):
+    if not isinstance(select_related, dict):
+        return []
+    paths = []
+    for name, nested in select_related.items():
+        paths.append(prefix + name)
+        paths.extend(_select_related_paths(nested, prefix + name + '__'))
+    return paths
+
+
+def optimize(queryset, serializer, *required_fields):
+    """Return ``queryset`` with the joins, prefetches and columns ``serializer`` reads."""
+    existing_prefetch = [
+        lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+        for lookup in queryset._prefetch_related_lookups
+    ]
+    plan = build_plan(serializer, queryset.model, existing_prefetch)
+
+    if plan.select:
+        queryset = queryset.select_related(*sorted(plan.select))
+    if plan.prefetch:
+        queryset = queryset.prefetch_related(*plan.prefetch.values())
+    deferred, defer = queryset.query.deferred_loading
+    if plan.restricted and not deferred and defer:
+        columns = plan.only | {field for field in required_fields if field}
+        columns.update(_select_related_paths(queryset.query.select_related))
+        queryset = queryset.only(*sorted(columns))
+    return queryset
@@ -0,0 +1,100 @@
+"""
+Date-range patrol reports.
+
+Dates are local (``TIME_ZONE``) calendar days. They are turned into aware
+``[start, end)`` timestamp bounds so the run query compares ``start_time``
+directly and can use its index, instead of ``start_time__date`` which converts
+every row's timezone in SQL. A report for any number of guards and days costs
+one query for the guards plus one each for runs, scans, incidents and
+occurrences.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import RouteRun, CheckpointScan
+from .query_planner import optimize
+from .serializers import ReportCheckpointScanSerializer, ReportRouteRunSerializer
+
+
+class ReportError(ValueError):
+    pass
+
+
+def parse_report_date(value, default=None):
+    if value in (None, ''):
+        return default if default is not None else timezone.localdate()
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ReportError(f'Fecha inválida: {value}. Use el formato AAAA-MM-DD')
+    return parsed
+
+
+def local_day_bounds(date_from, date_to):
+    """Aware ``[start, end)`` bounds covering the local days ``date_from`` to ``date_to``."""
+    start = timezone.make_aware(datetime.combine(date_from, time.min))
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    return start, end
+
+
+def report_route_runs(start, end, guard_ids):
+    scans = optimize(CheckpointScan.objects.order_by('scanned_at'), ReportCheckpointScanSerializer, 'route_run')
+    runs = RouteRun.objects.filter(
+        assignment__guard_id__in=guard_ids,
+        start_time__gte=start,
+        start_time__lt=end,
+    ).select_related('assignment').prefetch_related(
+        Prefetch('checkpoint_scans', queryset=scans),
+    ).order_by('start_time')
+    return optimize(runs, ReportRouteRunSerializer)
+
+
+def build_report(client_id, date_from, date_to, guard_ids=None):
+    if date_to < date_from:
+        raise ReportError('La fecha final debe ser posterior a la fecha inicial')
+    if (date_to - date_from).days + 1 > settings.REPORT_MAX_DAYS:
+        raise ReportError(f'El rango no puede superar {settings.REPORT_MAX_DAYS} días')
+
+    guards = User.objects.filter(
+        is_staff=False,
+        userprofile__is_admin=False,
+        userprofile__client_id=client_id,
+    ).order_by('username')
+    if guard_ids is not None:
+        guards = guards.filter(id__in=guard_ids)
+    guards = list(guards.only('id', 'username'))
+
+    start, end = local_day_bounds(date_from, date_to)
+    runs_by_guard = defaultdict(lambda: defaultdict(list))
+    route_runs = list(report_route_runs(start, end, [guard.id for guard in guards])) if guards else []
+    serialized_runs = ReportRouteRunSerializer(route_runs, many=True).data
+    for run, data in zip(route_runs, serialized_runs):
+        day = timezone.localtime(run.start_time).date()
+        runs_by_guard[run.assignment.guard_id][day].append(data)
+
+    return {
+        'client_id': client_id,
+        'date_from': date_from,
+        'date_to': date_to,
+        'guards': [
+            {
+                'id': guard.id,
+                'username': guard.username,
+                'days': [
+                    {'date': day, 'route_runs': runs}
+                    for day, runs in sorted(runs_by_guard[guard.id].items())
+                ],
+            }
+            for guard in guards
+        ],
+    }
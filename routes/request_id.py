@@ -0,0 +1,49 @@
+"""
+Request ids tying a client's report to the server's logs.
+
+``RequestIDMiddleware`` keeps the caller's ``X-Request-ID`` when it is a plain
+token, so the mobile app can send its own, and makes one otherwise. The id is
+held in a context variable while the request runs and returned in the
+response header. ``RequestIDFilter``, set on the log handlers in
+``settings.LOGGING``, stamps every record with it, so ``logger`` calls in the
+views carry the id without being handed it.
+
+Importing this module must not touch models: ``LOGGING`` loads the filter
+before the apps are ready.
+"""
+import contextvars
+import logging
+import re
+import uuid
+
+HEADER = 'X-Request-ID'
+VALID_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def get():
+    """The current request's id, or ``None`` outside a request."""
+    return _request_id.get()
+
+
+class RequestIDFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get() or '-'
+        return True
+
+
+class RequestIDMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        supplied = request.headers.get(HEADER, '')
+        request.request_id = supplied if VALID_ID.match(supplied) else uuid.uuid4().hex
+        token = _request_id.set(request.request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response[HEADER] = request.request_id
+        return response
@@ -0,0 +1,157 @@
+"""
+Token revocation with an in-memory fast path.
+
+Revocations are written to the compact ``RevokedToken`` and ``ClientRevocation``
+tables and mirrored into a per-worker store. Each worker pulls the rows added by
+other workers at most every ``TOKEN_REVOCATION_SYNC_INTERVAL`` seconds, so a
+check is a couple of dict/set lookups. Revoked ids live in buckets keyed by
+their expiry and whole buckets are dropped once every token in them has
+expired, so memory tracks the number of live revoked tokens only.
+
+The same sync pulls ``PrincipalInvalidation`` rows and drops those users'
+cached principals, so a role change, deactivation or deletion handled by one
+worker reaches the others within the sync interval too.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import principal
+from .models import RevokedToken, ClientRevocation, PrincipalInvalidation
+
+
+class TimeBucketedSet:
+    """Set of token ids grouped by expiry bucket; a lookup needs the token's ``exp``."""
+
+    def __init__(self, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+        self._buckets = {}
+
+    def _bucket(self, exp):
+        return int(exp // self.bucket_seconds)
+
+    def add(self, jti, exp):
+        self._buckets.setdefault(self._bucket(exp), set()).add(jti)
+
+    def contains(self, jti, exp):
+        bucket = self._buckets.get(self._bucket(exp))
+        return bucket is not None and jti in bucket
+
+    def purge(self, now):
+        for key in [key for key in self._buckets if (key + 1) * self.bucket_seconds <= now]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+
+class RevocationStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = TimeBucketedSet(settings.TOKEN_REVOCATION_BUCKET_SECONDS)
+        self._client_cutoffs = {}
+        self._last_token_id = 0
+        self._last_client_cutoff = None
+        self._last_invalidation_sync = None
+        self._next_sync = 0.0
+
+    def sync(self, force=False):
+        """Pull revocations written by other workers since the last sync."""
+        if not force and time.monotonic() < self._next_sync:
+            return
+        with self._lock:
+            if not force and time.monotonic() < self._next_sync:
+                return
+            now = time.time()
+            for token_id, jti, expires_at in RevokedToken.objects.filter(
+                id__gt=self._last_token_id
+            ).order_by('id').values_list('id', 'jti', 'expires_at'):
+                self._last_token_id = token_id
+                if expires_at.timestamp() > now:
+                    self._tokens.add(jti, expires_at.timestamp())
+
+            revocations = ClientRevocation.objects.all()
+            if self._last_client_cutoff is not None:
+                revocations = revocations.filter(revoked_before__gte=self._last_client_cutoff)
+            for client_id, revoked_before in revocations.values_list('client_id', 'revoked_before'):
+                self._client_cutoffs[client_id] = revoked_before.timestamp()
+                if self._last_client_cutoff is None or revoked_before > self._last_client_cutoff:
+                    self._last_client_cutoff = revoked_before
+
+            started = timezone.now()
+            invalidations = PrincipalInvalidation.objects.all()
+            if self._last_invalidation_sync is not None:
+                # Overlap the previous sync: a row commits a moment after its created_at
+                invalidations = invalidations.filter(created_at__gte=self._last_invalidation_sync - timedelta(seconds=1))
+            principal.forget(set(invalidations.values_list('user_id', flat=True)))
+            self._last_invalidation_sync = started
+
+            self._tokens.purge(now)
+            self._next_sync = time.monotonic() + settings.TOKEN_REVOCATION_SYNC_INTERVAL
+
+    def is_revoked(self, payload, exact=False):
+        """Check the in-memory store; ``exact`` also asks the table about the token id.
+
+        The exact check covers tokens revoked by another worker since this
+        worker's last sync and is used on the (rare) refresh path only.
+        """
+        self.sync()
+        jti = payload.get(api_settings.JTI_CLAIM)
+        if jti and self._tokens.contains(jti, payload.get('exp', 0)):
+            return True
+        cutoff = self._client_cutoffs.get(payload.get('client_id'))
+        if cutoff is not None and payload.get('iat', 0) < cutoff:
+            return True
+        return exact and bool(jti) and RevokedToken.objects.filter(jti=jti).exists()
+
+    def revoke_token(self, payload):
+        jti = payload[api_settings.JTI_CLAIM]
+        exp = payload['exp']
+        RevokedToken.objects.bulk_create(
+            [RevokedToken(jti=jti, expires_at=datetime.fromtimestamp(exp, tz=dt_timezone.utc))],
+            ignore_conflicts=True,
+        )
+        with self._lock:
+            self._tokens.add(jti, exp)
+
+    def revoke_client(self, client_id):
+        """Revoke every token issued so far to the client's users."""
+        now = timezone.now()
+        ClientRevocation.objects.update_or_create(client_id=client_id, defaults={'revoked_before': now})
+        with self._lock:
+            self._client_cutoffs[client_id] = now.timestamp()
+
+    def invalidate_principals(self, user_ids):
+        """Have every worker drop these users' cached principals at its next sync."""
+        PrincipalInvalidation.objects.bulk_create([PrincipalInvalidation(user_id=user_id) for user_id in user_ids])
+        # Principals cached before the oldest remaining row have expired everywhere by now
+        PrincipalInvalidation.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=settings.PRINCIPAL_CACHE_TIMEOUT)
+        ).delete()
+
+
+store = RevocationStore()
+
+
+class RevocableRefreshToken(RefreshToken):
+    """Refresh token checked against, and blacklisted into, the revocation store."""
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if store.is_revoked(self.payload, exact=True):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        store.revoke_token(self.payload)
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
@@ -0,0 +1,91 @@
+"""
+Maintenance of the ``DailyGuardStats`` rollup.
+
+Write endpoints call ``record`` inside their transaction with the increments
+their change implies; it is a single ``UPDATE ... SET x = x + n`` on the row of
+the run's guard, route and local start day, inserting the row the first time.
+Only the guard's own requests touch that row, and they are already serialized
+by the assignment lock. ``rebuild`` recomputes a date range from the event
+tables for backfills and repairs.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyGuardStats, RouteRun, Incident, Occurrence
+from .reports import local_day_bounds
+
+
+def completion(run):
+    """Increments for ``run`` having just been completed."""
+    return {'runs_completed': 1, 'completed_duration': run.end_time - run.start_time}
+
+
+def record(assignment, run, **increments):
+    """Add ``increments`` to the stats row of ``run``, which belongs to ``assignment``."""
+    increments = {field: value for field, value in increments.items() if value}
+    if not increments:
+        return
+    key = {
+        'guard_id': assignment.guard_id,
+        'route_id': assignment.route_id,
+        'date': timezone.localtime(run.start_time).date(),
+    }
+    updates = {field: F(field) + value for field, value in increments.items()}
+    updates['updated_at'] = timezone.now()
+    if DailyGuardStats.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            DailyGuardStats.objects.create(**key, **increments)
+    except IntegrityError:
+        DailyGuardStats.objects.filter(**key).update(**updates)
+
+
+def rebuild(date_from, date_to):
+    """Recompute the stats of the local days ``date_from`` to ``date_to`` from the event tables."""
+    start, end = local_day_bounds(date_from, date_to)
+    key_fields = ('stats_guard', 'stats_route', 'stats_day')
+    rows = defaultdict(dict)
+
+    runs = RouteRun.objects.filter(start_time__gte=start, start_time__lt=end).annotate(
+        stats_guard=F('assignment__guard_id'),
+        stats_route=F('assignment__route_id'),
+        stats_day=TruncDate('start_time'),
+    ).values(*key_fields).annotate(
+        runs_started=Count('id'),
+        runs_completed=Count('id', filter=Q(completed=True, end_time__isnull=False)),
+        completed_duration=Sum(
+            ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField()),
+            filter=Q(completed=True, end_time__isnull=False),
+        ),
+        checkpoints_scanned=Sum('scanned_count'),
+        checkpoints_expected=Sum('expected_total'),
+    )
+    for row in runs:
+        rows[tuple(row.pop(field) for field in key_fields)].update(row)
+
+    for model, field in ((Incident, 'incidents'), (Occurrence, 'occurrences')):
+        counts = model.objects.filter(
+            route_run__start_time__gte=start, route_run__start_time__lt=end
+        ).annotate(
+            stats_guard=F('route_run__assignment__guard_id'),
+            stats_route=F('route_run__assignment__route_id'),
+            stats_day=TruncDate('route_run__start_time'),
+        ).values(*key_fields).annotate(total=Count('id'))
+        for row in counts:
+            rows[tuple(row[field_name] for field_name in key_fields)][field] = row['total']
+
+    with transaction.atomic():
+        DailyGuardStats.objects.filter(date__gte=date_from, date__lte=date_to).delete()
+        DailyGuardStats.objects.bulk_create([
+            DailyGuardStats(
+                guard_id=guard_id, route_id=route_id, date=day,
+                **{field: value for field, value in values.items() if value is not None}
+            )
+            for (guard_id, route_id, day), values in rows.items()
+        ])
+    return len(rows)
@@ -1,8 +1,77 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
-from .models import Client, CheckpointScan, Checkpoint, RouteRun, GuardAssignment, Route, UserProfile, Incident, Occurrence
+from django.core.exceptions import FieldDoesNotExist
+from .models import Client, CheckpointScan, Checkpoint, RouteRun, GuardAssignment, Route, UserProfile, Incident, Occurrence, ReportJob
 
-class ClientSerializer(serializers.ModelSerializer):
+
+def _paths(value):
+    return [path.strip() for path in value.split(',') if path.strip()] if value is not None else None
+
+
+def _subpaths(paths, name):
+    if paths is None:
+        return None
+    return [path.split('.', 1)[1] for path in paths if path.startswith(name + '.')] or None
+
+
+class DynamicFieldsMixin:
+    """Sparse fieldsets (``?fields=``) and relation expansion (``?expand=``).
+
+    ``fields`` keeps only the listed fields. ``expand`` lists the nested
+    serializers to embed; the others collapse to the related id, or are left
+    out for relations without a foreign key column. Without ``expand`` every
+    nested serializer is embedded as before. Both take dotted paths for nested
+    serializers (``fields=id,route.name&expand=route``) and are read from the
+    request of the top-level serializer only. They shape output, so write
+    requests ignore them and validate every field.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = kwargs.get('context', {}).get('request')
+        if request is not None and request.method in SAFE_METHODS and fields is None and expand is None:
+            fields = _paths(request.query_params.get('fields'))
+            expand = _paths(request.query_params.get('expand'))
+
+        if fields is not None:
+            keep = {path.split('.', 1)[0] for path in fields}
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+        expanded = None if expand is None else {path.split('.', 1)[0] for path in expand}
+        for name, field in list(self.fields.items()):
+            if not isinstance(field, serializers.BaseSerializer):
+                continue
+            if expanded is not None and name not in expanded:
+                self._collapse(name, field)
+            elif _subpaths(fields, name) or _subpaths(expand, name) or expand is not None:
+                self.fields[name] = self._narrow(field, _subpaths(fields, name), _subpaths(expand, name) or [])
+
+    def _collapse(self, name, field):
+        self.fields.pop(name)
+        try:
+            relation = self.Meta.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return
+        if relation.many_to_one or (relation.one_to_one and relation.concrete):
+            source = field.source if field.source != name else None
+            self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, source=source)
+
+    @staticmethod
+    def _narrow(field, fields, expand):
+        if isinstance(field, serializers.ListSerializer):
+            serializer_class, kwargs = field.child.__class__, {**field.child._kwargs, 'many': True}
+        else:
+            serializer_class, kwargs = field.__class__, dict(field._kwargs)
+        if not issubclass(serializer_class, DynamicFieldsMixin):
+            return serializer_class(*field._args, **kwargs)
+        return serializer_class(*field._args, fields=fields, expand=expand, **kwargs)
+
+
+class ClientSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     username = serializers.CharField(write_only=True)
     password = serializers.CharField(write_only=True)
     
@@ -18,14 +87,14 @@ class ClientSerializer(serializers.ModelSerializer):
         client = Client.objects.create(user=user, **validated_data)
         return client
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     client = ClientSerializer(read_only=True)
 
     class Meta:
         model = UserProfile
         fields = ['is_admin', 'client']
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     profile = UserProfileSerializer(source='userprofile', required=False)
     password = serializers.CharField(write_only=True, required=False)
 
@@ -62,18 +131,12 @@ class UserSerializer(serializers.ModelSerializer):
 
         return instance
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        if hasattr(instance, 'userprofile'):
-            representation['profile'] = UserProfileSerializer(instance.userprofile).data
-        return representation
-
-class CheckpointSerializer(serializers.ModelSerializer):
+class CheckpointSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Checkpoint
         fields = ['id', 'name', 'qr_code', 'order']
 
-class RouteSerializer(serializers.ModelSerializer):
+class RouteSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     checkpoints = CheckpointSerializer(many=True)
     client = ClientSerializer(read_only=True)
     client_id = serializers.IntegerField(write_only=True)
@@ -160,7 +223,10 @@ class AssignmentRouteRunSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RouteRun
-        fields = ['id', 'start_time', 'end_time', 'completed', 'latest_scan']
+        fields = [
+            'id', 'start_time', 'end_time', 'completed', 'latest_scan',
+            'last_scanned_order', 'scanned_count', 'expected_total', 'last_scan_at'
+        ]
 
     def get_latest_scan(self, obj):
         latest_scan = obj.checkpoint_scans.order_by('-scanned_at').first()
@@ -168,7 +234,7 @@ class AssignmentRouteRunSerializer(serializers.ModelSerializer):
             return AssignmentCheckpointScanSerializer(latest_scan).data
         return None
 
-class GuardAssignmentListSerializer(serializers.ModelSerializer):
+class GuardAssignmentListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Lightweight list for admin dashboards (no nested checkpoints)."""
 
     guard = serializers.SerializerMethodField()
@@ -192,7 +258,7 @@ class GuardAssignmentListSerializer(serializers.ModelSerializer):
         return obj.route_runs.filter(completed=False).exists()
 
 
-class OptimizedGuardAssignmentSerializer(serializers.ModelSerializer):
+class OptimizedGuardAssignmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     guard = serializers.SerializerMethodField()
     route = RouteSerializer(read_only=True)
     active_run = serializers.SerializerMethodField()
@@ -239,3 +305,34 @@ class ReportRouteRunSerializer(serializers.ModelSerializer):
         model = RouteRun
         fields = ['id', 'start_time', 'end_time', 'completed', 'checkpoint_scans', 'incidents', 'occurrences']
 
+
+class SyncEventSerializer(serializers.Serializer):
+    """Envelope of one queued offline event; the payload is validated per type."""
+
+    EVENT_TYPES = ['scan', 'incident', 'occurrence']
+
+    id = serializers.CharField(required=False, max_length=64)
+    type = serializers.ChoiceField(choices=EVENT_TYPES)
+    timestamp = serializers.DateTimeField(required=False)
+    qr_code = serializers.CharField(required=False, max_length=100)
+
+    def validate(self, attrs):
+        if attrs['type'] == 'scan' and not attrs.get('qr_code'):
+            raise serializers.ValidationError({'qr_code': 'Se requiere el código QR'})
+        return attrs
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'status', 'output', 'params', 'rows', 'error',
+            'created_at', 'started_at', 'finished_at', 'expires_at', 'download_url',
+        ]
+
+    def get_download_url(self, obj):
+        if obj.status != ReportJob.DONE:
+            return None
+        return reverse('download_report_job', args=[obj.pk], request=self.context.get('request'))
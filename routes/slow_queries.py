@@ -0,0 +1,231 @@
+"""
+Slow query log: queries over ``SLOW_QUERY_THRESHOLD_MS`` with where they came from.
+
+``SlowQueryMiddleware`` (and ``run_report_worker``, around each job) wraps the
+connection with ``connection.execute_wrapper``. A query slower than the
+threshold is kept with its normalized SQL, its parameters, the innermost
+``routes`` frame that ran it and the view in ``routes/views.py`` it ran under.
+A ``SLOW_QUERY_EXPLAIN_RATE`` share of slow ``SELECT``s also gets the plan,
+with ``EXPLAIN ANALYZE`` on Postgres when ``SLOW_QUERY_EXPLAIN_ANALYZE`` is set
+and no transaction is open (it runs the query a second time). Entries are
+recorded, and plans taken, when the WSGI server closes the response after
+sending it: the worker stays busy for the plan's ``explain_ms``, the client
+does not wait for it. Streamed responses run their queries after the
+middleware returns and are not sampled; large exports go through report jobs,
+which are.
+
+Entries go to a ring buffer of fixed-size slots in ``SLOW_QUERY_FILE`` shared
+by every worker, which superadmins browse at ``/api/slow-queries/``.
+"""
+import json
+import logging
+import os
+import random
+import re
+import struct
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .mapped_file import MappedFile
+from .request_id import get as get_request_id
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RMSLOW01'
+COUNTER = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+SLOT_SIZE = 8192
+MAX_SQL = 2000
+MAX_PARAMS = 500
+MAX_EXPLAIN = 4000
+
+ROUTES_DIR = os.path.dirname(os.path.abspath(__file__))
+VIEWS_FILE = os.path.join(ROUTES_DIR, 'views.py')
+INSTRUMENTATION = {
+    os.path.join(ROUTES_DIR, name) for name in ('slow_queries.py', 'metrics.py', 'mapped_file.py')
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|%\(\w+\)s')
+_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Replace literals and placeholders with ``?`` and collapse lists, so one query shape reads the same."""
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('?, ...', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def call_sites():
+    """``(call site, view)`` as ``path:line in function``: the innermost ``routes`` frame and the view frame."""
+    call_site = view = None
+    frame = sys._getframe(1)
+    while frame is not None and view is None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(ROUTES_DIR) and filename not in INSTRUMENTATION:
+            where = f'{os.path.relpath(filename, os.path.dirname(ROUTES_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}'
+            call_site = call_site or where
+            if filename == VIEWS_FILE:
+                view = where
+        frame = frame.f_back
+    return call_site, view
+
+
+def explain(db, sql, params):
+    analyze = settings.SLOW_QUERY_EXPLAIN_ANALYZE and db.vendor == 'postgresql' and not db.in_atomic_block
+    prefix = db.ops.explain_query_prefix(analyze=True) if analyze else db.ops.explain_query_prefix()
+    # A bare backend cursor: no execute wrappers, no query log, so the EXPLAIN is not itself measured
+    cursor = db.create_cursor()
+    try:
+        cursor.execute(f'{prefix} {sql}', params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog(MappedFile):
+    """Ring buffer of JSON entries; a counter after the magic gives each entry its sequence number."""
+
+    setting = 'SLOW_QUERY_FILE'
+    magic = MAGIC
+
+    @property
+    def capacity(self):
+        return settings.SLOW_QUERY_LOG_SIZE
+
+    @property
+    def size(self):
+        return len(MAGIC) + COUNTER.size + self.capacity * SLOT_SIZE
+
+    def _offset(self, seq):
+        return len(MAGIC) + COUNTER.size + (seq % self.capacity) * SLOT_SIZE
+
+    def record(self, entry):
+        with self._lock:
+            mm = self._map()
+            with self._locked(COUNTER.size, len(MAGIC)):
+                seq = COUNTER.unpack_from(mm, len(MAGIC))[0]
+                COUNTER.pack_into(mm, len(MAGIC), seq + 1)
+            data = self._encode(dict(entry, seq=seq))
+            offset = self._offset(seq)
+            with self._locked(SLOT_SIZE, offset):
+                LENGTH.pack_into(mm, offset, len(data))
+                mm[offset + LENGTH.size:offset + LENGTH.size + len(data)] = data
+
+    def _encode(self, entry):
+        data = json.dumps(entry).encode()
+        if len(data) > SLOT_SIZE - LENGTH.size:
+            # Oversized plans and SQL are cut further rather than dropping the entry
+            entry.update(explain=entry['explain'] and entry['explain'][:500], sql=entry['sql'][:500])
+            data = json.dumps(entry).encode()[:SLOT_SIZE - LENGTH.size]
+        return data
+
+    def entries(self):
+        """Entries still in the buffer, newest first."""
+        with self._lock:
+            mm = self._map()
+            with self._locked(shared=True):
+                slots = [bytes(mm[self._offset(i):self._offset(i) + SLOT_SIZE]) for i in range(self.capacity)]
+        entries = []
+        for slot in slots:
+            length = LENGTH.unpack_from(slot)[0]
+            if length:
+                try:
+                    entries.append(json.loads(slot[LENGTH.size:LENGTH.size + length]))
+                except ValueError:
+                    continue
+        return sorted(entries, key=lambda entry: -entry['seq'])
+
+
+log = SlowQueryLog()
+
+
+class SlowQuerySampler:
+    """``execute_wrapper`` hook collecting queries over the threshold for one request or job.
+
+    Plans are taken in ``flush``, after the response is sent or the job is
+    done: the slow query's own cursor may still be open until then, and its
+    transaction is over by then.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.pending = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = time.perf_counter() - start
+        if elapsed * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS and not many:
+            call_site, view = call_sites()
+            self.pending.append((sql, params, elapsed, call_site, view, timezone.now(), get_request_id()))
+        return result
+
+    def flush(self):
+        for sql, params, elapsed, call_site, view, at, request_id in self.pending:
+            try:
+                plan = explain_ms = None
+                if sql.lstrip().upper().startswith(('SELECT', 'WITH')) and random.random() < settings.SLOW_QUERY_EXPLAIN_RATE:
+                    start = time.perf_counter()
+                    plan = explain(connection, sql, params)[:MAX_EXPLAIN]
+                    explain_ms = round((time.perf_counter() - start) * 1000, 1)
+                log.record({
+                    'at': at.isoformat(),
+                    'duration_ms': round(elapsed * 1000, 1),
+                    'sql': normalize(sql)[:MAX_SQL],
+                    'params': repr(params)[:MAX_PARAMS],
+                    'call_site': call_site,
+                    'view': view,
+                    'request': self.label,
+                    'request_id': request_id,
+                    'explain': plan,
+                    'explain_ms': explain_ms,
+                    'pid': os.getpid(),
+                })
+            except Exception:
+                # Never fail the request over its instrumentation
+                logger.exception('Could not record slow query')
+        self.pending = []
+
+
+@contextmanager
+def sampling(label):
+    """Record slow queries run on the default connection inside the block."""
+    sampler = SlowQuerySampler(label)
+    try:
+        with connection.execute_wrapper(sampler):
+            yield
+    finally:
+        sampler.flush()
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampler = SlowQuerySampler(f'{request.method} {request.path}')
+        with connection.execute_wrapper(sampler):
+            response = self.get_response(request)
+        if sampler.pending:
+            close = response.close
+
+            def flush_and_close():
+                # The server closes the response once it is sent; Django's own closers may drop the connection
+                try:
+                    sampler.flush()
+                finally:
+                    close()
+
+            response.close = flush_and_close
+        return response
@@ -0,0 +1,119 @@
+"""
+Test data factories.
+
+``seed`` builds whole tenants with ``bulk_create``, so a fixture of a few
+thousand rows takes a fraction of a second. The query-budget suite seeds the
+same shape at two sizes to check that no endpoint's query count follows the
+data.
+"""
+import itertools
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from ..models import (
+    Client, UserProfile, Route, Checkpoint, GuardAssignment, RouteRun, CheckpointScan, Incident, Occurrence,
+)
+from .. import rollups
+
+PASSWORD = 'secret'
+
+_sequence = itertools.count(1)
+
+
+def create_guard_on_route(checkpoint_count=5):
+    client_user = User.objects.create_user(username='client', password=PASSWORD)
+    client = Client.objects.create(user=client_user, name='Client')
+    guard = User.objects.create_user(username='guard', password=PASSWORD)
+    UserProfile.objects.create(user=guard, client=client)
+    route = Route.objects.create(name='Route', client=client)
+    for order in range(1, checkpoint_count + 1):
+        Checkpoint.objects.create(route=route, name=f'Checkpoint {order}', qr_code=f'qr-{order}', order=order)
+    assignment = GuardAssignment.objects.create(route=route, guard=guard, shift='day')
+    return guard, assignment
+
+
+class Tenant:
+    """What ``seed`` created for one client."""
+
+    def __init__(self, client, admin, routes, guards, assignments):
+        self.client = client
+        self.admin = admin
+        self.routes = routes
+        self.guards = guards
+        self.assignments = assignments
+
+
+def _users(usernames, **fields):
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([User(username=username, password=password, **fields) for username in usernames])
+    return list(User.objects.filter(username__in=usernames).order_by('id'))
+
+
+def seed(clients=1, guards=2, routes=2, checkpoints=5, runs=2):
+    """Create ``clients`` tenants and return their ``Tenant`` objects.
+
+    Each has an admin, ``routes`` routes of ``checkpoints`` checkpoints and
+    ``guards`` guards assigned round-robin. Every guard completed ``runs``
+    runs today, scanning every checkpoint and reporting one incident and one
+    occurrence per run; ``DailyGuardStats`` is rebuilt to match.
+    """
+    day = timezone.localdate()
+    day_start = timezone.make_aware(datetime.combine(day, time.min))
+    tenants = []
+    for _ in range(clients):
+        n = next(_sequence)
+        client_user, admin = _users([f'client-{n}', f'admin-{n}'])
+        admin.is_staff = True
+        admin.save(update_fields=['is_staff'])
+        client = Client.objects.create(user=client_user, name=f'Client {n}')
+        guard_users = _users([f'guard-{n}-{i}' for i in range(guards)])
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=admin, client=client, is_admin=True)]
+            + [UserProfile(user=guard, client=client) for guard in guard_users]
+        )
+
+        client_routes = Route.objects.bulk_create([Route(name=f'Route {n}-{i}', client=client) for i in range(routes)])
+        route_checkpoints = {}
+        for route in client_routes:
+            route_checkpoints[route.id] = Checkpoint.objects.bulk_create([
+                Checkpoint(route=route, name=f'Checkpoint {order}', qr_code=f'qr-{route.id}-{order}', order=order)
+                for order in range(1, checkpoints + 1)
+            ])
+        assignments = GuardAssignment.objects.bulk_create([
+            GuardAssignment(route=client_routes[i % routes], guard=guard, shift='day')
+            for i, guard in enumerate(guard_users)
+        ])
+
+        route_runs = RouteRun.objects.bulk_create([
+            RouteRun(
+                assignment=assignment,
+                start_time=day_start + timedelta(minutes=10 * i),
+                end_time=day_start + timedelta(minutes=10 * i + checkpoints),
+                completed=True,
+                last_scanned_order=checkpoints,
+                scanned_count=checkpoints,
+                expected_total=checkpoints,
+                last_scan_at=day_start + timedelta(minutes=10 * i + checkpoints),
+            )
+            for assignment in assignments for i in range(runs)
+        ])
+        CheckpointScan.objects.bulk_create([
+            CheckpointScan(checkpoint=checkpoint, route_run=run, scanned_at=run.start_time + timedelta(minutes=checkpoint.order))
+            for run in route_runs for checkpoint in route_checkpoints[run.assignment.route_id]
+        ])
+        Incident.objects.bulk_create([
+            Incident(guard_id=run.assignment.guard_id, route_run=run, description='Incident', timestamp=run.start_time)
+            for run in route_runs
+        ])
+        Occurrence.objects.bulk_create([
+            Occurrence(route_run=run, occurrence_type='person', name='Visitor', dni='12345678', motive='Visit',
+                       timestamp=run.start_time)
+            for run in route_runs
+        ])
+        tenants.append(Tenant(client, admin, client_routes, guard_users, assignments))
+
+    rollups.rebuild(day, day)
+    return tenants
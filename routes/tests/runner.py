@@ -0,0 +1,29 @@
+"""
+Test runner keeping test requests out of this host's shared files.
+
+Every request goes through ``MetricsMiddleware`` and ``SlowQueryMiddleware``,
+which write to ``METRICS_FILE`` and ``SLOW_QUERY_FILE``; a dev or production
+server on the same machine maps the same files. The run points both at a
+temporary directory of its own.
+"""
+import os
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.shared_files = tempfile.TemporaryDirectory(prefix='route_monitor_test_')
+        self.shared_files_override = override_settings(
+            METRICS_FILE=os.path.join(self.shared_files.name, 'metrics'),
+            SLOW_QUERY_FILE=os.path.join(self.shared_files.name, 'slow_queries'),
+        )
+        self.shared_files_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.shared_files_override.disable()
+        self.shared_files.cleanup()
+        super().teardown_test_environment(**kwargs)
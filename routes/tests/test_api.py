@@ -0,0 +1,1116 @@
+import importlib
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, QuerySet, Sum
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.testcases import LiveServerThread
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..models import (
+    Client, UserProfile, Route, Checkpoint, RouteRun, CheckpointScan, Incident, Occurrence,
+    DailyGuardStats, IdempotencyKey, PrincipalInvalidation,
+)
+from ..idempotency import idempotent
+from ..principal import cache_principal, load_principal
+from ..revocation import RevocationStore, TimeBucketedSet, store as revocation_store
+from ..serializers import RouteSerializer
+from .. import checkpoint_index, metrics, principal, query_planner, request_id, rollups, slow_queries
+from .factories import create_guard_on_route
+
+
+class CheckpointIndexTests(TestCase):
+    def setUp(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        self.route = assignment.route
+        checkpoint_index.clear()
+        self.assertEqual(self.index().total, 3)
+
+    def index(self):
+        # Scans read the route row afresh on every request
+        return checkpoint_index.get_route_index(Route.objects.get(pk=self.route.pk))
+
+    def test_adding_a_checkpoint_rebuilds_the_index(self):
+        Checkpoint.objects.create(route=self.route, name='Checkpoint 4', qr_code='qr-4', order=4)
+        index = self.index()
+        self.assertEqual(index.total, 4)
+        self.assertEqual(index.checkpoints['qr-4'].order, 4)
+
+    def test_editing_a_checkpoint_rebuilds_the_index(self):
+        checkpoint = Checkpoint.objects.get(route=self.route, qr_code='qr-2')
+        checkpoint.qr_code = 'qr-new'
+        checkpoint.save()
+        index = self.index()
+        self.assertNotIn('qr-2', index.checkpoints)
+        self.assertEqual(index.checkpoints['qr-new'].id, checkpoint.id)
+
+    def test_deleting_a_checkpoint_rebuilds_the_index(self):
+        Checkpoint.objects.get(route=self.route, qr_code='qr-3').delete()
+        index = self.index()
+        self.assertEqual(index.total, 2)
+        self.assertNotIn('qr-3', index.checkpoints)
+
+    def test_saving_the_route_drops_the_index(self):
+        stale = self.index()
+        self.route.name = 'Renamed'
+        self.route.save()
+        self.assertIsNot(self.index(), stale)
+
+    def test_entries_built_by_other_workers_are_rebuilt_once_stale(self):
+        stale = self.index()
+        Checkpoint.objects.create(route=self.route, name='Checkpoint 4', qr_code='qr-4', order=4)
+        # Another worker still holds the entry built before the change
+        checkpoint_index._index[self.route.pk] = stale
+        self.assertEqual(self.index().total, 4)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RunProgressTests(TestCase):
+    def test_backfill_fills_progress_from_existing_scans(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        run = RouteRun.objects.create(assignment=assignment)
+        checkpoints = list(assignment.route.checkpoints.order_by('order'))
+        for checkpoint in checkpoints[:2]:
+            CheckpointScan.objects.create(checkpoint=checkpoint, route_run=run)
+        empty = RouteRun.objects.create(assignment=assignment, completed=True)
+        # Rows as they were before the progress columns existed
+        RouteRun.objects.update(last_scanned_order=0, scanned_count=0, expected_total=0, last_scan_at=None)
+
+        migration = importlib.import_module('routes.migrations.0015_routerun_progress')
+        migration.forward_func(django_apps, None)
+
+        run.refresh_from_db()
+        self.assertEqual((run.last_scanned_order, run.scanned_count, run.expected_total), (2, 2, 3))
+        self.assertEqual(run.last_scan_at, CheckpointScan.objects.get(checkpoint=checkpoints[1]).scanned_at)
+        empty.refresh_from_db()
+        self.assertEqual((empty.last_scanned_order, empty.scanned_count, empty.expected_total), (0, 0, 3))
+
+    def test_scan_out_of_order_is_rejected(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+        api.post('/api/start-run/')
+        self.assertEqual(api.post('/api/scan/', {'qr_code': 'qr-1'}, format='json').status_code, 201)
+
+        response = api.post('/api/scan/', {'qr_code': 'qr-3'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Orden incorrecto', response.data['error'])
+        run = RouteRun.objects.get(assignment=assignment)
+        self.assertEqual((run.last_scanned_order, run.scanned_count, run.completed), (1, 1, False))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SyncEventsTests(TestCase):
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route(checkpoint_count=3)
+        self.api = APIClient()
+        self.api.force_authenticate(self.guard)
+
+    def sync(self, events):
+        return self.api.post('/api/sync/', {'events': events}, format='json')
+
+    def test_results_follow_the_batch_order(self):
+        self.api.post('/api/start-run/')
+
+        response = self.sync([
+            {'id': 'a', 'type': 'scan', 'qr_code': 'qr-1'},
+            {'id': 'b', 'type': 'incident', 'description': 'Puerta abierta'},
+            {'id': 'c', 'type': 'scan', 'qr_code': 'qr-3'},
+            {'id': 'd', 'type': 'scan', 'qr_code': 'qr-unknown'},
+            {'id': 'e', 'type': 'scan', 'qr_code': 'qr-1'},
+            {'id': 'f', 'type': 'scan', 'qr_code': 'qr-2'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(
+            [result['status'] for result in results], ['created', 'created', 'error', 'error', 'duplicate', 'created']
+        )
+        self.assertIn('Orden incorrecto', results[2]['error'])
+        self.assertIn('no válido', results[3]['error'])
+        run = RouteRun.objects.get(assignment=self.assignment)
+        self.assertEqual((run.last_scanned_order, run.scanned_count), (2, 2))
+        self.assertEqual(Incident.objects.filter(route_run=run).count(), 1)
+
+    def test_replayed_scans_are_duplicates(self):
+        self.api.post('/api/start-run/')
+        self.sync([{'type': 'scan', 'qr_code': 'qr-1'}])
+
+        response = self.sync([{'type': 'scan', 'qr_code': 'qr-1'}])
+
+        self.assertEqual(response.data['results'][0]['status'], 'duplicate')
+        self.assertEqual(CheckpointScan.objects.count(), 1)
+
+    def test_without_an_active_run_is_rejected(self):
+        response = self.sync([{'type': 'scan', 'qr_code': 'qr-1'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_a_bare_list_body_is_rejected(self):
+        self.api.post('/api/start-run/')
+        response = self.api.post('/api/sync/', [{'type': 'scan', 'qr_code': 'qr-1'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CheckpointScan.objects.count(), 0)
+
+
+@api_view(['POST'])
+@idempotent
+def flaky_view(request):
+    """Fails the way ``request.data['fail']`` says."""
+    if request.data.get('fail') == 'raise':
+        raise RuntimeError('boom')
+    if request.data.get('fail') == '503':
+        return Response({'error': 'unavailable'}, status=503)
+    return Response({'ok': True}, status=201)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route(checkpoint_count=3)
+        self.api = APIClient()
+        self.api.force_authenticate(self.guard)
+
+    def post(self, path, key, data=None):
+        return self.api.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def claim(self, key, path='/api/start-run/', **fields):
+        now = timezone.now()
+        return IdempotencyKey.objects.create(
+            user=self.guard, key=key, path=path, created_at=fields.pop('created_at', now),
+            expires_at=fields.pop('expires_at', now + timedelta(hours=1)), **fields
+        )
+
+    def call_flaky(self, key, fail):
+        request = APIRequestFactory().post('/flaky/', {'fail': fail}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user=self.guard)
+        return flaky_view(request)
+
+    def test_repeated_key_replays_the_stored_response(self):
+        first = self.post('/api/start-run/', 'start-1')
+        replay = self.post('/api/start-run/', 'start-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((replay.status_code, replay.data), (201, first.data))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(RouteRun.objects.filter(assignment=self.assignment).count(), 1)
+
+    def test_key_in_flight_conflicts(self):
+        self.claim('start-1')
+        response = self.post('/api/start-run/', 'start-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(RouteRun.objects.exists())
+
+    def test_key_reused_on_another_path_is_unprocessable(self):
+        self.post('/api/start-run/', 'key-1')
+        response = self.post('/api/create-incident/', 'key-1', {'description': 'Puerta abierta'})
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Incident.objects.exists())
+
+    def test_server_errors_free_the_key(self):
+        self.assertEqual(self.call_flaky('flaky-1', '503').status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.filter(key='flaky-1').exists())
+        with self.assertRaises(RuntimeError):
+            self.call_flaky('flaky-2', 'raise')
+        self.assertFalse(IdempotencyKey.objects.filter(key='flaky-2').exists())
+
+        # The retry runs the view instead of replaying or conflicting
+        response = self.call_flaky('flaky-1', None)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_expired_and_abandoned_keys_are_claimed_again(self):
+        past = timezone.now() - timedelta(hours=2)
+        self.claim('expired', status_code=400, response_body={'error': 'old'}, created_at=past, expires_at=past)
+        self.claim('abandoned', created_at=timezone.now() - settings.IDEMPOTENCY_KEY_LOCK_TIMEOUT - timedelta(seconds=1))
+
+        response = self.post('/api/start-run/', 'expired')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.api.post('/api/end-shift/')
+        response = self.post('/api/start-run/', 'abandoned')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get(key='abandoned').status_code, 201)
+
+    def test_purge_deletes_expired_keys_only(self):
+        past = timezone.now() - timedelta(hours=2)
+        self.claim('expired', status_code=201, created_at=past, expires_at=past)
+        self.claim('live', status_code=201)
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['live'])
+
+
+class ActiveRunConstraintTests(TestCase):
+    def test_second_active_run_is_rejected(self):
+        guard, assignment = create_guard_on_route()
+        RouteRun.objects.create(assignment=assignment)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RouteRun.objects.create(assignment=assignment)
+
+    def test_completed_runs_do_not_count_as_active(self):
+        guard, assignment = create_guard_on_route()
+        RouteRun.objects.create(assignment=assignment, completed=True)
+        RouteRun.objects.create(assignment=assignment, completed=True)
+        RouteRun.objects.create(assignment=assignment)
+        self.assertEqual(RouteRun.objects.filter(assignment=assignment).count(), 3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class StartRaceTests(TestCase):
+    """A start that commits between another start's check and its insert."""
+
+    def test_losing_start_gets_400_and_one_run_stays_active(self):
+        guard, assignment = create_guard_on_route()
+        api = APIClient()
+        api.force_authenticate(guard)
+        exists = QuerySet.exists
+
+        def exists_then_lose_race(queryset):
+            if queryset.model is not RouteRun:
+                return exists(queryset)
+            # Another start commits right after this one found no active run
+            RouteRun.objects.create(assignment=assignment)
+            return False
+
+        with mock.patch.object(QuerySet, 'exists', exists_then_lose_race):
+            response = api.post('/api/start-run/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(RouteRun.objects.filter(assignment=assignment, completed=False).count(), 1)
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, 'needs row locks: set DATABASE_URL to a Postgres database')
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConcurrentRunTests(TransactionTestCase):
+    """Hammer start-run/ and scan/ for one guard from many threads at once.
+
+    SQLite has no row locks and reports contention as errors, so these run
+    against Postgres only: ``DATABASE_URL=postgres://... python manage.py test
+    routes``. ``StartRaceTests`` covers the constraint on every backend.
+    """
+
+    THREADS = 8
+
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route(checkpoint_count=5)
+
+    def hammer(self, method, path, payloads):
+        statuses = []
+        barrier = threading.Barrier(len(payloads))
+
+        def worker(payload):
+            api = APIClient()
+            api.force_authenticate(self.guard)
+            try:
+                barrier.wait()
+                response = getattr(api, method)(path, payload, format='json')
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(payload,)) for payload in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_concurrent_starts_create_one_active_run(self):
+        statuses = self.hammer('post', '/api/start-run/', [None] * self.THREADS)
+
+        self.assertEqual(RouteRun.objects.filter(assignment=self.assignment, completed=False).count(), 1)
+        self.assertEqual(statuses.count(201), 1)
+        self.assertLessEqual(set(statuses), {201, 400})
+
+    def test_concurrent_scans_keep_progress_consistent(self):
+        run = RouteRun.objects.create(assignment=self.assignment, expected_total=5)
+
+        for order in range(1, 6):
+            statuses = self.hammer('post', '/api/scan/', [{'qr_code': f'qr-{order}'}] * self.THREADS)
+            self.assertLessEqual(set(statuses), {201, 200, 400})
+
+        run.refresh_from_db()
+        scans = CheckpointScan.objects.filter(route_run=run)
+        self.assertEqual(run.scanned_count, scans.count())
+        self.assertEqual(run.last_scanned_order, max(scans.values_list('checkpoint__order', flat=True), default=0))
+        self.assertEqual(run.completed, run.scanned_count == 5)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginTests(TestCase):
+    def test_login_resolves_user_profile_and_client_in_one_query(self):
+        guard, assignment = create_guard_on_route()
+
+        with self.assertNumQueries(1):
+            response = APIClient().post('/api/token/', {'username': 'guard', 'password': 'secret'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['role'], 'guard')
+        token = AccessToken(response.data['access'])
+        self.assertEqual(token['client_id'], assignment.route.client_id)
+        self.assertFalse(token['is_admin'])
+
+    def test_frozen_client_login_is_rejected(self):
+        create_guard_on_route()
+        Client.objects.update(is_active=False)
+
+        response = APIClient().post('/api/token/', {'username': 'client', 'password': 'secret'}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('access', response.data)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TOKEN_REVOCATION_SYNC_INTERVAL=3600,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        # The worker's store outlives each test's rollback, and SQLite reuses the
+        # rolled-back ids, so start from (and leave behind) an empty store.
+        self.reset_store()
+        self.addCleanup(self.reset_store)
+        self.guard, self.assignment = create_guard_on_route()
+        self.client_record = self.assignment.route.client
+
+    @staticmethod
+    def reset_store():
+        vars(revocation_store).update(vars(RevocationStore()))
+
+    def access_token(self):
+        token = AccessToken.for_user(self.guard)
+        token['client_id'] = self.client_record.id
+        # Issued before the revocation cutoff, which has sub-second precision
+        token.set_iat(at_time=timezone.now() - timedelta(seconds=10))
+        return str(token)
+
+    def test_rotated_refresh_token_cannot_be_reused(self):
+        login = APIClient().post('/api/token/', {'username': 'guard', 'password': 'secret'}, format='json')
+        refresh = login.data['refresh']
+
+        rotated = APIClient().post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(rotated.status_code, 200)
+        self.assertNotEqual(rotated.data['refresh'], refresh)
+
+        reused = APIClient().post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(reused.status_code, 401)
+        again = APIClient().post('/api/token/refresh/', {'refresh': rotated.data['refresh']}, format='json')
+        self.assertEqual(again.status_code, 200)
+
+    def test_freeze_client_rejects_existing_access_tokens(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token()}')
+        self.assertEqual(api.get('/api/assignment/').status_code, 200)
+
+        superuser = User.objects.create_superuser(username='root', password='secret')
+        admin_api = APIClient()
+        admin_api.force_authenticate(superuser)
+        self.assertEqual(admin_api.post(f'/api/freeze-client/{self.client_record.id}/').status_code, 200)
+
+        self.assertEqual(api.get('/api/assignment/').status_code, 401)
+
+    def test_client_revoked_by_another_worker_is_rejected_after_sync(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token()}')
+        revocation_store.sync(force=True)
+
+        RevocationStore().revoke_client(self.client_record.id)
+
+        self.assertEqual(api.get('/api/check-role/').status_code, 200)
+        revocation_store.sync(force=True)
+        self.assertEqual(api.get('/api/check-role/').status_code, 401)
+
+    def test_expired_buckets_are_purged(self):
+        tokens = TimeBucketedSet(bucket_seconds=100)
+        tokens.add('old', exp=150)
+        tokens.add('new', exp=250)
+
+        tokens.purge(now=200)
+
+        self.assertFalse(tokens.contains('old', 150))
+        self.assertTrue(tokens.contains('new', 250))
+        self.assertEqual(len(tokens), 1)
+        tokens.purge(now=300)
+        self.assertEqual(len(tokens), 0)
+
+
+class PrincipalInvalidationTests(TestCase):
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route()
+        self.client_record = self.assignment.route.client
+        revocation_store.sync(force=True)
+
+    def test_client_change_invalidates_its_guards_once_committed(self):
+        stale = load_principal(self.guard.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_record.is_active = False
+            self.client_record.save()
+            # A concurrent request caching the state the transaction replaces
+            cache_principal(stale)
+
+        self.assertTrue(load_principal(self.guard.id).is_frozen)
+        self.assertEqual(
+            set(PrincipalInvalidation.objects.values_list('user_id', flat=True)),
+            {self.guard.id, self.client_record.user_id},
+        )
+
+    def test_other_workers_drop_invalidated_principals_at_their_next_sync(self):
+        self.assertFalse(load_principal(self.guard.id).is_admin)
+
+        # What another worker's commit leaves behind: a changed row and an invalidation
+        UserProfile.objects.filter(user=self.guard).update(is_admin=True)
+        revocation_store.invalidate_principals([self.guard.id])
+        self.assertFalse(load_principal(self.guard.id).is_admin)
+
+        revocation_store.sync(force=True)
+        self.assertTrue(load_principal(self.guard.id).is_admin)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TOKEN_REVOCATION_SYNC_INTERVAL=3600)
+class ClaimsAuthenticationTests(TestCase):
+    """A user cut off through one worker is rejected by the others once they sync."""
+
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.guard)}')
+        revocation_store.sync(force=True)
+        # Caches the guard's principal in this worker
+        self.assertEqual(self.api.get('/api/check-role/').status_code, 200)
+
+    def in_other_worker(self):
+        """Run the block with its own principal cache, as another gunicorn worker would."""
+        return mock.patch.object(principal, 'cache', LocMemCache('other-worker', {}))
+
+    def assert_cut_off_at_next_sync(self):
+        self.assertEqual(self.api.get('/api/check-role/').status_code, 200)
+        revocation_store.sync(force=True)
+        self.assertEqual(self.api.get('/api/check-role/').status_code, 401)
+
+    def test_deactivated_user_is_cut_off(self):
+        with self.in_other_worker(), self.captureOnCommitCallbacks(execute=True):
+            self.guard.is_active = False
+            self.guard.save()
+        self.assert_cut_off_at_next_sync()
+
+    def test_deleted_user_is_cut_off(self):
+        with self.in_other_worker(), self.captureOnCommitCallbacks(execute=True):
+            self.guard.delete()
+        self.assert_cut_off_at_next_sync()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReportTests(TestCase):
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route(checkpoint_count=3)
+        self.api = APIClient()
+        self.api.force_authenticate(self.assignment.route.client.user)
+        load_principal(self.assignment.route.client.user_id)
+
+    def add_runs(self, days):
+        checkpoints = list(self.assignment.route.checkpoints.all())
+        for day in range(days):
+            start = timezone.now() - timedelta(days=day)
+            run = RouteRun.objects.create(assignment=self.assignment, completed=True)
+            RouteRun.objects.filter(pk=run.pk).update(start_time=start)
+            for checkpoint in checkpoints:
+                CheckpointScan.objects.create(checkpoint=checkpoint, route_run=run, scanned_at=start)
+            Incident.objects.create(guard=self.guard, route_run=run, description='incident')
+            Occurrence.objects.create(route_run=run, occurrence_type='person', name='n', dni='1', motive='m')
+
+    def test_query_count_does_not_grow_with_range(self):
+        self.add_runs(1)
+        with self.assertNumQueries(5):
+            response = self.api.get('/api/report/')
+        self.assertEqual(len(response.data['guards'][0]['days']), 1)
+
+        self.add_runs(7)
+        date_from = (timezone.localdate() - timedelta(days=7)).isoformat()
+        with self.assertNumQueries(5):
+            response = self.api.get(f'/api/report/?date_from={date_from}')
+        days = response.data['guards'][0]['days']
+        self.assertEqual(sum(len(day['route_runs']) for day in days), 8)
+        self.assertEqual(len(days[-1]['route_runs'][0]['occurrences']), 1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+    def test_export_streams_every_record_type(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        for _ in range(3):
+            run = RouteRun.objects.create(assignment=assignment, completed=True)
+            for checkpoint in assignment.route.checkpoints.all():
+                CheckpointScan.objects.create(checkpoint=checkpoint, route_run=run)
+            Incident.objects.create(guard=guard, route_run=run, description='incident')
+        Occurrence.objects.create(route_run=run, occurrence_type='car', name='n', dni='1', motive='m')
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+
+        response = api.get('/api/export/')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        record_types = [line.split(',', 1)[0] for line in lines[1:]]
+        self.assertEqual(record_types, ['run'] * 3 + ['scan'] * 9 + ['incident'] * 3 + ['occurrence'])
+
+        response = api.get('/api/export/?output=ndjson')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 16)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DailyStatsTests(TestCase):
+    FIELDS = [
+        'guard_id', 'route_id', 'date', 'runs_started', 'runs_completed', 'completed_duration',
+        'checkpoints_scanned', 'checkpoints_expected', 'incidents', 'occurrences',
+    ]
+
+    def test_live_rollup_matches_rebuild(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+
+        api.post('/api/start-run/')
+        for order in range(1, 4):
+            api.post('/api/scan/', {'qr_code': f'qr-{order}'}, format='json')
+        api.post('/api/start-run/')
+        api.post('/api/create-incident/', {'description': 'incident'}, format='json')
+        api.post('/api/create-occurrence/', {'occurrence_type': 'person', 'name': 'n', 'dni': '1', 'motive': 'm'}, format='json')
+        api.post('/api/sync/', {'events': [
+            {'type': 'scan', 'qr_code': 'qr-1'},
+            {'type': 'incident', 'description': 'offline'},
+        ]}, format='json')
+        api.post('/api/end-shift/')
+
+        live = list(DailyGuardStats.objects.values(*self.FIELDS))
+        self.assertEqual(len(live), 1)
+        self.assertEqual(live[0]['runs_started'], 2)
+        self.assertEqual(live[0]['runs_completed'], 2)
+        self.assertEqual(live[0]['checkpoints_scanned'], 4)
+        self.assertEqual(live[0]['checkpoints_expected'], 6)
+        self.assertEqual(live[0]['incidents'], 2)
+        self.assertEqual(live[0]['occurrences'], 1)
+
+        today = timezone.localdate()
+        rollups.rebuild(today, today)
+        self.assertEqual(list(DailyGuardStats.objects.values(*self.FIELDS)), live)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConditionalGetTests(TestCase):
+    def test_unchanged_assignment_is_not_modified_until_a_scan(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+        api.post('/api/start-run/')
+
+        etag = api.get('/api/assignment/')['ETag']
+        with self.assertNumQueries(1):
+            response = api.get('/api/assignment/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        api.post('/api/scan/', {'qr_code': 'qr-1'}, format='json')
+        response = api.get('/api/assignment/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['active_run']['scanned_count'], 1)
+
+    def test_scans_do_not_write_the_assignment(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+        api.post('/api/start-run/')
+
+        with CaptureQueriesContext(connection) as queries:
+            api.post('/api/scan/', {'qr_code': 'qr-1'}, format='json')
+        self.assertFalse([q['sql'] for q in queries if 'UPDATE "routes_guardassignment"' in q['sql']])
+
+    def test_assignment_list_changes_when_a_run_starts_or_ends(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        guard_api, client_api = APIClient(), APIClient()
+        guard_api.force_authenticate(guard)
+        client_api.force_authenticate(assignment.route.client.user)
+
+        etags = [client_api.get('/api/guard-assignments/')['ETag']]
+        guard_api.post('/api/start-run/')
+        etags.append(client_api.get('/api/guard-assignments/')['ETag'])
+        guard_api.post('/api/scan/', {'qr_code': 'qr-1'}, format='json')
+        self.assertEqual(client_api.get('/api/guard-assignments/', HTTP_IF_NONE_MATCH=etags[-1]).status_code, 304)
+        guard_api.post('/api/end-shift/')
+        response = client_api.get('/api/guard-assignments/', HTTP_IF_NONE_MATCH=etags[-1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etags[0], etags[1])
+        self.assertEqual(response['ETag'], etags[0])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, REPORT_JOBS_DIR=tempfile.mkdtemp())
+class ReportJobTests(TestCase):
+    def test_submit_dedupe_render_and_download(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=2)
+        run = RouteRun.objects.create(assignment=assignment)
+        CheckpointScan.objects.create(checkpoint=assignment.route.checkpoints.first(), route_run=run)
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+
+        response = api.post('/api/report-jobs/', {'guard_ids': [guard.id]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['id']
+        response = api.post('/api/report-jobs/', {'guard_ids': [guard.id]}, format='json')
+        self.assertEqual((response.status_code, response.data['id']), (200, job_id))
+        self.assertEqual(api.get(f'/api/report-jobs/{job_id}/download/').status_code, 409)
+
+        call_command('run_report_worker', '--once', stdout=StringIO())
+
+        response = api.get(f'/api/report-jobs/{job_id}/')
+        self.assertEqual((response.data['status'], response.data['rows']), ('done', 2))
+        response = api.get(f'/api/report-jobs/{job_id}/download/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',', 1)[0] for line in lines], ['record_type', 'run', 'scan'])
+
+    def test_unknown_output_is_rejected(self):
+        guard, assignment = create_guard_on_route()
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+
+        response = api.post('/api/report-jobs/', {'output': 'xlsx'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('csv', response.data['error'])
+
+    def test_finished_file_is_reused_only_for_past_ranges(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=2)
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+
+        past_id = api.post('/api/report-jobs/', {'date_to': yesterday}, format='json').data['id']
+        today_id = api.post('/api/report-jobs/', {}, format='json').data['id']
+        call_command('run_report_worker', '--once', stdout=StringIO())
+        call_command('run_report_worker', '--once', stdout=StringIO())
+
+        response = api.post('/api/report-jobs/', {'date_to': yesterday}, format='json')
+        self.assertEqual((response.status_code, response.data['id']), (200, past_id))
+        # Today's file misses whatever happened since it was rendered
+        response = api.post('/api/report-jobs/', {}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.data['id'], today_id)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ClientDashboardTests(TestCase):
+    def test_dashboard_kpis(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+        api.post('/api/start-run/')
+        api.post('/api/scan/', {'qr_code': 'qr-1'}, format='json')
+        api.post('/api/end-shift/')
+        api.post('/api/start-run/')
+        api.post('/api/create-incident/', {'description': 'incident'}, format='json')
+
+        api.force_authenticate(assignment.route.client.user)
+        data = api.get('/api/client-dashboard/').data
+
+        self.assertEqual(data['active_guards'], 1)
+        self.assertEqual(data['runs_in_progress'], 1)
+        self.assertEqual(data['completion_rate'], 0.5)
+        self.assertEqual(data['missed_checkpoints'], 2)
+        self.assertEqual(data['incidents'], 1)
+        self.assertEqual(data['guards'][0]['today']['checkpoints_scanned'], 1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SegmentTimingTests(TestCase):
+    def test_segment_distribution_and_outliers(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        checkpoints = list(assignment.route.checkpoints.all())
+        start = timezone.now() - timedelta(hours=12)
+        for i, minutes in enumerate([5, 6, 7, 8, 40]):
+            run_start = start + timedelta(hours=i)
+            run = RouteRun.objects.create(assignment=assignment, start_time=run_start, completed=True)
+            CheckpointScan.objects.create(checkpoint=checkpoints[0], route_run=run, scanned_at=run_start)
+            CheckpointScan.objects.create(checkpoint=checkpoints[1], route_run=run, scanned_at=run_start + timedelta(minutes=minutes))
+            CheckpointScan.objects.create(checkpoint=checkpoints[2], route_run=run, scanned_at=run_start + timedelta(minutes=minutes + 2))
+
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+        today = timezone.localdate()
+        response = api.get('/api/segment-timings/', {'date_from': (today - timedelta(days=1)).isoformat(), 'date_to': today.isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        first, second = response.data['routes'][0]['segments']
+        self.assertEqual((first['from']['order'], first['to']['order']), (1, 2))
+        self.assertEqual(first['count'], 5)
+        self.assertEqual(first['median'], 7 * 60)
+        self.assertEqual(first['outliers'], 1)
+        self.assertEqual(first['slowest'][0]['seconds'], 40 * 60)
+        self.assertEqual((second['median'], second['outliers']), (120, 0))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        guard, assignment = create_guard_on_route()
+        client = assignment.route.client
+        for name in ['delta', 'alpha', 'echo', 'charlie', 'bravo']:
+            user = User.objects.create_user(username=name, password='secret')
+            UserProfile.objects.create(user=user, client=client)
+        self.api = APIClient()
+        self.api.force_authenticate(client.user)
+
+    def test_pages_follow_username_order_without_counting(self):
+        usernames = []
+        url = '/api/list-guards/?page_size=2'
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                page = self.api.get(url).data
+                usernames += [guard['username'] for guard in page['results']]
+                url = page['next']
+        self.assertEqual(usernames, ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'guard'])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_count_only_when_requested_and_plain_list_without_params(self):
+        self.assertEqual(self.api.get('/api/list-guards/?page_size=4&count=true').data['count'], 6)
+        self.assertEqual(len(self.api.get('/api/list-guards/').data), 6)
+        self.assertEqual(self.api.get('/api/list-guards/?cursor=not-a-cursor').status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class QueryPlannerTests(TestCase):
+    def test_route_serializer_plan(self):
+        plan = query_planner.build_plan(RouteSerializer, Route)
+        self.assertEqual(plan.select, {'client'})
+        self.assertEqual(list(plan.prefetch), ['checkpoints'])
+        self.assertEqual(plan.only, {'id', 'name', 'client', 'client__id', 'client__name', 'client__is_active'})
+
+    def test_list_query_counts_do_not_grow_with_rows(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        client = assignment.route.client
+        api = APIClient()
+        api.force_authenticate(client.user)
+
+        def counts():
+            counts = []
+            for url in ['/api/list-routes/', '/api/list-guards/']:
+                with CaptureQueriesContext(connection) as queries:
+                    api.get(url)
+                counts.append(len(queries))
+            return counts
+
+        load_principal(client.user_id)
+        before = counts()
+        for i in range(5):
+            route = Route.objects.create(name=f'Route {i}', client=client)
+            Checkpoint.objects.create(route=route, name='Checkpoint', qr_code=f'extra-{i}', order=1)
+            user = User.objects.create_user(username=f'guard-{i}', password='secret')
+            UserProfile.objects.create(user=user, client=client)
+        self.assertEqual(counts(), before)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        self.api = APIClient()
+        self.api.force_authenticate(assignment.route.client.user)
+        load_principal(assignment.route.client.user_id)
+
+    def test_fields_and_expand_narrow_payload_and_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            routes = self.api.get('/api/list-routes/?fields=id,name,client').data
+        self.assertEqual(set(routes[0]), {'id', 'name', 'client'})
+        self.assertIsInstance(routes[0]['client'], dict)
+        # ETag aggregate plus one query for the routes; no checkpoint prefetch
+        self.assertEqual(len(queries), 2)
+
+        routes = self.api.get('/api/list-routes/?expand=checkpoints&fields=id,checkpoints.name').data
+        self.assertEqual(routes[0], {'id': routes[0]['id'], 'checkpoints': [
+            {'name': 'Checkpoint 1'}, {'name': 'Checkpoint 2'}, {'name': 'Checkpoint 3'},
+        ]})
+
+        routes = self.api.get('/api/list-routes/?expand=').data
+        self.assertNotIn('checkpoints', routes[0])
+        self.assertIsInstance(routes[0]['client'], int)
+
+    def test_no_params_keep_full_payload(self):
+        routes = self.api.get('/api/list-routes/').data
+        self.assertEqual(len(routes[0]['checkpoints']), 3)
+        self.assertEqual(routes[0]['client']['name'], 'Client')
+
+    def test_writes_ignore_fields(self):
+        superuser = User.objects.create_superuser(username='root', password='secret')
+        self.api.force_authenticate(superuser)
+
+        response = self.api.post(
+            '/api/clients/?fields=id', {'name': 'Nuevo', 'username': 'nuevo', 'password': 'secret'}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.data), {'id', 'name', 'is_active'})
+        self.assertTrue(User.objects.get(username='nuevo').check_password('secret'))
+
+
+class SeedLoadTests(TestCase):
+    def test_generates_consistent_history(self):
+        call_command(
+            'seed_load', '--clients', '1', '--guards', '3', '--routes', '2', '--checkpoints', '4', '--days', '7',
+            '--seed', '1', stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='load-0-guard-').count(), 3)
+        self.assertTrue(RouteRun.objects.exists())
+        self.assertFalse(RouteRun.objects.filter(completed=False).exists())
+        # Every scan belongs to a checkpoint of its run's route, and the counters match the scans
+        self.assertFalse(CheckpointScan.objects.exclude(checkpoint__route=F('route_run__assignment__route')).exists())
+        for run in RouteRun.objects.annotate(scans=Count('checkpoint_scans')):
+            self.assertEqual(run.scans, run.scanned_count)
+        self.assertEqual(
+            DailyGuardStats.objects.aggregate(total=Sum('checkpoints_scanned'))['total'], CheckpointScan.objects.count()
+        )
+
+
+class SyncWorkerServer(ThreadedWSGIServer):
+    """One request at a time, as a gunicorn sync worker; the in-memory test database is one shared connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_lock = threading.Lock()
+
+    def process_request_thread(self, request, client_address):
+        with self.request_lock:
+            super().process_request_thread(request, client_address)
+
+
+class SyncWorkerThread(LiveServerThread):
+    server_class = SyncWorkerServer
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoadtestShiftTests(LiveServerTestCase):
+    server_thread_class = SyncWorkerThread
+
+    def test_replays_patrols_against_live_server(self):
+        call_command(
+            'seed_load', '--clients', '1', '--guards', '1', '--routes', '1', '--checkpoints', '3', '--days', '1',
+            stdout=StringIO(),
+        )
+        seeded_runs = RouteRun.objects.count()
+        out = StringIO()
+        call_command(
+            'loadtest_shift', '--base-url', f'{self.live_server_url}/api/', '--guards', '1', '--admins', '1',
+            '--duration', '1', '--ramp-up', '0', '--scan-interval', '0.05', '--poll-interval', '0.2',
+            '--seed', '1', stdout=out,
+        )
+        output = out.getvalue()
+        for endpoint in ['token/', 'start-run/', 'scan/', 'guard-assignments/', 'daily-report/']:
+            self.assertIn(endpoint, output)
+        self.assertNotIn('failed', output)
+        self.assertGreater(RouteRun.objects.filter(completed=True, scanned_count=3).count(), seeded_runs)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(METRICS_FILE=os.path.join(directory.name, 'metrics'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_records_requests_queries_and_serializer_time_per_url_name(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        api = APIClient()
+        api.force_authenticate(guard)
+        api.get('/api/assignment/')
+        api.get('/api/assignment/')
+        api.get('/api/nowhere/')
+
+        with self.settings(METRICS_TOKEN='scrape-me'):
+            response = APIClient().get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                sample, value = line.rsplit(' ', 1)
+                samples[sample] = float(value)
+        self.assertEqual(samples['route_monitor_requests_total{url_name="guard_assignment",status="2xx"}'], 2)
+        self.assertEqual(samples['route_monitor_request_duration_seconds_bucket{url_name="guard_assignment",le="+Inf"}'], 2)
+        self.assertEqual(samples['route_monitor_request_duration_seconds_count{url_name="guard_assignment"}'], 2)
+        self.assertGreater(samples['route_monitor_request_duration_seconds_sum{url_name="guard_assignment"}'], 0)
+        self.assertGreater(samples['route_monitor_db_queries_total{url_name="guard_assignment"}'], 0)
+        self.assertGreater(samples['route_monitor_serializer_duration_seconds_total{url_name="guard_assignment"}'], 0)
+        self.assertGreater(samples['route_monitor_response_bytes_total{url_name="guard_assignment"}'], 0)
+        self.assertEqual(samples[f'route_monitor_requests_total{{url_name="{metrics.UNMATCHED}",status="4xx"}}'], 1)
+
+    def test_scrapes_need_the_metrics_token(self):
+        superuser = User.objects.create_superuser(username='root', password='secret')
+        api = APIClient()
+        api.force_authenticate(superuser)
+        self.assertEqual(api.get('/api/metrics/').status_code, 403)
+
+        with self.settings(METRICS_TOKEN='scrape-me'):
+            self.assertEqual(APIClient().get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(APIClient().get('/api/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_workers_share_counters(self):
+        metrics.store.reset()
+        pid = os.fork()
+        if pid == 0:
+            # A second worker process
+            metrics.store.record('scan_checkpoint', 0.02, 201, 10, metrics.RequestMetrics())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        metrics.store.record('scan_checkpoint', 0.3, 500, 10, metrics.RequestMetrics())
+
+        totals = metrics.store.snapshot()['scan_checkpoint']
+        self.assertEqual(totals['requests'], 2)
+        self.assertEqual((totals['2xx'], totals['5xx']), (1, 1))
+        self.assertEqual(totals['response_bytes'], 20)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN_RATE=1)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(SLOW_QUERY_FILE=os.path.join(directory.name, 'slow_queries'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_records_call_site_view_and_plan(self):
+        guard, assignment = create_guard_on_route(checkpoint_count=3)
+        superuser = User.objects.create_superuser(username='root', password='secret')
+        api = APIClient()
+        api.force_authenticate(assignment.route.client.user)
+        response_id = api.get('/api/daily-report/', {'guard_id': guard.id})['X-Request-ID']
+
+        api.force_authenticate(superuser)
+        response = api.get('/api/slow-queries/', {'view': 'daily_report'})
+        self.assertEqual(response.status_code, 200)
+        entries = response.data['entries']
+        self.assertTrue(entries)
+        self.assertTrue(all(entry['view'].startswith('routes/views.py:') for entry in entries))
+        self.assertTrue(all(entry['request'] == 'GET /api/daily-report/' for entry in entries))
+        self.assertEqual({entry['request_id'] for entry in entries}, {response_id})
+        # The report's runs are read when the view serializes them
+        report_query = next(entry for entry in entries if 'FROM "routes_routerun"' in entry['sql'])
+        self.assertTrue(report_query['call_site'].startswith('routes/views.py:'))
+        self.assertIsNotNone(report_query['explain'])
+        self.assertEqual(entries, sorted(entries, key=lambda entry: -entry['seq']))
+
+        api.force_authenticate(guard)
+        self.assertEqual(api.get('/api/slow-queries/').status_code, 403)
+
+    def test_plans_are_taken_once_the_response_is_sent(self):
+        slow_queries.log.reset()
+        middleware = slow_queries.SlowQueryMiddleware(lambda request: HttpResponse(str(Route.objects.count())))
+
+        response = middleware(RequestFactory().get('/api/list-routes/'))
+        self.assertEqual(slow_queries.log.entries(), [])
+
+        response.close()
+        entry, = slow_queries.log.entries()
+        self.assertEqual(entry['request'], 'GET /api/list-routes/')
+        self.assertIsNotNone(entry['explain'])
+        self.assertGreaterEqual(entry['explain_ms'], 0)
+
+    def test_common_table_expressions_are_explained(self):
+        slow_queries.log.reset()
+
+        def view(request):
+            with connection.cursor() as cursor:
+                cursor.execute('WITH counts AS (SELECT COUNT(*) AS n FROM routes_route) SELECT n FROM counts')
+            return HttpResponse()
+
+        slow_queries.SlowQueryMiddleware(view)(RequestFactory().get('/api/list-routes/')).close()
+        entry, = slow_queries.log.entries()
+        self.assertTrue(entry['sql'].startswith('WITH'))
+        self.assertIsNotNone(entry['explain'])
+
+    def test_buffer_keeps_newest_entries(self):
+        with self.settings(SLOW_QUERY_LOG_SIZE=3):
+            slow_queries.log.reset()
+            for i in range(5):
+                slow_queries.log.record({'sql': f'SELECT {i}', 'explain': None, 'view': None})
+            self.assertEqual([entry['seq'] for entry in slow_queries.log.entries()], [4, 3, 2])
+
+    def test_normalize(self):
+        self.assertEqual(
+            slow_queries.normalize("SELECT * FROM t WHERE a IN (%s, %s, %s) AND b = 'x'  LIMIT 21"),
+            'SELECT * FROM t WHERE a IN (?, ...) AND b = ? LIMIT ?',
+        )
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(request_id.RequestIDFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.guard, self.assignment = create_guard_on_route(checkpoint_count=3)
+        self.api = APIClient()
+
+    def test_server_timing_phases(self):
+        self.api.force_authenticate(self.guard)
+        response = self.api.get('/api/assignment/')
+        phases = {
+            phase.split(';')[0]: float(phase.split('dur=')[1].split(';')[0])
+            for phase in response['Server-Timing'].split(', ')
+        }
+        self.assertEqual(set(phases), {'auth', 'permission', 'db', 'serialization', 'total'})
+        self.assertGreater(phases['db'], 0)
+        self.assertGreater(phases['serialization'], 0)
+        self.assertLessEqual(phases['serialization'], phases['total'])
+
+    def test_request_id_is_kept_or_generated(self):
+        response = self.api.get('/api/health/', HTTP_X_REQUEST_ID='mobile-7f3a.2')
+        self.assertEqual(response['X-Request-ID'], 'mobile-7f3a.2')
+        response = self.api.get('/api/health/', HTTP_X_REQUEST_ID='not valid\r\n')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_view_logs_carry_request_id(self):
+        handler = RecordingHandler()
+        view_logger = logging.getLogger('routes.views')
+        view_logger.addHandler(handler)
+        self.addCleanup(view_logger.removeHandler, handler)
+        view_logger.setLevel(logging.INFO)
+        view_logger.propagate = False
+        self.addCleanup(setattr, view_logger, 'propagate', True)
+        self.addCleanup(view_logger.setLevel, logging.NOTSET)
+
+        self.api.force_authenticate(self.assignment.route.client.user)
+        response = self.api.get('/api/list-guards/', HTTP_X_REQUEST_ID='support-ticket-42')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(handler.records)
+        self.assertEqual({record.request_id for record in handler.records}, {'support-ticket-42'})
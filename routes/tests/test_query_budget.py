@@ -0,0 +1,218 @@
+"""
+Query budgets for every endpoint in ``routes/urls.py``.
+
+The whole API is exercised once against a small and once against a large
+seeded tenant. Each endpoint must run the same number of queries at both sizes
+(no query per row) and no more than its entry in ``BUDGETS``. Failures list
+the SQL of the large run.
+
+Requests run with a cold cache, a warm principal and a freshly synced
+revocation store, the common case in production.
+"""
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..models import ReportJob
+from ..principal import load_principal
+from ..revocation import RevocableRefreshToken, store as revocation_store
+from .. import jobs, urls
+from .factories import PASSWORD, seed
+
+SIZES = {
+    'small': {'guards': 5, 'routes': 2, 'checkpoints': 3, 'runs': 1},
+    'large': {'guards': 12, 'routes': 4, 'checkpoints': 8, 'runs': 4},
+}
+
+# Queries allowed per request, by URL name and, for views serving several methods, method
+BUDGETS = {
+    'api_root': 0,
+    'health_check': 0,
+    'static_files_debug': 0,
+    'check_role': 0,
+    'token_obtain_pair': 1,
+    'token_refresh': 2,
+    'guard_assignment': 7,
+    'start_route_run': 11,
+    'scan_checkpoint': 10,
+    'create_incident': 5,
+    'create_occurrence': 5,
+    'sync_events': 11,
+    'end_shift': 7,
+    'list_routes': 3,
+    'list_guard_assignments': 3,
+    'list_guards': 1,
+    'list_admins': 1,
+    'daily_report': 6,
+    'report': 5,
+    'export': 4,
+    'client_dashboard': 6,
+    'segment_timings': 2,
+    'submit_report_job': 2,
+    'report_job_status': 1,
+    'download_report_job': 1,
+    'assign_guard': 17,
+    'create_guard': 18,
+    'update_guard': 5,
+    'delete_guard': 20,
+    'create_admin': 9,
+    'update_admin': 5,
+    'delete_admin': 14,
+    'create_route': 7,
+    'delete_route': 13,
+    'create_client': 2,
+    'update_client': 5,
+    'delete_client': 19,
+    'client_list GET': 1,
+    'client_list POST': 2,
+    'client_detail GET': 1,
+    'client_detail PUT': 5,
+    'client_detail DELETE': 19,
+    'freeze_client': 14,
+    'metrics': 0,
+    'slow_queries': 0,
+}
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.jobs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.jobs_dir.cleanup)
+        self.superuser = User.objects.create_superuser(username='root', password=PASSWORD)
+
+    def request(self, label, actor, method, url, data=None, headers=None):
+        """Run one request and record its queries under ``label``."""
+        cache.clear()
+        revocation_store.sync(force=True)
+        api = APIClient(headers=headers)
+        if actor is not None:
+            load_principal(actor.id)
+            api.force_authenticate(actor)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(api, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            response.close()
+        self.measured[label] = (response.status_code, [query['sql'] for query in queries.captured_queries])
+        return response
+
+    def exercise_api(self, tenant, other):
+        client_user, admin, guard, other_guard = tenant.client.user, tenant.admin, tenant.guards[0], tenant.guards[1]
+        checkpoints = list(tenant.assignments[0].route.checkpoints.all())
+        today = timezone.localdate().isoformat()
+
+        # Reads
+        self.request('api_root', None, 'get', reverse('api_root'))
+        self.request('health_check', None, 'get', reverse('health_check'))
+        self.request('static_files_debug', None, 'get', reverse('static_files_debug'))
+        self.request('check_role', guard, 'get', reverse('check_role'))
+        self.request('guard_assignment', guard, 'get', reverse('guard_assignment'))
+        for name in ['list_routes', 'list_guard_assignments', 'list_guards', 'list_admins', 'report', 'export',
+                     'client_dashboard', 'segment_timings']:
+            self.request(name, client_user, 'get', reverse(name))
+        self.request('daily_report', admin, 'get', reverse('daily_report'), {'guard_id': guard.id, 'date': today})
+        self.request('client_list GET', self.superuser, 'get', reverse('client_list'))
+        self.request('client_detail GET', self.superuser, 'get', reverse('client_detail', args=[tenant.client.id]))
+        with self.settings(METRICS_TOKEN='scrape-me'):
+            self.request('metrics', None, 'get', reverse('metrics'), headers={'Authorization': 'Bearer scrape-me'})
+        self.request('slow_queries', self.superuser, 'get', reverse('slow_queries'))
+
+        # Authentication
+        self.request('token_obtain_pair', None, 'post', reverse('token_obtain_pair'),
+                     {'username': guard.username, 'password': PASSWORD})
+        refresh = str(RevocableRefreshToken.for_user(guard))
+        self.request('token_refresh', None, 'post', reverse('token_refresh'), {'refresh': refresh})
+
+        # A patrol
+        self.request('start_route_run', guard, 'post', reverse('start_route_run'))
+        self.request('scan_checkpoint', guard, 'post', reverse('scan_checkpoint'), {'qr_code': checkpoints[0].qr_code})
+        self.request('create_incident', guard, 'post', reverse('create_incident'), {'description': 'Puerta abierta'})
+        self.request('create_occurrence', guard, 'post', reverse('create_occurrence'),
+                     {'occurrence_type': 'person', 'name': 'Visitante', 'dni': '1', 'motive': 'Visita'})
+        self.request('sync_events', guard, 'post', reverse('sync_events'), {'events': [
+            {'type': 'scan', 'qr_code': checkpoints[1].qr_code},
+            {'type': 'incident', 'description': 'Sin señal'},
+        ]})
+        self.request('end_shift', guard, 'post', reverse('end_shift'))
+
+        # Report files
+        with self.settings(REPORT_JOBS_DIR=self.jobs_dir.name):
+            self.request('submit_report_job', client_user, 'post', reverse('submit_report_job'),
+                         {'date_from': today, 'date_to': today})
+            job = ReportJob.objects.get(client=tenant.client)
+            jobs.run(job)
+            self.request('report_job_status', client_user, 'get', reverse('report_job_status', args=[job.id]))
+            self.request('download_report_job', client_user, 'get', reverse('download_report_job', args=[job.id]))
+            os.remove(ReportJob.objects.get(id=job.id).file_path)
+
+        # Administration
+        self.request('assign_guard', client_user, 'post', reverse('assign_guard'),
+                     {'guard_id': other_guard.id, 'route_id': tenant.routes[0].id, 'shift': 'night'})
+        self.request('create_guard', client_user, 'post', reverse('create_guard'),
+                     {'username': f'new-guard-{tenant.client.id}', 'password': PASSWORD})
+        self.request('update_guard', client_user, 'patch', reverse('update_guard', args=[other_guard.id]),
+                     {'first_name': 'Ana'})
+        self.request('create_admin', client_user, 'post', reverse('create_admin'),
+                     {'username': f'new-admin-{tenant.client.id}', 'password': PASSWORD})
+        self.request('update_admin', client_user, 'patch', reverse('update_admin', args=[admin.id]), {'first_name': 'Luis'})
+        self.request('create_route', self.superuser, 'post', reverse('create_route'), {
+            'client_id': tenant.client.id, 'name': 'Nueva ruta',
+            'checkpoints': [{'name': 'Entrada', 'qr_code': f'new-{tenant.client.id}', 'order': 1}],
+        })
+        self.request('create_client', self.superuser, 'post', reverse('create_client'),
+                     {'name': 'Nuevo', 'username': f'new-client-{tenant.client.id}', 'password': PASSWORD})
+        self.request('client_list POST', self.superuser, 'post', reverse('client_list'),
+                     {'name': 'Otro', 'username': f'other-client-{tenant.client.id}', 'password': PASSWORD})
+        self.request('update_client', self.superuser, 'patch', reverse('update_client', args=[tenant.client.id]),
+                     {'name': 'Renombrado'})
+        self.request('client_detail PUT', self.superuser, 'put', reverse('client_detail', args=[tenant.client.id]),
+                     {'name': 'Renombrado', 'username': 'unused', 'password': PASSWORD})
+        self.request('freeze_client', self.superuser, 'post', reverse('freeze_client', args=[other.client.id]))
+
+        # Deletes cascade over the tenant's data, so they go last
+        self.request('delete_guard', client_user, 'delete', reverse('delete_guard', args=[tenant.guards[-1].id]))
+        self.request('delete_admin', client_user, 'delete', reverse('delete_admin', args=[admin.id]))
+        self.request('delete_route', self.superuser, 'delete', reverse('delete_route', args=[tenant.routes[0].id]))
+        self.request('client_detail DELETE', self.superuser, 'delete', reverse('client_detail', args=[other.client.id]))
+        self.request('delete_client', self.superuser, 'delete', reverse('delete_client', args=[tenant.client.id]))
+
+    def measure(self, size):
+        self.measured = {}
+        with transaction.atomic():
+            tenant, other = seed(clients=2, **SIZES[size])
+            self.exercise_api(tenant, other)
+            transaction.set_rollback(True)
+        return self.measured
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, {label.split(' ')[0] for label in BUDGETS})
+
+    def test_query_counts_stay_within_budget_at_any_size(self):
+        small, large = self.measure('small'), self.measure('large')
+        self.assertEqual(set(large), set(BUDGETS))
+
+        failures = []
+        for label, budget in BUDGETS.items():
+            (_, small_queries), (status_code, large_queries) = small[label], large[label]
+            if status_code >= 400:
+                failures.append(f'{label}: answered {status_code}')
+            elif len(small_queries) != len(large_queries) or len(large_queries) > budget:
+                sql = '\n'.join(f'    {i}. {query}' for i, query in enumerate(large_queries, 1))
+                failures.append(
+                    f'{label}: {len(small_queries)} queries small, {len(large_queries)} large, budget {budget}\n{sql}'
+                )
+        if failures:
+            self.fail('\n\n'.join(failures))
@@ -17,6 +17,13 @@ urlpatterns = [
     path('guard-assignments/', views.list_guard_assignments, name='list_guard_assignments'),
     path('list-guards/', views.list_guards, name='list_guards'),
     path('daily-report/', views.daily_report, name='daily_report'),
+    path('report/', views.report, name='report'),
+    path('export/', views.export, name='export'),
+    path('client-dashboard/', views.client_dashboard, name='client_dashboard'),
+    path('segment-timings/', views.segment_timings, name='segment_timings'),
+    path('report-jobs/', views.submit_report_job, name='submit_report_job'),
+    path('report-jobs/<int:pk>/', views.report_job_status, name='report_job_status'),
+    path('report-jobs/<int:pk>/download/', views.download_report_job, name='download_report_job'),
     path('create-guard/', views.create_guard, name='create_guard'),
     path('update-guard/<int:pk>/', views.update_guard, name='update_guard'),
     path('delete-guard/<int:pk>/', views.delete_guard, name='delete_guard'),
@@ -24,6 +31,7 @@ urlpatterns = [
     path('check-role/', views.check_role, name='check_role'),
     path('create-incident/', views.create_incident, name='create_incident'),
     path('create-occurrence/', views.create_occurrence, name='create_occurrence'),
+    path('sync/', views.sync_events, name='sync_events'),
     path('clients/', views.ClientViewSet.as_view({'get': 'list', 'post': 'create'}), name='client_list'),
     path('clients/<int:pk>/', views.ClientViewSet.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}), name='client_detail'),
     path('freeze-client/<int:pk>/', views.freeze_client, name='freeze_client'),
@@ -36,6 +44,8 @@ urlpatterns = [
     path('delete-client/<int:pk>/', views.delete_client, name='delete_client'),
     path('update-guard/<int:pk>/', views.update_guard, name='update_guard'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('slow-queries/', views.slow_queries_view, name='slow_queries'),
     path('static-debug/', views.static_files_debug, name='static_files_debug'),
 ]
 
@@ -1,7 +1,7 @@
 from django.utils import timezone
 from django.db import transaction, IntegrityError
 from rest_framework import status, generics, viewsets
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.reverse import reverse
@@ -9,44 +9,76 @@ from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.exceptions import InvalidToken
 from django.contrib.auth.models import User
 from django.db.models import Prefetch
-from django.http import JsonResponse
-from .models import Client, Route, GuardAssignment, RouteRun, Checkpoint, CheckpointScan, UserProfile, Incident, Occurrence
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .models import Client, Route, GuardAssignment, RouteRun, Checkpoint, CheckpointScan, UserProfile, Incident, Occurrence, ReportJob
 from .serializers import (
     ClientSerializer, RouteSerializer, GuardAssignmentListSerializer, OptimizedGuardAssignmentSerializer, UserSerializer,
     AssignmentCheckpointScanSerializer, IncidentSerializer, ReportRouteRunSerializer, OccurrenceSerializer,
-    AssignmentRouteRunSerializer
+    AssignmentRouteRunSerializer, SyncEventSerializer, ReportJobSerializer
 )
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .permissions import IsSuperAdmin, IsAdminUser, IsClientUser, IsGuardUser
+from .permissions import IsSuperAdmin, IsAdminUser, IsClientUser, IsGuardUser, HasMetricsToken
+from .principal import get_principal, principal_from_user, cache_principal
+from . import analytics, checkpoint_index, conditional, dashboard, exports, jobs, metrics, reports, rollups, slow_queries
+from .idempotency import idempotent
+from .pagination import NameKeysetPagination, paginated_response
+from .query_planner import optimize
+from .authentication import CLAIMS_AUTHENTICATION
+from .revocation import RevocableRefreshToken, store as revocation_store
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RevocableRefreshToken
+
     @classmethod
-    def get_token(cls, user):
+    def get_token(cls, user, principal=None):
         token = super().get_token(user)
+        if principal is None:
+            principal = principal_from_user(user)
 
         # Add custom claims
         token['username'] = user.username
-        token['is_superadmin'] = user.is_superuser
-        if user.is_superuser:
+        token['is_superadmin'] = principal.role == 'superadmin'
+        if principal.role == 'superadmin':
             token['is_admin'] = True
             token['client_id'] = None
-        elif hasattr(user, 'userprofile'):
-            token['is_admin'] = user.userprofile.is_admin
-            token['client_id'] = user.userprofile.client.id if user.userprofile.client else None
-        elif hasattr(user, 'client'):
+        elif principal.has_profile:
+            token['is_admin'] = principal.is_admin
+            token['client_id'] = principal.client_id
+        elif principal.role == 'client':
             token['is_client'] = True
-            token['client_id'] = user.client.id
+            token['client_id'] = principal.client_id
         else:
             token['is_guard'] = True
-            token['client_id'] = getattr(user.userprofile, 'client_id', None) if hasattr(user, 'userprofile') else None
+            token['client_id'] = None
 
         return token
 
+    def validate(self, attrs):
+        # Authenticates through ProfileModelBackend, which joins profile and client
+        data = super(TokenObtainPairSerializer, self).validate(attrs)
+        self.principal = principal_from_user(self.user)
+
+        # Frozen accounts get no tokens; the view answers with 403
+        if self.principal.is_frozen and self.principal.role != 'superadmin':
+            return data
+
+        refresh = self.get_token(self.user, self.principal)
+        data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+        cache_principal(self.principal)
+        return data
+
 class CustomTokenObtainPairView(TokenObtainPairView):
+    serializer_class = CustomTokenObtainPairSerializer
+
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         
@@ -61,43 +93,34 @@ class CustomTokenObtainPairView(TokenObtainPairView):
                 )
             raise e
 
-        user = serializer.user
+        principal = serializer.principal
 
-        # Check if user's account is frozen (after successful authentication)
-        if user.is_superuser:
-            # Superadmins bypass the frozen check
-            pass
-        elif hasattr(user, 'userprofile') and hasattr(user.userprofile, 'client') and not user.userprofile.client.is_active:
-            return Response(
-                {'error': 'Cuenta congelada. Por favor contacte a su administrador'}, 
-                status=status.HTTP_403_FORBIDDEN
-            )
-        elif hasattr(user, 'client') and not user.client.is_active:
-            return Response(
-                {'error': 'Cuenta congelada. Por favor contacte a soporte'}, 
-                status=status.HTTP_403_FORBIDDEN
-            )
-
-        if user.is_superuser:
-            role = 'superadmin'
-        elif hasattr(user, 'client'):
-            role = 'client'
-        elif hasattr(user, 'userprofile') and user.userprofile.is_admin:
-            role = 'admin'
-        else:
-            role = 'guard'
+        # Check if user's account is frozen (after successful authentication); superadmins bypass it
+        if principal.is_frozen and principal.role != 'superadmin':
+            if principal.role == 'client':
+                message = 'Cuenta congelada. Por favor contacte a soporte'
+            else:
+                message = 'Cuenta congelada. Por favor contacte a su administrador'
+            return Response({'error': message}, status=status.HTTP_403_FORBIDDEN)
 
         return Response({
-            'access': str(serializer.validated_data.get('access')),
-            'refresh': str(serializer.validated_data.get('refresh')),
-            'role': role,
+            'access': serializer.validated_data.get('access'),
+            'refresh': serializer.validated_data.get('refresh'),
+            'role': principal.role,
         }, status=status.HTTP_200_OK)
 
 class ClientViewSet(viewsets.ModelViewSet):
-    queryset = Client.objects.all()
+    queryset = Client.objects.order_by('name', 'id')
     serializer_class = ClientSerializer
+    pagination_class = NameKeysetPagination
     permission_classes = [IsSuperAdmin]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = optimize(queryset, self.get_serializer())
+        return queryset
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def freeze_client(request, pk):
@@ -110,8 +133,10 @@ def freeze_client(request, pk):
             client.is_active = not client.is_active
             client.save()
 
-            # Freeze/unfreeze all associated user accounts
+            # Freeze/unfreeze all associated user accounts; saving the client invalidated their principals
             User.objects.filter(userprofile__client=client).update(is_active=client.is_active)
+            if not client.is_active:
+                revocation_store.revoke_client(client.id)
 
             action = "frozen" if not client.is_active else "activated"
             return Response({
@@ -134,6 +159,11 @@ def api_root(request, format=None):
         'create_route': reverse('create_route', request=request, format=format),
         'assign_guard': reverse('assign_guard', request=request, format=format),
         'daily_report': reverse('daily_report', request=request, format=format),
+        'report': reverse('report', request=request, format=format),
+        'export': reverse('export', request=request, format=format),
+        'report_jobs': reverse('submit_report_job', request=request, format=format),
+        'client_dashboard': reverse('client_dashboard', request=request, format=format),
+        'segment_timings': reverse('segment_timings', request=request, format=format),
         'create_guard': reverse('create_guard', request=request, format=format),
         'list_guards': reverse('list_guards', request=request, format=format),
         'update_guard': 'api/update-guard/{pk}/',
@@ -142,28 +172,33 @@ def api_root(request, format=None):
         'check_role': reverse('check_role', request=request, format=format),
         'create_incident': reverse('create_incident', request=request, format=format),
         'create_occurrence': reverse('create_occurrence', request=request, format=format),
+        'sync': reverse('sync_events', request=request, format=format),
         'clients': reverse('client_list', request=request, format=format),
         'freeze_client': 'api/freeze-client/{pk}/',
         'create_admin': reverse('create_admin', request=request, format=format),
         'list_admins': reverse('list_admins', request=request, format=format),
-        'create_client': reverse('create_client', request=request, format=format)
+        'create_client': reverse('create_client', request=request, format=format),
+        'metrics': reverse('metrics', request=request, format=format),
+        'slow_queries': reverse('slow_queries', request=request, format=format)
     })
 
+@method_decorator(condition(etag_func=conditional.assignment_etag), name='get')
 class GuardAssignmentView(generics.RetrieveAPIView):
+    authentication_classes = CLAIMS_AUTHENTICATION
     permission_classes = [IsAuthenticated]
     serializer_class = OptimizedGuardAssignmentSerializer
 
     def get_object(self):
-        return GuardAssignment.objects.select_related('route', 'guard__userprofile').prefetch_related(
+        return GuardAssignment.objects.select_related('route', 'guard__userprofile__client').prefetch_related(
             'route__checkpoints',
             Prefetch('route_runs', queryset=RouteRun.objects.filter(completed=False).order_by('-start_time'))
-        ).get(guard=self.request.user)
+        ).get(guard_id=self.request.user.id)
 
     def retrieve(self, request, *args, **kwargs):
         try:
-            instance = self.get_object()
-            if not instance.guard.userprofile.client.is_active:
+            if get_principal(request).is_frozen:
                 return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+            instance = self.get_object()
             serializer = self.get_serializer(instance)
             data = serializer.data
             
@@ -186,22 +221,46 @@ class GuardAssignmentView(generics.RetrieveAPIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+def _lock_assignment(guard_id):
+    """Lock the guard's assignment row for the rest of the transaction.
+
+    Every path that starts, advances or completes a run takes this lock first,
+    so concurrent taps from the same guard are serialized and the single active
+    run can be read without further locking.
+    """
+    return GuardAssignment.objects.select_for_update().select_related('route').get(guard_id=guard_id)
+
 @api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
+@idempotent
 def start_route_run(request):
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+
     try:
-        assignment = GuardAssignment.objects.get(guard=request.user)
-        if not assignment.guard.userprofile.client.is_active:
-            return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-        
-        active_run = RouteRun.objects.filter(assignment=assignment, completed=False).first()
-        if active_run:
-            return Response(
-                {'error': 'Ya tienes un recorrido activo sin completar'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        new_run = RouteRun.objects.create(assignment=assignment)
+        with transaction.atomic():
+            assignment = _lock_assignment(request.user.id)
+
+            if RouteRun.objects.filter(assignment=assignment, completed=False).exists():
+                return Response(
+                    {'error': 'Ya tienes un recorrido activo sin completar'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            try:
+                with transaction.atomic():
+                    new_run = RouteRun.objects.create(
+                        assignment=assignment,
+                        expected_total=checkpoint_index.get_route_index(assignment.route).total
+                    )
+            except IntegrityError:
+                # Lost the race against another start on a backend without row locks
+                return Response(
+                    {'error': 'Ya tienes un recorrido activo sin completar'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            rollups.record(assignment, new_run, runs_started=1, checkpoints_expected=new_run.expected_total)
         serializer = AssignmentRouteRunSerializer(new_run)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     except GuardAssignment.DoesNotExist:
@@ -216,26 +275,26 @@ def start_route_run(request):
         )
 
 @api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAdminUser|IsClientUser])
+@condition(etag_func=conditional.daily_report_etag)
 def daily_report(request):
-    date = request.query_params.get('date', timezone.now().date())
     guard_id = request.query_params.get('guard_id')
 
     if not guard_id:
         return Response({'error': 'Se requiere el ID del guardia'}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        guard = User.objects.get(id=guard_id)
+        date = reports.parse_report_date(request.query_params.get('date'))
+    except reports.ReportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        guard = User.objects.select_related('userprofile__client').get(id=guard_id)
         if not guard.userprofile.client.is_active:
             return Response({'error': 'Client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-        
-        route_runs = RouteRun.objects.filter(
-            assignment__guard=guard,
-            start_time__date=date
-        ).select_related('assignment__guard').prefetch_related(
-            Prefetch('checkpoint_scans', queryset=CheckpointScan.objects.order_by('scanned_at')),
-            'incidents'
-        ).order_by('start_time')
+
+        route_runs = reports.report_route_runs(*reports.local_day_bounds(date, date), [guard.id])
 
         run_data = ReportRouteRunSerializer(route_runs, many=True).data
 
@@ -251,66 +310,354 @@ def daily_report(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _report_client(request):
+    """Client a report covers: the caller's own, or ``?client_id=`` for superadmins."""
+    principal = get_principal(request)
+    if request.user.is_superuser:
+        client_id = request.query_params.get('client_id')
+        if not client_id:
+            return None, Response({'error': 'client_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        client = Client.objects.filter(id=client_id).only('id', 'is_active').first() if client_id.isdigit() else None
+        if client is None:
+            return None, Response({'error': 'Invalid client_id'}, status=status.HTTP_404_NOT_FOUND)
+        client_id, client_is_active = client.id, client.is_active
+    else:
+        client_id, client_is_active = principal.client_id, principal.client_is_active
+    if not client_is_active:
+        return None, Response({'error': 'Client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+    return client_id, None
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def report(request):
+    """Runs of several guards over a date range, grouped by guard and local day."""
+    client_id, error = _report_client(request)
+    if error:
+        return error
+
+    guard_ids = request.query_params.get('guard_ids')
+    try:
+        if guard_ids:
+            guard_ids = [int(guard_id) for guard_id in guard_ids.split(',')]
+        date_to = reports.parse_report_date(request.query_params.get('date_to'))
+        date_from = reports.parse_report_date(request.query_params.get('date_from'), default=date_to)
+        return Response(reports.build_report(client_id, date_from, date_to, guard_ids or None))
+    except ValueError as e:
+        message = str(e) if isinstance(e, reports.ReportError) else 'guard_ids debe ser una lista de IDs separados por comas'
+        return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def export(request):
+    """Stream runs, scans, incidents and occurrences of a date range as CSV or NDJSON."""
+    client_id, error = _report_client(request)
+    if error:
+        return error
+
+    # ``format`` is taken by DRF's format suffixes
+    output = request.query_params.get('output', 'csv')
+    if output not in exports.FORMATS:
+        return Response({'error': f'output debe ser uno de: {", ".join(exports.FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_to = reports.parse_report_date(request.query_params.get('date_to'))
+        date_from = reports.parse_report_date(request.query_params.get('date_from'), default=date_to)
+    except reports.ReportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if date_to < date_from:
+        return Response({'error': 'La fecha final debe ser posterior a la fecha inicial'}, status=status.HTTP_400_BAD_REQUEST)
+    if (date_to - date_from).days + 1 > settings.EXPORT_MAX_DAYS:
+        return Response({'error': f'El rango no puede superar {settings.EXPORT_MAX_DAYS} días'}, status=status.HTTP_400_BAD_REQUEST)
+
+    start, end = reports.local_day_bounds(date_from, date_to)
+    response = StreamingHttpResponse(
+        exports.stream_export(output, client_id, start, end), content_type=exports.FORMATS[output]
+    )
+    response['Content-Disposition'] = f'attachment; filename="export-{client_id}-{date_from}-{date_to}.{output}"'
+    return response
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def client_dashboard(request):
+    """Today's KPIs and per-guard status for the caller's client."""
+    client_id, error = _report_client(request)
+    if error:
+        return error
+    try:
+        date = reports.parse_report_date(request.query_params.get('date'))
+    except reports.ReportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(dashboard.get_dashboard(client_id, date))
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def segment_timings(request):
+    """Median, p90 and outliers of the time between consecutive checkpoints, per route."""
+    client_id, error = _report_client(request)
+    if error:
+        return error
+
+    route_id = request.query_params.get('route_id')
+    if route_id and not route_id.isdigit():
+        return Response({'error': 'route_id debe ser numérico'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_to = reports.parse_report_date(request.query_params.get('date_to'))
+        date_from = reports.parse_report_date(request.query_params.get('date_from'), default=date_to)
+    except reports.ReportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if date_to < date_from:
+        return Response({'error': 'La fecha final debe ser posterior a la fecha inicial'}, status=status.HTTP_400_BAD_REQUEST)
+    if (date_to - date_from).days + 1 > settings.ANALYTICS_MAX_DAYS:
+        return Response({'error': f'El rango no puede superar {settings.ANALYTICS_MAX_DAYS} días'}, status=status.HTTP_400_BAD_REQUEST)
+
+    start, end = reports.local_day_bounds(date_from, date_to)
+    return Response({
+        'client_id': client_id,
+        'date_from': date_from,
+        'date_to': date_to,
+        'routes': analytics.segment_timings(client_id, start, end, route_id and int(route_id)),
+    })
+
+@api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def submit_report_job(request):
+    """Queue a report file for ``run_report_worker``; ``jobs.submit`` decides when an identical job is reused."""
+    client_id, error = _report_client(request)
+    if error:
+        return error
+
+    output = request.data.get('output', 'csv')
+    if output not in jobs.RENDERERS:
+        return Response(
+            {'error': f'output debe ser uno de: {", ".join(jobs.RENDERERS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        date_to = reports.parse_report_date(request.data.get('date_to'))
+        date_from = reports.parse_report_date(request.data.get('date_from'), default=date_to)
+        guard_ids = request.data.get('guard_ids') or None
+        if guard_ids is not None:
+            guard_ids = sorted({int(guard_id) for guard_id in guard_ids})
+    except reports.ReportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except (TypeError, ValueError):
+        return Response({'error': 'guard_ids debe ser una lista de IDs'}, status=status.HTTP_400_BAD_REQUEST)
+    if date_to < date_from:
+        return Response({'error': 'La fecha final debe ser posterior a la fecha inicial'}, status=status.HTTP_400_BAD_REQUEST)
+    if (date_to - date_from).days + 1 > settings.EXPORT_MAX_DAYS:
+        return Response({'error': f'El rango no puede superar {settings.EXPORT_MAX_DAYS} días'}, status=status.HTTP_400_BAD_REQUEST)
+
+    params = {'date_from': date_from, 'date_to': date_to, 'guard_ids': guard_ids}
+    job, created = jobs.submit(client_id, request.user.id, params, output)
+    return Response(
+        ReportJobSerializer(job, context={'request': request}).data,
+        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
+    )
+
+def _get_report_job(request, pk):
+    principal = get_principal(request)
+    jobs_qs = ReportJob.objects.all() if request.user.is_superuser else ReportJob.objects.filter(client_id=principal.client_id)
+    return jobs_qs.filter(pk=pk).first()
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def report_job_status(request, pk):
+    job = _get_report_job(request, pk)
+    if job is None:
+        return Response({'error': 'Reporte no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(ReportJobSerializer(job, context={'request': request}).data)
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAdminUser|IsClientUser])
+def download_report_job(request, pk):
+    job = _get_report_job(request, pk)
+    if job is None:
+        return Response({'error': 'Reporte no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    if job.status != ReportJob.DONE:
+        return Response({'error': 'El reporte aún no está listo', 'status': job.status}, status=status.HTTP_409_CONFLICT)
+    if job.expires_at <= timezone.now() or not os.path.exists(job.file_path):
+        return Response({'error': 'El reporte expiró, solicítelo nuevamente'}, status=status.HTTP_410_GONE)
+
+    filename = f'reporte-{job.params["date_from"]}-{job.params["date_to"]}.{job.output}'
+    return FileResponse(
+        open(job.file_path, 'rb'), as_attachment=True, filename=filename, content_type=jobs.CONTENT_TYPES[job.output]
+    )
+
 @api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
+@idempotent
 def scan_checkpoint(request):
     qr_code = request.data.get('qr_code')
     if not qr_code:
         return Response({'error': 'Se requiere el código QR'}, status=status.HTTP_400_BAD_REQUEST)
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
 
     try:
         with transaction.atomic():
-            assignment = GuardAssignment.objects.select_related('route').prefetch_related(
-                Prefetch('route__checkpoints', queryset=Checkpoint.objects.order_by('order')),
-                Prefetch('route_runs', queryset=RouteRun.objects.filter(completed=False), to_attr='active_runs')
-            ).get(guard=request.user)
-
-            if not assignment.guard.userprofile.client.is_active:
-                return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-
-            active_run = assignment.active_runs[0] if assignment.active_runs else None
+            assignment = _lock_assignment(request.user.id)
+            active_run = RouteRun.objects.filter(assignment=assignment, completed=False).first()
             if not active_run:
                 return Response({'error': 'No hay un recorrido activo'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            checkpoint = next((cp for cp in assignment.route.checkpoints.all() if cp.qr_code == qr_code), None)
-            if not checkpoint:
+
+            route_index = checkpoint_index.get_route_index(assignment.route)
+            indexed = route_index.checkpoints.get(qr_code)
+            if not indexed:
                 return Response({'error': 'Código QR no válido para esta ruta'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            last_scan = CheckpointScan.objects.filter(route_run=active_run).order_by('-checkpoint__order').first()
-            expected_order = 1 if not last_scan else last_scan.checkpoint.order + 1
-            
+            checkpoint = Checkpoint(
+                id=indexed.id, route=assignment.route, name=indexed.name, qr_code=qr_code, order=indexed.order
+            )
+
+            expected_order = active_run.expected_order
             if checkpoint.order != expected_order:
                 return Response({
                     'error': f'Orden incorrecto. Se esperaba el punto de control {expected_order}, pero se escaneó el {checkpoint.order}'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            
-            checkpoint_scan, created = CheckpointScan.objects.get_or_create(
-                checkpoint=checkpoint,
-                route_run=active_run,
-                defaults={'scanned_at': timezone.now()}
-            )
-            
-            if not created:
+
+            try:
+                with transaction.atomic():
+                    checkpoint_scan = CheckpointScan.objects.create(
+                        checkpoint=checkpoint, route_run=active_run, scanned_at=timezone.now()
+                    )
+            except IntegrityError:
+                checkpoint_scan = CheckpointScan.objects.get(checkpoint=checkpoint, route_run=active_run)
+                checkpoint_scan.checkpoint = checkpoint
                 return Response({
                     'message': 'Este punto de control ya fue escaneado en este recorrido',
                     'scan_data': AssignmentCheckpointScanSerializer(checkpoint_scan).data
                 }, status=status.HTTP_200_OK)
-            
-            total_checkpoints = assignment.route.checkpoints.count()
-            scanned_checkpoints = active_run.checkpoint_scans.count()
-            
-            if scanned_checkpoints == total_checkpoints:
-                active_run.completed = True
-                active_run.end_time = timezone.now()
-                active_run.save()
-            
+
+            active_run.record_scan(checkpoint.order, checkpoint_scan.scanned_at, route_index.total)
+            rollups.record(
+                assignment, active_run, checkpoints_scanned=1,
+                **(rollups.completion(active_run) if active_run.completed else {})
+            )
+
             serializer = AssignmentCheckpointScanSerializer(checkpoint_scan)
             return Response({
                 'message': 'Punto de control escaneado exitosamente',
                 'scan_data': serializer.data,
                 'run_completed': active_run.completed
             }, status=status.HTTP_201_CREATED)
-            
+
+    except GuardAssignment.DoesNotExist:
+        return Response({'error': 'No tienes una ruta asignada'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+SYNC_MAX_EVENTS = 500
+
+@api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsAuthenticated])
+@idempotent
+def sync_events(request):
+    """Replay a batch of queued offline scans, incidents and occurrences in order.
+
+    Events are validated against the active run once and written with
+    ``bulk_create`` in a single transaction. Each event gets its own result so
+    the app can drop the ones that were stored and surface the ones that failed.
+    """
+    events = request.data.get('events') if isinstance(request.data, dict) else None
+    if not isinstance(events, list) or not events:
+        return Response({'error': 'Se requiere una lista de eventos'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(events) > SYNC_MAX_EVENTS:
+        return Response(
+            {'error': f'Se permiten como máximo {SYNC_MAX_EVENTS} eventos por sincronización'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        with transaction.atomic():
+            assignment = _lock_assignment(request.user.id)
+            active_run = RouteRun.objects.filter(assignment=assignment, completed=False).first()
+            if not active_run:
+                return Response({'error': 'No hay un recorrido activo'}, status=status.HTTP_400_BAD_REQUEST)
+
+            route_index = checkpoint_index.get_route_index(assignment.route)
+            now = timezone.now()
+            results = []
+            created = {'scan': [], 'incident': [], 'occurrence': []}
+
+            for position, event in enumerate(events):
+                result = {'index': position, 'status': 'error'}
+                results.append(result)
+
+                envelope = SyncEventSerializer(data=event)
+                if not envelope.is_valid():
+                    result['error'] = envelope.errors
+                    continue
+                event_type = envelope.validated_data['type']
+                result['type'] = event_type
+                if 'id' in envelope.validated_data:
+                    result['id'] = envelope.validated_data['id']
+                timestamp = min(envelope.validated_data.get('timestamp') or now, now)
+
+                if active_run.completed:
+                    result['error'] = 'No hay un recorrido activo'
+                    continue
+
+                if event_type == 'scan':
+                    indexed = route_index.checkpoints.get(envelope.validated_data['qr_code'])
+                    if not indexed:
+                        result['error'] = 'Código QR no válido para esta ruta'
+                        continue
+                    if indexed.order <= active_run.last_scanned_order:
+                        result['status'] = 'duplicate'
+                        continue
+                    if indexed.order != active_run.expected_order:
+                        result['error'] = (
+                            f'Orden incorrecto. Se esperaba el punto de control {active_run.expected_order}, '
+                            f'pero se escaneó el {indexed.order}'
+                        )
+                        continue
+                    instance = CheckpointScan(checkpoint_id=indexed.id, route_run=active_run, scanned_at=timestamp)
+                    active_run.apply_scan(indexed.order, timestamp, route_index.total)
+                else:
+                    payload_serializer = IncidentSerializer if event_type == 'incident' else OccurrenceSerializer
+                    payload = payload_serializer(data={**event, 'timestamp': timestamp})
+                    if not payload.is_valid():
+                        result['error'] = payload.errors
+                        continue
+                    if event_type == 'incident':
+                        instance = Incident(guard_id=request.user.id, route_run=active_run, **payload.validated_data)
+                    else:
+                        instance = Occurrence(route_run=active_run, **payload.validated_data)
+
+                result['status'] = 'created'
+                created[event_type].append((result, instance))
+
+            for event_type, model in (('scan', CheckpointScan), ('incident', Incident), ('occurrence', Occurrence)):
+                if created[event_type]:
+                    model.objects.bulk_create([instance for _, instance in created[event_type]])
+                    for result, instance in created[event_type]:
+                        result['object_id'] = instance.pk
+
+            if created['scan']:
+                active_run.save(update_fields=RouteRun.PROGRESS_FIELDS)
+            rollups.record(
+                assignment, active_run,
+                checkpoints_scanned=len(created['scan']),
+                incidents=len(created['incident']),
+                occurrences=len(created['occurrence']),
+                **(rollups.completion(active_run) if active_run.completed else {})
+            )
+
+            return Response({
+                'results': results,
+                'run': AssignmentRouteRunSerializer(active_run).data,
+                'run_completed': active_run.completed
+            }, status=status.HTTP_200_OK)
+
     except GuardAssignment.DoesNotExist:
         return Response({'error': 'No tienes una ruta asignada'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
@@ -335,19 +682,19 @@ def create_route(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsSuperAdmin|IsAdminUser|IsClientUser])
+@condition(etag_func=conditional.routes_etag)
 def list_routes(request):
+    principal = get_principal(request)
     if request.user.is_superuser:
         routes = Route.objects.all()
-    elif hasattr(request.user, 'userprofile'):
-        routes = Route.objects.filter(client=request.user.userprofile.client)
-    elif hasattr(request.user, 'client'):
-        routes = Route.objects.filter(client=request.user.client)
+    elif principal.has_profile or principal.role == 'client':
+        routes = Route.objects.filter(client_id=principal.client_id)
     else:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
-    
-    serializer = RouteSerializer(routes, many=True)
-    return Response(serializer.data)
+
+    return paginated_response(request, routes, RouteSerializer, ('name', 'id'))
 
 @api_view(['DELETE'])
 @permission_classes([IsSuperAdmin])
@@ -379,30 +726,27 @@ def assign_guard(request):
         route = Route.objects.get(id=route_id)
         
         # Check if the user is a client or admin and verify permissions
-        if hasattr(request.user, 'client'):
-            client = request.user.client
-        else:
-            client = request.user.userprofile.client
-            
-        if guard.userprofile.client != client:
+        client_id = get_principal(request).client_id
+
+        if guard.userprofile.client_id != client_id:
             return Response({'error': 'No puedes asignar guardias de otros clientes'}, status=status.HTTP_403_FORBIDDEN)
         
-        if route.client != client:
+        if route.client_id != client_id:
             return Response({'error': 'No puedes asignar rutas de otros clientes'}, status=status.HTTP_403_FORBIDDEN)
 
         with transaction.atomic():
-            existing = GuardAssignment.objects.filter(guard=guard).first()
+            existing = GuardAssignment.objects.select_for_update().filter(guard=guard).first()
             if existing and existing.route_id != route.id:
-                for active_run in RouteRun.objects.filter(
-                    assignment=existing, completed=False
-                ):
+                active_run = RouteRun.objects.filter(assignment=existing, completed=False).first()
+                if active_run:
                     active_run.mark_as_completed()
+                    rollups.record(existing, active_run, **rollups.completion(active_run))
 
             assignment, created = GuardAssignment.objects.update_or_create(
                 guard=guard,
                 defaults={'route': route, 'shift': shift}
             )
-        serializer = OptimizedGuardAssignmentSerializer(assignment)
+        serializer = OptimizedGuardAssignmentSerializer(assignment, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     except User.DoesNotExist:
         return Response({'error': 'Usuario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
@@ -412,60 +756,59 @@ def assign_guard(request):
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAdminUser|IsClientUser])
+@condition(etag_func=conditional.guard_assignments_etag)
 def list_guard_assignments(request):
+    principal = get_principal(request)
     if request.user.is_superuser:
         qs = GuardAssignment.objects.all()
-    elif (hasattr(request.user, 'userprofile') and request.user.userprofile.is_admin) or hasattr(
-        request.user, 'client'
-    ):
-        client = request.user.client if hasattr(request.user, 'client') else request.user.userprofile.client
-        if not client:
+    elif principal.is_admin or principal.role == 'client':
+        if not principal.client_id:
             return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
-        qs = GuardAssignment.objects.filter(guard__userprofile__client=client)
+        qs = GuardAssignment.objects.filter(guard__userprofile__client_id=principal.client_id)
     else:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
-    assignments = qs.select_related('route', 'guard').prefetch_related(
-        Prefetch('route_runs', queryset=RouteRun.objects.filter(completed=False), to_attr='active_runs')
-    ).order_by('guard__username')
-    serializer = GuardAssignmentListSerializer(assignments, many=True)
-    return Response(serializer.data)
+    assignments = qs.select_related('route', 'guard')
+    if 'has_active_run' in GuardAssignmentListSerializer(context={'request': request}).fields:
+        assignments = assignments.prefetch_related(
+            Prefetch('route_runs', queryset=RouteRun.objects.filter(completed=False), to_attr='active_runs')
+        )
+    return paginated_response(request, assignments, GuardAssignmentListSerializer, ('guard__username', 'id'))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_guards(request):
     logger.info(f"Listing guards for user: {request.user.username}")
     
+    principal = get_principal(request)
     if request.user.is_superuser:
         guards = User.objects.filter(
             is_staff=False,
             userprofile__is_admin=False
-        ).select_related('userprofile__client')
+        )
         logger.info("Superadmin fetching all guards")
-    elif (hasattr(request.user, 'userprofile') and request.user.userprofile.is_admin) or hasattr(request.user, 'client'):
-        client = request.user.client if hasattr(request.user, 'client') else request.user.userprofile.client
-        logger.info(f"Fetching guards for client: {client.name}")
+    elif principal.is_admin or principal.role == 'client':
+        logger.info(f"Fetching guards for client: {principal.client_id}")
         guards = User.objects.filter(
             is_staff=False,
             userprofile__is_admin=False,
-            userprofile__client=client
-        ).select_related('userprofile__client')
+            userprofile__client_id=principal.client_id
+        )
     else:
         logger.warning(f"Unauthorized access attempt by user: {request.user.username}")
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
-    logger.info(f"Found {guards.count()} guards")
-
-    serializer = UserSerializer(guards, many=True)
-    return Response(serializer.data)
+    return paginated_response(request, guards, UserSerializer, ('username', 'id'))
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_guard(request):
     logger.info(f"Creating guard, requested by user: {request.user.username}")
     
-    if not (hasattr(request.user, 'userprofile') and request.user.userprofile.is_admin) and not hasattr(request.user, 'client'):
+    principal = get_principal(request)
+    if not principal.is_admin and principal.role != 'client':
         logger.warning(f"Unauthorized guard creation attempt by user: {request.user.username}")
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
@@ -483,20 +826,20 @@ def create_guard(request):
                 user.is_staff = False
                 user.save()
                 
-                client = request.user.client if hasattr(request.user, 'client') else request.user.userprofile.client
-                logger.info(f"Associating guard with client: {client.name}")
+                client_id = principal.client_id
+                logger.info(f"Associating guard with client: {client_id}")
                 
                 profile, created = UserProfile.objects.update_or_create(
                     user=user,
                     defaults={
                         'is_admin': False,
-                        'client': client
+                        'client_id': client_id
                     }
                 )
                 
                 # Verify the client association
-                if profile.client != client:
-                    logger.error(f"Failed to associate guard with client. Expected: {client.name}, Got: {profile.client.name if profile.client else 'None'}")
+                if profile.client_id != client_id:
+                    logger.error(f"Failed to associate guard with client. Expected: {client_id}, Got: {profile.client_id}")
                     raise ValueError("Failed to associate guard with the correct client")
                 
                 # Refresh the user object to include the newly created profile
@@ -520,13 +863,7 @@ def delete_guard(request, pk):
     try:
         user = User.objects.get(pk=pk)
         
-        # Get the client based on the user type
-        if hasattr(request.user, 'client'):
-            client = request.user.client
-        else:
-            client = request.user.userprofile.client
-            
-        if user.userprofile.client != client:
+        if user.userprofile.client_id != get_principal(request).client_id:
             return Response({'error': 'No puedes eliminar guardias de otros clientes'}, status=status.HTTP_403_FORBIDDEN)
     except User.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
@@ -535,35 +872,44 @@ def delete_guard(request, pk):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 @api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_incident(request):
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+
     try:
-        active_run = RouteRun.objects.filter(assignment__guard=request.user, completed=False).first()
+        active_run = RouteRun.objects.select_related('assignment').filter(
+            assignment__guard_id=request.user.id, completed=False
+        ).first()
         if not active_run:
             return Response({'error': 'No hay un recorrido activo'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not active_run.assignment.guard.userprofile.client.is_active:
-            return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-        
         serializer = IncidentSerializer(data=request.data)
         if serializer.is_valid():
-            incident = serializer.save(guard=request.user, route_run=active_run)
+            with transaction.atomic():
+                incident = serializer.save(guard_id=request.user.id, route_run=active_run)
+                rollups.record(active_run.assignment, active_run, incidents=1)
             return Response(IncidentSerializer(incident).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
 def end_shift(request):
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+
     try:
-        assignment = GuardAssignment.objects.get(guard=request.user)
-        if not assignment.guard.userprofile.client.is_active:
-            return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-        
-        active_run = RouteRun.objects.filter(assignment=assignment, completed=False).first()
-        if active_run:
-            active_run.mark_as_completed()
+        with transaction.atomic():
+            assignment = _lock_assignment(request.user.id)
+            active_run = RouteRun.objects.filter(assignment=assignment, completed=False).first()
+            if active_run:
+                active_run.mark_as_completed()
+                rollups.record(assignment, active_run, **rollups.completion(active_run))
         
         return Response({"message": "Shift ended successfully"}, status=status.HTTP_200_OK)
     except GuardAssignment.DoesNotExist:
@@ -572,19 +918,10 @@ def end_shift(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
 def check_role(request):
-    user = request.user
-    if user.is_superuser:
-        role = 'superadmin'
-    elif hasattr(user, 'client'):
-        role = 'client'
-    elif hasattr(user, 'userprofile') and user.userprofile.is_admin:
-        role = 'admin'
-    else:
-        role = 'guard'
-    
-    return Response({'role': role})
+    return Response({'role': get_principal(request).role})
 
 @api_view(['POST'])
 @permission_classes([IsSuperAdmin])
@@ -598,7 +935,8 @@ def create_client(request):
 @api_view(['POST'])
 @permission_classes([IsSuperAdmin|IsClientUser])
 def create_admin(request):
-    if not (request.user.is_superuser or hasattr(request.user, 'client')):
+    principal = get_principal(request)
+    if not (request.user.is_superuser or principal.role == 'client'):
         return Response({'error': 'Only super admins and clients can create admins'}, status=status.HTTP_403_FORBIDDEN)
 
     serializer = UserSerializer(data=request.data)
@@ -607,57 +945,61 @@ def create_admin(request):
         user.is_staff = True
         user.save()
         
-        client = None
+        client_id = None
         if request.user.is_superuser:
             client_id = request.data.get('client_id')
             if client_id:
-                try:
-                    client = Client.objects.get(id=client_id)
-                except Client.DoesNotExist:
+                if not Client.objects.filter(id=client_id).exists():
                     return Response({'error': 'Invalid client_id'}, status=status.HTTP_400_BAD_REQUEST)
             else:
                 return Response({'error': 'client_id is required for super admin'}, status=status.HTTP_400_BAD_REQUEST)
         else:
-            client = request.user.client
+            client_id = principal.client_id
 
-        UserProfile.objects.create(user=user, is_admin=True, client=client)
+        UserProfile.objects.create(user=user, is_admin=True, client_id=client_id)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 @permission_classes([IsSuperAdmin|IsClientUser])
 def list_admins(request):
+    principal = get_principal(request)
     if request.user.is_superuser:
         admins = User.objects.filter(
             is_staff=True,
             userprofile__is_admin=True
-        ).select_related('userprofile__client')
-    elif hasattr(request.user, 'client'):
+        )
+    elif principal.role == 'client':
         admins = User.objects.filter(
             is_staff=True,
             userprofile__is_admin=True,
-            userprofile__client=request.user.client
-        ).select_related('userprofile__client')
+            userprofile__client_id=principal.client_id
+        )
     else:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
-    
-    serializer = UserSerializer(admins, many=True)
-    return Response(serializer.data)
+
+    return paginated_response(request, admins, UserSerializer, ('username', 'id'))
 
 @api_view(['POST'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_occurrence(request):
+    if get_principal(request).is_frozen:
+        return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
+
     try:
-        active_run = RouteRun.objects.filter(assignment__guard=request.user, completed=False).first()
+        active_run = RouteRun.objects.select_related('assignment').filter(
+            assignment__guard_id=request.user.id, completed=False
+        ).first()
         if not active_run:
             return Response({'error': 'No hay un recorrido activo'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not active_run.assignment.guard.userprofile.client.is_active:
-            return Response({'error': 'Your client account is frozen'}, status=status.HTTP_403_FORBIDDEN)
-        
         serializer = OccurrenceSerializer(data=request.data)
         if serializer.is_valid():
-            occurrence = serializer.save(route_run=active_run)
+            with transaction.atomic():
+                occurrence = serializer.save(route_run=active_run)
+                rollups.record(active_run.assignment, active_run, occurrences=1)
             return Response(OccurrenceSerializer(occurrence).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
@@ -666,6 +1008,7 @@ def create_occurrence(request):
 @api_view(['DELETE'])
 @permission_classes([IsSuperAdmin|IsClientUser])
 def delete_admin(request, pk):
+    principal = get_principal(request)
     try:
         admin = User.objects.get(pk=pk)
         
@@ -673,9 +1016,9 @@ def delete_admin(request, pk):
         if request.user.is_superuser:
             # Superadmin can delete any admin
             pass
-        elif hasattr(request.user, 'client'):
+        elif principal.role == 'client':
             # Client can only delete admins associated with their client
-            if not hasattr(admin, 'userprofile') or not admin.userprofile.is_admin or admin.userprofile.client != request.user.client:
+            if not hasattr(admin, 'userprofile') or not admin.userprofile.is_admin or admin.userprofile.client_id != principal.client_id:
                 return Response({'error': 'No puedes eliminar administradores de otros clientes'}, 
                                status=status.HTTP_403_FORBIDDEN)
         else:
@@ -693,6 +1036,7 @@ def delete_admin(request, pk):
 @api_view(['PUT', 'PATCH'])
 @permission_classes([IsSuperAdmin|IsClientUser])
 def update_admin(request, pk):
+    principal = get_principal(request)
     try:
         admin = User.objects.get(pk=pk)
         
@@ -700,9 +1044,9 @@ def update_admin(request, pk):
         if request.user.is_superuser:
             # Superadmin can update any admin
             pass
-        elif hasattr(request.user, 'client'):
+        elif principal.role == 'client':
             # Client can only update admins associated with their client
-            if not hasattr(admin, 'userprofile') or not admin.userprofile.is_admin or admin.userprofile.client != request.user.client:
+            if not hasattr(admin, 'userprofile') or not admin.userprofile.is_admin or admin.userprofile.client_id != principal.client_id:
                 return Response({'error': 'No puedes actualizar administradores de otros clientes'}, 
                                status=status.HTTP_403_FORBIDDEN)
         else:
@@ -758,6 +1102,7 @@ def delete_client(request, pk):
 @api_view(['PUT', 'PATCH'])
 @permission_classes([IsSuperAdmin|IsClientUser|IsAdminUser])
 def update_guard(request, pk):
+    principal = get_principal(request)
     try:
         guard = User.objects.get(pk=pk)
         
@@ -765,14 +1110,9 @@ def update_guard(request, pk):
         if request.user.is_superuser:
             # Superadmin can update any guard
             pass
-        elif hasattr(request.user, 'userprofile') and request.user.userprofile.is_admin:
-            # Admin can only update guards associated with their client
-            if not hasattr(guard, 'userprofile') or guard.userprofile.is_admin or guard.userprofile.client != request.user.userprofile.client:
-                return Response({'error': 'No puedes actualizar vigilantes de otros clientes'}, 
-                               status=status.HTTP_403_FORBIDDEN)
-        elif hasattr(request.user, 'client'):
-            # Client can only update guards associated with their client
-            if not hasattr(guard, 'userprofile') or guard.userprofile.is_admin or guard.userprofile.client != request.user.client:
+        elif principal.is_admin or principal.role == 'client':
+            # Admins and clients can only update guards associated with their client
+            if not hasattr(guard, 'userprofile') or guard.userprofile.is_admin or guard.userprofile.client_id != principal.client_id:
                 return Response({'error': 'No puedes actualizar vigilantes de otros clientes'}, 
                                status=status.HTTP_403_FORBIDDEN)
         else:
@@ -848,3 +1188,29 @@ def static_files_debug(request):
         'middleware_order': [m for m in settings.MIDDLEWARE if 'whitenoise' in m.lower() or 'static' in m.lower()],
     })
 
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def metrics_view(request):
+    """Request counts, latency, DB and serializer time per endpoint, across all workers, for Prometheus"""
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+@api_view(['GET'])
+@authentication_classes(CLAIMS_AUTHENTICATION)
+@permission_classes([IsSuperAdmin])
+def slow_queries_view(request):
+    """Recent queries over SLOW_QUERY_THRESHOLD_MS, newest first; ?view= filters by view function"""
+    entries = slow_queries.log.entries()
+    view = request.query_params.get('view')
+    if view:
+        entries = [entry for entry in entries if entry['view'] and entry['view'].endswith(f' in {view}')]
+    try:
+        limit = int(request.query_params.get('limit', 50))
+    except ValueError:
+        return Response({'error': 'limit debe ser numérico'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'threshold_ms': settings.SLOW_QUERY_THRESHOLD_MS,
+        'count': len(entries),
+        'entries': entries[:max(limit, 0)],
+    })
@@ -7,6 +7,11 @@ echo "🚀 Starting application..."
 echo "📦 Running pre-startup tasks..."
 python check_db_and_migrate.py
 
+# Render queued reports outside the request workers. The worker must run here, next to
+# gunicorn: download_report_job serves the files it writes to the local REPORT_JOBS_DIR
+echo "📄 Starting report worker..."
+python manage.py run_report_worker &
+
 # Start Gunicorn
 echo "✅ Starting Gunicorn..."
 exec gunicorn route_monitor.wsgi:application \